@@ -1,5 +1,13 @@
+from datetime import datetime
+
 from django.contrib import admin
-from .models import Category, Transaction, UserGroup, UserGroupMember
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.settings import api_settings
+from .models import Category, Transaction, UserGroup, UserGroupMember, BalanceSnapshot, CategoryRollup, ExportJob, \
+    Tombstone, User
+from .throttling import CostBucket, get_cost_rate, top_consumers
 
 
 # Category админка
@@ -30,3 +38,72 @@ class UserGroupAdmin(admin.ModelAdmin):
 class UserGroupMemberAdmin(admin.ModelAdmin):
     list_display = ('user', 'group', 'role', 'joined_at')  # колонки
     list_filter = ('role', 'group')  # фильтры по роль и группе
+    list_select_related = ('user', 'group')  # __str__ показывает пользователя и группу
+
+
+# BalanceSnapshot админка
+@admin.register(BalanceSnapshot)
+class BalanceSnapshotAdmin(admin.ModelAdmin):
+    list_display = ('user', 'group', 'income', 'expense', 'count', 'updated_at')  # колонки
+    list_filter = ('group',)  # фильтр по группе
+    readonly_fields = ('income', 'expense', 'count', 'updated_at')  # поддерживается автоматически
+
+
+# CategoryRollup админка
+@admin.register(CategoryRollup)
+class CategoryRollupAdmin(admin.ModelAdmin):
+    list_display = ('month', 't_type', 'category', 'user', 'group', 'total', 'count')  # колонки
+    list_filter = ('t_type', 'month')  # фильтры тип, месяц
+    readonly_fields = ('total', 'count')  # поддерживается автоматически
+
+
+# ExportJob админка
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'rows_done', 'rows_total', 'created_at', 'finished_at')  # колонки
+    list_filter = ('status',)  # фильтр по статусу
+    readonly_fields = ('data_version', 'rows_done', 'rows_total', 'error', 'created_at', 'finished_at')  # заполняются задачей
+
+
+# Tombstone админка
+@admin.register(Tombstone)
+class TombstoneAdmin(admin.ModelAdmin):
+    list_display = ('model', 'object_id', 'user', 'group_id', 'deleted_at')  # колонки
+    list_filter = ('model',)  # фильтр по типу объекта
+    fields = readonly_fields = ('model', 'object_id', 'user', 'group_id', 'deleted_at')  # пишутся сигналами
+
+
+# Самые активные пользователи API и экспортов (страница админки без модели)
+def throttle_usage(request):
+    """
+    Show the heaviest API and export users of this process and how full their throttle buckets are.
+    """
+    change_url = f'admin:{User._meta.app_label}_{User._meta.model_name}_change'
+    scopes = []
+    for scope, rate in api_settings.DEFAULT_THROTTLE_RATES.items():
+        if rate is None:
+            continue
+        capacity, duration = get_cost_rate(scope)
+        since, consumers = top_consumers(scope)
+        users = User.objects.in_bulk([int(ident) for ident, counters in consumers if ident.isdigit()])
+        rows = [
+            {
+                'ident': ident,
+                'user': users.get(int(ident)) if ident.isdigit() else None,
+                'user_url': reverse(change_url, args=[ident]) if ident.isdigit() and int(ident) in users else None,
+                'cost': counters['cost'],
+                'requests': counters['requests'],
+                'throttled': counters['throttled'],
+                'last_seen': datetime.fromtimestamp(counters['last_seen'], timezone.get_current_timezone()),
+                'fill': min(100, round(100 * CostBucket(scope, ident, capacity, duration).level() / capacity)),
+            }
+            for ident, counters in consumers
+        ]
+        scopes.append({
+            'name': scope,
+            'rate': rate,
+            'since': datetime.fromtimestamp(since, timezone.get_current_timezone()) if since else None,
+            'rows': rows,
+        })
+    context = {**admin.site.each_context(request), 'title': 'Top API and export consumers', 'scopes': scopes}
+    return TemplateResponse(request, 'admin/finance/throttle_usage.html', context)
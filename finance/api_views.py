@@ -1,20 +1,254 @@
-from rest_framework import generics
-from rest_framework.authentication import TokenAuthentication
+from decimal import Decimal
+
+from django.utils.decorators import method_decorator
+from rest_framework import generics, status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from .authentication import CachedTokenAuthentication, rotate_token, token_expires_at
+from .batch import BATCH_MAX_OPERATIONS, apply_batch
+from .conditional import user_data_condition
+from .forms import SummaryQueryForm, TransactionQueryForm
 from .models import Transaction
-from .serializers import TransactionSerializer
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .reports import SummaryRangeError, summarize
+from .serializers import TransactionSerializer, BalanceSummarySerializer, transaction_rows
+from .services import get_personal_balance, get_group_balances, filter_transactions
+from .sync import SYNC_MAX_PAGE_SIZE, SYNC_PAGE_SIZE, InvalidSyncToken, sync_changes
+from .throttling import CostRateThrottle, count_rows, rows_cost
+
+
+class CostThrottledMixin:
+    """
+    Throttle a view by what its requests cost rather than by how many there are.
+
+    Each response is charged one unit plus one per ROWS_PER_COST_UNIT rows
+    in its data, unless the view sets request.throttle_cost itself.
+    """
+    throttle_classes = [CostRateThrottle]
+    throttle_scope = 'api'
 
+    def finalize_response(self, request, response, *args, **kwargs):
+        """
+        Charge the cost of the response to the buckets that admitted the request.
+        """
+        response = super().finalize_response(request, response, *args, **kwargs)
+        buckets = getattr(request, 'cost_buckets', ())
+        if buckets:
+            cost = getattr(request, 'throttle_cost', None) or rows_cost(count_rows(getattr(response, 'data', None)))
+            for bucket in buckets:
+                bucket.charge(cost)
+        return response
 
-class IncomeListAPI(generics.ListAPIView):
+
+class FastListMixin:
+    """
+    Serve a list endpoint from values_list() rows instead of model instances.
+
+    The output is identical to serializer_class; row_serializer must be a
+    finance.serializers.ValuesSerializer built from it.
+    """
+    row_serializer = None
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def list(self, request, *args, **kwargs):
+        """
+        Return the (paginated) rows of the filtered queryset.
+        """
+        queryset = self.filter_queryset(self.get_queryset()).values_list(*self.row_serializer.columns, named=True)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.row_serializer.serialize(page))
+        return Response(self.row_serializer.serialize(queryset))
+
+
+@method_decorator(user_data_condition, name='get')
+class IncomeListAPI(CostThrottledMixin, FastListMixin, generics.ListAPIView):
     """
     API view to list all income transactions for the authenticated user.
     """
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
     serializer_class = TransactionSerializer
+    row_serializer = transaction_rows
 
     def get_queryset(self):
         """
         Return a queryset of income transactions filtered by the current user.
         """
-        return Transaction.objects.filter(user=self.request.user, t_type='income').order_by('-date')
+        return Transaction.objects.filter(user=self.request.user, t_type='income').order_by('-date', '-id')
+
+
+@method_decorator(user_data_condition, name='get')
+class TransactionListAPI(CostThrottledMixin, FastListMixin, generics.ListAPIView):
+    """
+    API view listing the personal and group transactions of the authenticated user, newest first.
+
+    Accepts the same filters as the exports plus an amount range, and pages
+    with a cursor so deep pages cost the same as the first one.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    serializer_class = TransactionSerializer
+    row_serializer = transaction_rows
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        """
+        Return the user's transactions matching the query parameters.
+        """
+        form = TransactionQueryForm(self.request.query_params, user=self.request.user,
+                                    memberships=self.request.memberships)
+        if not form.is_valid():
+            raise ValidationError(form.errors)
+        return filter_transactions(self.request.user, form.cleaned_data)
+
+
+class TransactionBatchAPI(CostThrottledMixin, APIView):
+    """
+    API view applying up to BATCH_MAX_OPERATIONS transaction creates, updates and deletes at once.
+
+    The body is {"operations": [{"op": "create", "data": {...}},
+    {"op": "update", "id": 1, "data": {...}}, {"op": "delete", "id": 2}]}.
+    Either all operations are applied or, if any is invalid, none is.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Apply the batch and return one result per operation, in request order.
+        """
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list) or not operations:
+            raise ValidationError({'operations': ["Expected a non-empty list of operations."]})
+        if len(operations) > BATCH_MAX_OPERATIONS:
+            raise ValidationError({'operations': [f"At most {BATCH_MAX_OPERATIONS} operations are allowed."]})
+
+        batch = apply_batch(request.user, operations)
+        results = []
+        for result in batch.results:
+            if 'transaction' in result:
+                result = {'status': result['status'], 'transaction': TransactionSerializer(result['transaction']).data}
+            results.append(result)
+        return Response({'results': results}, status=status.HTTP_200_OK if batch.applied else status.HTTP_400_BAD_REQUEST)
+
+
+class SyncAPI(CostThrottledMixin, APIView):
+    """
+    API view returning the transactions, categories and memberships changed since a sync token.
+
+    Without a token everything visible to the user is returned. Each response
+    carries the token for the next request; while has_more is true the
+    client keeps calling with it to fetch the rest of the transactions.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        """
+        Return the next page of changes.
+        """
+        try:
+            page_size = min(int(request.query_params.get('page_size', SYNC_PAGE_SIZE)), SYNC_MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError({'page_size': ["A valid integer is required."]})
+        if page_size < 1:
+            raise ValidationError({'page_size': ["Ensure this value is greater than or equal to 1."]})
+        try:
+            page = sync_changes(request.user, request.query_params.get('token') or None, page_size)
+        except InvalidSyncToken as exc:
+            raise ValidationError({'token': [str(exc)]})
+        return Response({
+            'token': page.token,
+            'has_more': page.has_more,
+            'reset': page.reset,
+            'transactions': page.transactions,
+            'categories': page.categories,
+            'memberships': page.memberships,
+            'deleted': page.deleted,
+        })
+
+
+@method_decorator(user_data_condition, name='get')
+class SummaryAPI(CostThrottledMixin, APIView):
+    """
+    API view returning personal or group totals per day, week, month or year as columnar arrays.
+
+    `by` may be given as category and/or type to split the totals into one
+    series per category and/or type; without a type split totals are net.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    def get(self, request):
+        """
+        Return the bucket labels and one list of totals and counts per series.
+        """
+        form = SummaryQueryForm(request.query_params, memberships=request.memberships)
+        if not form.is_valid():
+            raise ValidationError(form.errors)
+        filters = form.cleaned_data
+        try:
+            summary = summarize(
+                request.user, filters['bucket'], tuple(filters['by']), group=filters['group'],
+                t_type=filters['t_type'] or None, date_from=filters['date_from'], date_to=filters['date_to'],
+            )
+        except SummaryRangeError as exc:
+            raise ValidationError({'bucket': [str(exc)]})
+        cent = Decimal('0.01')
+        for series in summary.series:
+            series['totals'] = [f'{total.quantize(cent):f}' for total in series['totals']]
+        return Response({
+            'bucket': summary.bucket,
+            'source': summary.source,
+            'labels': [label.isoformat() for label in summary.labels],
+            'series': summary.series,
+        })
+
+
+@method_decorator(user_data_condition, name='get')
+class BalanceAPI(CostThrottledMixin, APIView):
+    """
+    API view returning the personal and group balances of the authenticated user.
+    """
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        """
+        Return the same balance summaries that are shown on the dashboard.
+        """
+        return Response({
+            'personal': BalanceSummarySerializer(get_personal_balance(request.user)).data,
+            'groups': [
+                {'id': group.id, 'name': group.name, **BalanceSummarySerializer(summary).data}
+                for group, summary in get_group_balances(request.user)
+            ],
+        })
+
+
+class TokenRotateAPI(CostThrottledMixin, APIView):
+    """
+    API view replacing the authenticated user's token with a new one.
+
+    Also accepts a logged-in browser session, so a user whose token has
+    expired can get a new one.
+    """
+    authentication_classes = [CachedTokenAuthentication, SessionAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        """
+        Delete the current token and return its replacement.
+        """
+        token = rotate_token(request.user)
+        expires_at = token_expires_at(token.created)
+        return Response({'token': token.key, 'expires_at': expires_at.isoformat() if expires_at else None},
+                        status=status.HTTP_201_CREATED)
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class FinanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'finance'
+
+    def ready(self):
+        """
+        Connect the signal handlers that keep denormalized data current and register the system checks.
+        """
+        from . import checks, signals  # noqa: F401
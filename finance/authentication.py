@@ -0,0 +1,95 @@
+"""
+Token authentication that resolves tokens from Django's cache instead of the database.
+
+A token's user is cached for AUTH_TOKEN_CACHE_TIMEOUT seconds under a hash
+of the key, so raw keys never reach the cache backend. Entries are evicted
+by signals when the token is deleted or rotated and when its user is
+saved (e.g. deactivated); the timeout bounds how long a revocation the
+signals cannot see (another process with a local cache, raw SQL) is served.
+Tokens older than AUTH_TOKEN_TTL are rejected and must be rotated.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import User
+
+
+def token_cache_key(key: str) -> str:
+    """
+    Return the cache key of a token without exposing the token itself.
+    """
+    return f'finance:auth-token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def user_token_cache_key(user_id: int) -> str:
+    """
+    Return the cache key remembering which token of a user is cached.
+    """
+    return f'finance:auth-user:{user_id}'
+
+
+def evict_token(key: str) -> None:
+    """
+    Drop a token from the authentication cache.
+    """
+    cache.delete(token_cache_key(key))
+
+
+def evict_user(user_id: int) -> None:
+    """
+    Drop the cached token of a user from the authentication cache.
+    """
+    cached_key = cache.get(user_token_cache_key(user_id))
+    if cached_key:
+        cache.delete_many([cached_key, user_token_cache_key(user_id)])
+
+
+def token_expires_at(token_created):
+    """
+    Return when a token created at the given time expires, or None if tokens do not expire.
+    """
+    ttl = getattr(settings, 'AUTH_TOKEN_TTL', None)
+    return token_created + ttl if ttl else None
+
+
+def rotate_token(user: User) -> Token:
+    """
+    Replace a user's token with a new one; the old key stops working immediately.
+    """
+    with transaction.atomic():
+        Token.objects.filter(user=user).delete()
+        return Token.objects.create(user=user)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that needs no query while a token is cached and rejects expired tokens.
+    """
+
+    def authenticate_credentials(self, key):
+        """
+        Return the (user, token) of a key, from the cache when possible.
+        """
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cached = (user, token)
+            timeout = getattr(settings, 'AUTH_TOKEN_CACHE_TIMEOUT', 300)
+            cache.set_many({cache_key: cached, user_token_cache_key(user.pk): cache_key}, timeout)
+        user, token = cached
+
+        expires_at = token_expires_at(token.created)
+        if expires_at is not None and expires_at <= timezone.now():
+            raise AuthenticationFailed('Token has expired.')
+        if not user.is_active:
+            raise AuthenticationFailed('User inactive or deleted.')
+        return user, token
+
@@ -0,0 +1,174 @@
+"""
+Batch creation, update and deletion of transactions for the API.
+
+A batch is validated as a whole: categories are looked up in the catalog
+TransactionForm offers, the groups and existing transactions it refers to
+are each loaded with one query, and the same rules as TransactionForm are
+applied to every item. If every item is valid
+the batch is written in one database transaction with bulk_create() and
+bulk_update(); otherwise nothing is written.
+"""
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import ledger, suggestions
+from .catalog import user_categories
+from .models import Transaction, User, UserGroup
+from .serializers import BatchOperationSerializer, TransactionWriteSerializer
+from .sync import record_moves
+
+BATCH_MAX_OPERATIONS = 500
+WRITE_FIELDS = ('t_type', 'amount', 'category', 'group', 'description', 'date')
+_ATTRIBUTES = {'category': 'category_id', 'group': 'group_id'}
+
+
+@dataclass
+class BatchResult:
+    """
+    Per-operation results in request order, and whether the batch was applied.
+    """
+    results: list[dict]
+    applied: bool
+
+
+def apply_batch(user: User, operations: list) -> BatchResult:
+    """
+    Validates a list of create/update/delete operations and applies them together.
+    """
+    items, errors = [], []
+    for raw in operations:
+        op_serializer = BatchOperationSerializer(data=raw)
+        if not op_serializer.is_valid():
+            items.append(None)
+            errors.append(op_serializer.errors)
+            continue
+        operation = op_serializer.validated_data
+        if operation['op'] == 'delete':
+            items.append(operation)
+            errors.append(None)
+            continue
+        data_serializer = TransactionWriteSerializer(data=operation['data'], partial=operation['op'] == 'update')
+        if data_serializer.is_valid():
+            items.append({**operation, 'data': data_serializer.validated_data})
+            errors.append(None)
+        else:
+            items.append(None)
+            errors.append({'data': data_serializer.errors})
+
+    with transaction.atomic():
+        existing = _load_references(user, items, errors)
+        if any(errors):
+            return BatchResult(
+                results=[{'status': 'error', 'errors': error} if error else {'status': 'skipped'} for error in errors],
+                applied=False,
+            )
+        return BatchResult(results=_write(user, items, existing), applied=True)
+
+
+def _load_references(user: User, items: list, errors: list) -> dict[int, Transaction]:
+    """
+    Loads everything the batch refers to with one query per table and records reference errors.
+    """
+    target_ids = [item['id'] for item in items if item and item['op'] != 'create']
+    existing = Transaction.objects.select_for_update().filter(user=user).in_bulk(target_ids) if target_ids else {}
+
+    category_ids, group_ids = set(), set()
+    for item in items:
+        if item and 'data' in item:
+            current = existing.get(item.get('id'))
+            category_ids.add(item['data']['category'] if 'category' in item['data'] else current and current.category_id)
+            group_ids.add(item['data'].get('group'))
+    category_ids.discard(None)
+    group_ids.discard(None)
+    # The categories TransactionForm offers: global, own and those of the user's groups.
+    categories = {entry.pk: entry for entry in user_categories(user) if entry.pk in category_ids}
+    groups = set(
+        UserGroup.objects.filter(pk__in=group_ids, members__user=user).values_list('pk', flat=True)
+    ) if group_ids else set()
+
+    seen = set()
+    for index, item in enumerate(items):
+        if item is None:
+            continue
+        if item['op'] != 'create':
+            if item['id'] in seen:
+                errors[index] = {'id': ["This transaction appears more than once in the batch."]}
+            elif item['id'] not in existing:
+                errors[index] = {'id': ["Transaction not found."]}
+            seen.add(item['id'])
+        if item['op'] != 'delete' and not errors[index]:
+            problems = _check_data(item['data'], existing.get(item.get('id')), categories, groups)
+            if problems:
+                errors[index] = {'data': problems}
+    return existing
+
+
+def _check_data(data: dict, current: Transaction | None, categories: dict, groups: set) -> dict:
+    """
+    Applies the TransactionForm rules: a visible category matching the type, and a group the user belongs to.
+    """
+    problems = {}
+    if data.get('category') is not None:
+        if data['category'] not in categories:
+            problems['category'] = ["Category not found."]
+    if 'category' in data or 't_type' in data:
+        category_id = data['category'] if 'category' in data else getattr(current, 'category_id', None)
+        t_type = data.get('t_type') or current.t_type
+        category = categories.get(category_id)
+        if category is not None and 'category' not in problems and category.is_income != (t_type == 'income'):
+            problems['category'] = ["Please select a valid category for the chosen transaction type."]
+    if data.get('group') is not None and data['group'] not in groups:
+        problems['group'] = ["You are not a member of this group."]
+    return problems
+
+
+def _write(user: User, items: list, existing: dict[int, Transaction]) -> list[dict]:
+    created, updated, deleted = [], [], []
+    changed_fields = set()
+    results = []
+    for item in items:
+        values = {_ATTRIBUTES.get(field, field): value for field, value in item.get('data', {}).items()}
+        if item['op'] == 'create':
+            obj = Transaction(user=user, **values)
+            created.append(obj)
+            results.append({'status': 'created', 'transaction': obj})
+        elif item['op'] == 'update':
+            obj = existing[item['id']]
+            for attribute, value in values.items():
+                setattr(obj, attribute, value)
+            changed_fields.update(item['data'])
+            updated.append(obj)
+            results.append({'status': 'updated', 'transaction': obj})
+        else:
+            deleted.append(item['id'])
+            results.append({'status': 'deleted', 'id': item['id']})
+
+    # Bulk writes send no signals, so the ledger deltas are recorded here.
+    with ledger.deferred_ledger():
+        if deleted:
+            # QuerySet.delete() sends post_delete per row, which updates the ledger.
+            Transaction.objects.filter(pk__in=deleted).delete()
+        if created:
+            Transaction.objects.bulk_create(created)
+            ledger.record_many(ledger.entry_for(obj) for obj in created)
+            suggestions.record_many(suggestions.entry_for(obj) for obj in created)
+        if updated:
+            # bulk_update() does not apply auto_now, so the modification time is set explicitly.
+            now = timezone.now()
+            for obj in updated:
+                obj.updated_at = now
+            fields = [field for field in WRITE_FIELDS if field in changed_fields] + ['updated_at']
+            Transaction.objects.bulk_update(updated, fields)
+            moves = []
+            for obj in updated:
+                current = ledger.entry_for(obj)
+                ledger.record_change(obj._ledger_entry, current)
+                moves.append((obj.pk, obj._ledger_entry, current))
+                obj._ledger_entry = current
+                current = suggestions.entry_for(obj)
+                suggestions.record_change(obj._suggestion_entry, current)
+                obj._suggestion_entry = current
+            record_moves(moves)
+    return results
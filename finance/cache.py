@@ -0,0 +1,186 @@
+"""
+Data versions and versioned caching of per-user dashboard data.
+
+Every user, group and the set of global categories has a "data version"
+counter in the cache. Writes bump the counters of the scopes they touch, and
+cached entries embed the versions they were built from, so a changed version
+simply makes old entries unreachable instead of requiring explicit deletes.
+
+Counters start from the current time in nanoseconds, so a counter that was
+evicted and recreated never repeats a value an old entry was keyed on.
+Each counter also has a "modified" timestamp, used for Last-Modified headers.
+"""
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+DASHBOARD_CACHE_TIMEOUT = getattr(settings, 'DASHBOARD_CACHE_TIMEOUT', 600)
+
+GLOBAL_VERSION_KEY = 'finance:version:global'
+
+
+def user_version_key(user_id: int) -> str:
+    """
+    Return the cache key of a user's data version.
+    """
+    return f'finance:version:user:{user_id}'
+
+
+def group_version_key(group_id: int) -> str:
+    """
+    Return the cache key of a group's data version.
+    """
+    return f'finance:version:group:{group_id}'
+
+
+def modified_key(version_key: str) -> str:
+    """
+    Return the cache key of the time a data version was last bumped.
+    """
+    return f'{version_key}:modified'
+
+
+def get_versions(keys: list[str]) -> dict[str, int]:
+    """
+    Read several data versions at once, initializing the missing ones.
+    """
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        for key, value in missing.items():
+            cache.add(key, value, timeout=None)
+        versions.update(cache.get_many(list(missing)))
+    return versions
+
+
+def bump_versions(user_ids=(), group_ids=(), global_categories: bool = False):
+    """
+    Invalidate every cached entry built from the given scopes.
+
+    Inside a database transaction the versions are bumped again after commit,
+    so readers that cached pre-commit data in between are invalidated too.
+    """
+    keys = [user_version_key(pk) for pk in set(user_ids) if pk]
+    keys += [group_version_key(pk) for pk in set(group_ids) if pk]
+    if global_categories:
+        keys.append(GLOBAL_VERSION_KEY)
+    if not keys:
+        return
+    _bump(keys)
+    if connection.in_atomic_block:
+        transaction.on_commit(partial(_bump, keys))
+
+
+def _bump(keys: list[str]):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+    now = time.time()
+    cache.set_many({modified_key(key): now for key in keys}, timeout=None)
+
+
+def get_validators(version_keys: list[str]) -> tuple[str, datetime | None]:
+    """
+    Return an ETag digest and the last modification time of the given scopes, without touching the database.
+
+    A scope whose modification time is unknown (e.g. evicted) counts as modified now.
+    Last-Modified only has a precision of one second, so no modification time
+    is returned until the newest change is a full second old; otherwise a
+    second write within the same second would be answered with 304.
+    """
+    versions = get_versions(version_keys)
+    stamp_keys = [modified_key(key) for key in version_keys]
+    stamps = cache.get_many(stamp_keys)
+    missing = [key for key in stamp_keys if key not in stamps]
+    now = time.time()
+    if missing:
+        for key in missing:
+            cache.add(key, now, timeout=None)
+        stamps.update(cache.get_many(missing))
+    digest = hashlib.sha256('|'.join(f'{key}={versions[key]}' for key in version_keys).encode()).hexdigest()
+    newest = max(stamps.values(), default=now)
+    last_modified = datetime.fromtimestamp(newest, tz=dt_timezone.utc) if now - newest >= 1 else None
+    return digest, last_modified
+
+
+def get_versioned(prefix: str, version_keys: list[str], build, timeout: int = DASHBOARD_CACHE_TIMEOUT):
+    """
+    Return a value cached under the current versions of the given scopes, calling build() on a miss.
+    """
+    versions = get_versions(version_keys)
+    key = ':'.join([prefix, *(str(versions[version_key]) for version_key in version_keys)])
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, timeout)
+    return value
+
+
+class CacheStats:
+    """
+    Process-local hit and miss counters of a cache.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        logger.debug("%s cache %s (hits=%d, misses=%d)", self.name, 'hit' if hit else 'miss', self.hits, self.misses)
+
+    def as_dict(self) -> dict:
+        """
+        Return the counters and the hit ratio.
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'ratio': self.hits / total if total else 0.0}
+
+
+dashboard_stats = CacheStats('dashboard')
+
+
+def get_dashboard_data(user, period: str, load_groups, build) -> tuple[dict, bool]:
+    """
+    Return the cached dashboard data of a user, building it on a miss.
+
+    On a miss load_groups() returns the groups the data depends on and
+    build(groups) computes the data. Returns the data and whether it came
+    from the cache.
+    """
+    versions = get_versions([user_version_key(user.pk), GLOBAL_VERSION_KEY])
+    key = 'finance:dashboard:{}:{}:{}:{}'.format(
+        user.pk, period, versions[user_version_key(user.pk)], versions[GLOBAL_VERSION_KEY]
+    )
+
+    entry = cache.get(key)
+    if entry is not None:
+        group_versions = get_versions(list(entry['group_versions']))
+        if group_versions == entry['group_versions']:
+            dashboard_stats.record(hit=True)
+            return entry['data'], True
+
+    dashboard_stats.record(hit=False)
+    # Versions are read before building so writes made during the build invalidate the new entry.
+    groups = load_groups()
+    group_versions = get_versions([group_version_key(group.pk) for group in groups])
+    data = build(groups)
+    cache.set(key, {'data': data, 'group_versions': group_versions}, DASHBOARD_CACHE_TIMEOUT)
+    return data, False
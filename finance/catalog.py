@@ -0,0 +1,217 @@
+"""
+Process-wide catalog of the categories a user can pick, and an index to search it.
+
+Global categories (no owner) rarely change, so every process keeps them in
+an immutable tuple that is reloaded only when the global data version
+moves. A user's own categories and the categories of each of their groups
+are cached under the matching data versions. Whatever is missing is read
+with a single query, so a page needs no category query while the catalog
+is warm and at most one otherwise.
+
+Each process also keeps a bounded LRU of CategoryIndex objects keyed by the
+versions they were built from, so autocomplete requests are answered from
+memory without reading the catalog from the cache.
+"""
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+
+from .cache import DASHBOARD_CACHE_TIMEOUT, GLOBAL_VERSION_KEY, get_versions, group_version_key, user_version_key
+from .conditional import user_group_ids
+from .models import Category, User
+
+CATALOG_FIELDS = ('pk', 'name', 'is_income', 'icon', 'user_id', 'group_id')
+AUTOCOMPLETE_LIMIT = 20
+AUTOCOMPLETE_MAX_LIMIT = 50
+INDEX_CACHE_SIZE = 1000
+
+_global_catalog = (None, ())
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+_WORD_START = re.compile(r'(?<!\w)\w')
+
+
+class CatalogEntry(NamedTuple):
+    """
+    The fields of a category that forms and views need.
+    """
+    pk: int
+    name: str
+    is_income: bool
+    icon: str
+    user_id: int | None
+    group_id: int | None
+
+    def as_category(self) -> Category:
+        """
+        Return a Category instance for this entry without querying the database.
+        """
+        category = Category(id=self.pk, name=self.name, is_income=self.is_income, icon=self.icon,
+                            user_id=self.user_id, group_id=self.group_id)
+        category._state.adding = False
+        category._state.db = DEFAULT_DB_ALIAS
+        return category
+
+    @property
+    def scope(self) -> str:
+        """
+        Return whether the category is global, shared with a group or personal.
+        """
+        if self.user_id is None:
+            return 'global'
+        return 'group' if self.group_id else 'personal'
+
+
+def _load(categories) -> tuple[CatalogEntry, ...]:
+    return tuple(CatalogEntry(*row) for row in categories.order_by('pk').values_list(*CATALOG_FIELDS))
+
+
+def _catalog_versions(user: User) -> tuple[list[int], dict[str, int]]:
+    group_ids = user_group_ids(user)
+    keys = [GLOBAL_VERSION_KEY, user_version_key(user.pk)] + [group_version_key(pk) for pk in group_ids]
+    return group_ids, get_versions(keys)
+
+
+def _read_catalog(user: User, group_ids: list[int], versions: dict[str, int]) -> list[CatalogEntry]:
+    global _global_catalog
+    own_key = f'finance:categories:user:{user.pk}:{versions[user_version_key(user.pk)]}'
+    group_keys = {pk: f'finance:categories:group:{pk}:{versions[group_version_key(pk)]}' for pk in group_ids}
+    parts = cache.get_many([own_key, *group_keys.values()])
+
+    global_version = versions[GLOBAL_VERSION_KEY]
+    loaded_version, global_entries = _global_catalog
+    missing_groups = [pk for pk, key in group_keys.items() if key not in parts]
+    query = Q()
+    if loaded_version != global_version:
+        query |= Q(user=None)
+    if own_key not in parts:
+        query |= Q(user=user)
+    if missing_groups:
+        query |= Q(group__in=missing_groups)
+    if query:
+        entries = _load(Category.objects.filter(query))
+        if loaded_version != global_version:
+            global_entries = tuple(entry for entry in entries if entry.user_id is None)
+            _global_catalog = (global_version, global_entries)
+        fresh = {group_keys[pk]: tuple(entry for entry in entries if entry.group_id == pk) for pk in missing_groups}
+        if own_key not in parts:
+            fresh[own_key] = tuple(entry for entry in entries if entry.user_id == user.pk)
+        cache.set_many(fresh, DASHBOARD_CACHE_TIMEOUT)
+        parts.update(fresh)
+
+    merged = {entry.pk: entry for entry in global_entries}
+    for part in parts.values():
+        merged.update((entry.pk, entry) for entry in part)
+    return sorted(merged.values())
+
+
+def user_categories(user: User) -> list[CatalogEntry]:
+    """
+    Return the global, own and group categories of a user, in creation order.
+    """
+    return _read_catalog(user, *_catalog_versions(user))
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+
+def _one_edit_apart(a: str, b: str) -> bool:
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            swapped = len(a) == len(b) and a[i + 1:i + 2] == y and b[i + 1:i + 2] == x and a[i + 2:] == b[i + 2:]
+            return a[i + 1:] == b[i + 1:] or a[i:] == b[i + 1:] or swapped
+    return True
+
+
+class CategoryIndex:
+    """
+    Immutable in-memory index for prefix and fuzzy searches over category names.
+
+    Every word of a name starts a key running to the end of the name, so
+    "fuel" finds "Gas/Fuel". Keys are sorted and searched with bisect.
+    """
+
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        self.names = tuple(_normalize(entry.name) for entry in self.entries)
+        keys = sorted(
+            (name[match.start():], position)
+            for position, name in enumerate(self.names)
+            for match in _WORD_START.finditer(name)
+        )
+        self.keys = [key for key, position in keys]
+        self.positions = [position for key, position in keys]
+        self.alphabetical = sorted(range(len(self.entries)), key=lambda position: self.names[position])
+
+    def search(self, query: str, is_income: bool | None = None, limit: int = AUTOCOMPLETE_LIMIT) -> list[CatalogEntry]:
+        """
+        Return up to limit categories matching query, best matches first.
+
+        Names starting with the query rank first, then names with a word
+        starting with it. When these do not fill the limit, names containing
+        the query and names with a word one typo away from it follow. An
+        empty query lists categories alphabetically.
+        """
+        def wanted(position):
+            return is_income is None or self.entries[position].is_income == is_income
+
+        query = _normalize(query)
+        if not query:
+            return [self.entries[position] for position in self.alphabetical if wanted(position)][:limit]
+
+        ranks = {}
+        index = bisect_left(self.keys, query)
+        while index < len(self.keys) and self.keys[index].startswith(query):
+            position = self.positions[index]
+            if wanted(position):
+                rank = 0 if self.keys[index] == self.names[position] else 1
+                ranks[position] = min(rank, ranks.get(position, rank))
+            index += 1
+
+        if len(ranks) < limit:
+            size = len(query)
+            for position, name in enumerate(self.names):
+                if position in ranks or not wanted(position):
+                    continue
+                if query in name:
+                    ranks[position] = 2
+                elif size >= 3 and any(
+                    _one_edit_apart(query, name[match.start():match.start() + length])
+                    for match in _WORD_START.finditer(name)
+                    for length in (size - 1, size, size + 1)
+                ):
+                    ranks[position] = 3
+
+        best = sorted(ranks, key=lambda position: (ranks[position], self.names[position]))
+        return [self.entries[position] for position in best[:limit]]
+
+
+def category_index(user: User) -> CategoryIndex:
+    """
+    Return the search index of a user's categories, rebuilt only when one of its data versions moved.
+    """
+    group_ids, versions = _catalog_versions(user)
+    signature = tuple(sorted(versions.items()))
+    with _indexes_lock:
+        cached = _indexes.get(user.pk)
+        if cached is not None and cached[0] == signature:
+            _indexes.move_to_end(user.pk)
+            return cached[1]
+    index = CategoryIndex(_read_catalog(user, group_ids, versions))
+    with _indexes_lock:
+        _indexes[user.pk] = (signature, index)
+        _indexes.move_to_end(user.pk)
+        while len(_indexes) > INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
@@ -0,0 +1,29 @@
+"""
+System checks for deployment settings the finance app depends on.
+"""
+from django.conf import settings
+from django.core.checks import Error, register
+
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Require a cache shared by all worker processes when more than one serves requests.
+
+    Cached dashboards, conditional GET validators, export artifacts and the
+    category catalog are invalidated by bumping data versions in the default
+    cache. In a process-local cache a write handled by one worker would never
+    invalidate the others.
+    """
+    workers = getattr(settings, 'WEB_CONCURRENCY', 1)
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if workers > 1 and backend in PROCESS_LOCAL_CACHES:
+        return [Error(
+            f"WEB_CONCURRENCY is {workers} but the default cache ({backend}) is local to each process.",
+            hint="Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by all workers, "
+                 "e.g. FileBasedCache on one host or RedisCache.",
+            id='finance.E001',
+        )]
+    return []
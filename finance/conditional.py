@@ -0,0 +1,78 @@
+"""
+Conditional GET (ETag / Last-Modified) for views that show a user's own data.
+
+Validators come from the data versions in finance.cache, so a request that
+can be answered with 304 Not Modified needs no database query beyond
+authentication and nothing is rendered or serialized for it. The ETag also
+covers what HTML pages show besides the data: the CSRF token and the
+profile in the header.
+"""
+import hashlib
+from functools import wraps
+
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .cache import GLOBAL_VERSION_KEY, get_validators, get_versioned, group_version_key, user_version_key
+from .models import User, UserGroupMember
+
+
+def user_group_ids(user: User) -> list[int]:
+    """
+    Return the ids of a user's groups for building cache keys, cached under the user's version.
+
+    Access checks must not use this; see finance.memberships.
+    """
+    return get_versioned(
+        f'finance:user-groups:{user.pk}',
+        [user_version_key(user.pk)],
+        lambda: list(UserGroupMember.objects.filter(user=user).order_by('group_id').values_list('group_id', flat=True)),
+    )
+
+
+def user_scope_version_keys(user: User) -> list[str]:
+    """
+    Return the data version keys of everything a user can see: their own data, their groups and global categories.
+    """
+    group_ids = user_group_ids(user)
+    return [user_version_key(user.pk), GLOBAL_VERSION_KEY] + [group_version_key(pk) for pk in group_ids]
+
+
+def _validators(request):
+    validators = getattr(request, '_finance_validators', None)
+    if validators is None:
+        digest, last_modified = get_validators(user_scope_version_keys(request.user))
+        get_token(request)  # Creates the CSRF secret now if the page would create it while rendering.
+        # The same data renders differently per user, URL (filters, cursor) and negotiated format. HTML pages
+        # also embed the CSRF token (rotated on login) and the profile shown in the header.
+        avatar = getattr(request.user, 'avatar', None)
+        variant = '|'.join([
+            str(request.user.pk), digest, request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''), request.META.get('HTTP_ACCEPT_LANGUAGE', ''),
+            request.META['CSRF_COOKIE'], request.user.get_username(),
+            avatar.name if avatar else '',
+        ])
+        validators = (hashlib.sha256(variant.encode()).hexdigest(), last_modified)
+        request._finance_validators = validators
+    return validators
+
+
+def user_data_condition(view_func):
+    """
+    Answer conditional GETs of a view showing the requesting user's data with 304 while that data is unchanged.
+
+    Responses are marked private and must be revalidated, so browsers keep
+    them but always ask first.
+    """
+    conditional = condition(
+        etag_func=lambda request, *args, **kwargs: _validators(request)[0],
+        last_modified_func=lambda request, *args, **kwargs: _validators(request)[1],
+    )(view_func)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        response = conditional(request, *args, **kwargs)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    return wrapper
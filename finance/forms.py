@@ -1,12 +1,55 @@
 from django import forms
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.urls import reverse_lazy
+from finance.catalog import user_categories
 from finance.models import Transaction, Category, UserGroup, UserGroupMember, Invitation
+from finance.reports import BUCKET_CHOICES, BUCKET_DAYS, SPLIT_CHOICES, SUMMARY_LAST_DATE, SUMMARY_MAX_BUCKETS
 
 User = get_user_model()
 
 
+def member_groups(memberships):
+    # Group choices come from request.memberships, so no membership join runs per form.
+    return UserGroup.objects.filter(pk__in=memberships.group_ids)
+
+
+class AutocompleteSelect(forms.Select):
+    # Renders only the empty and the selected options; the page script loads the rest from data-autocomplete-url.
+    def __init__(self, attrs=None):
+        super().__init__({'data-autocomplete-url': reverse_lazy('category_autocomplete'), **(attrs or {})})
+
+    def optgroups(self, name, value, attrs=None):
+        all_choices = self.choices
+        selected = {str(item) for item in value}
+        self.choices = [choice for choice in all_choices if choice[0] in ('', None) or str(choice[0]) in selected]
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = all_choices
+
+
+class CatalogCategoryField(forms.ModelChoiceField):
+    # Choices and cleaned values come from finance.catalog instead of a queryset, so no query is needed.
+    def __init__(self, *args, **kwargs):
+        super().__init__(Category.objects.none(), *args, **kwargs)
+        self.entries = {}
+
+    def set_entries(self, entries):
+        self.entries = {str(entry.pk): entry for entry in entries}
+        choices = [(entry.pk, entry.name) for entry in entries]
+        self.choices = [('', self.empty_label)] + choices if self.empty_label is not None else choices
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        key = str(value.pk if isinstance(value, Category) else value)
+        if key not in self.entries:
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return self.entries[key].as_category()
+
+
 class TransactionForm(forms.ModelForm):
+    category = CatalogCategoryField(required=False, widget=AutocompleteSelect)
     group = forms.ModelChoiceField(
         queryset=UserGroup.objects.none(),
         required=False,
@@ -19,13 +62,12 @@ class TransactionForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user')
+        memberships = kwargs.pop('memberships')
         super().__init__(*args, **kwargs)
 
-        # Filter categories to show user's own categories AND global categories
-        self.fields['category'].queryset = Category.objects.filter(
-            Q(user=user) | Q(user=None)
-        )
-        self.fields['group'].queryset = UserGroup.objects.filter(members__user=user)
+        # Accept the user's own, group AND global categories; the widget fetches them on demand
+        self.fields['category'].set_entries(user_categories(user))
+        self.fields['group'].queryset = member_groups(memberships)
 
     def clean(self):
         cleaned_data = super().clean()
@@ -72,15 +114,101 @@ class InvitationForm(forms.Form):
 
 
 class TransactionFilterForm(forms.Form):
-    category = forms.ModelChoiceField(
-        queryset=Category.objects.none(),
+    category = CatalogCategoryField(
         required=False,
-        label="Filter by Category"
+        label="Filter by Category",
+        widget=AutocompleteSelect
     )
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user')
         super().__init__(*args, **kwargs)
-        self.fields['category'].queryset = Category.objects.filter(
-            Q(user=user) | Q(user=None)
-        )
+        self.fields['category'].set_entries(user_categories(user))
+
+
+class TransactionQueryForm(forms.Form):
+    SCOPE_CHOICES = (
+        ('all', 'Personal and group'),
+        ('personal', 'Personal only'),
+        ('group', 'Group only'),
+    )
+
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    t_type = forms.ChoiceField(choices=(('', 'Any'),) + Transaction.TYPE_CHOICES, required=False)
+    category = CatalogCategoryField(required=False)
+    amount_min = forms.DecimalField(max_digits=10, decimal_places=2, required=False)
+    amount_max = forms.DecimalField(max_digits=10, decimal_places=2, required=False)
+    scope = forms.ChoiceField(choices=SCOPE_CHOICES, required=False)
+    group = forms.ModelChoiceField(queryset=UserGroup.objects.none(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user')
+        memberships = kwargs.pop('memberships')
+        super().__init__(*args, **kwargs)
+        self.fields['category'].set_entries(user_categories(user))
+        self.fields['group'].queryset = member_groups(memberships)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            self.add_error('date_to', "The end date must not be before the start date.")
+        amount_min = cleaned_data.get('amount_min')
+        amount_max = cleaned_data.get('amount_max')
+        if amount_min is not None and amount_max is not None and amount_min > amount_max:
+            self.add_error('amount_max', "The maximum amount must not be below the minimum amount.")
+        if cleaned_data.get('group') and cleaned_data.get('scope') == 'personal':
+            self.add_error('group', "A group cannot be selected together with the personal scope.")
+        return cleaned_data
+
+
+class SummaryQueryForm(forms.Form):
+    bucket = forms.ChoiceField(choices=BUCKET_CHOICES, required=False)
+    by = forms.MultipleChoiceField(choices=SPLIT_CHOICES, required=False)
+    t_type = forms.ChoiceField(choices=(('', 'Any'),) + Transaction.TYPE_CHOICES, required=False)
+    date_from = forms.DateField(required=False)
+    date_to = forms.DateField(required=False)
+    group = forms.ModelChoiceField(queryset=UserGroup.objects.none(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        memberships = kwargs.pop('memberships')
+        super().__init__(*args, **kwargs)
+        self.fields['group'].queryset = member_groups(memberships)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        cleaned_data['bucket'] = cleaned_data.get('bucket') or 'month'
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        for name in ('date_from', 'date_to'):
+            if cleaned_data.get(name) and cleaned_data[name] > SUMMARY_LAST_DATE:
+                self.add_error(name, f"Dates must not be after {SUMMARY_LAST_DATE.isoformat()}.")
+                return cleaned_data
+        if date_from and date_to:
+            if date_from > date_to:
+                self.add_error('date_to', "The end date must not be before the start date.")
+            elif (date_to - date_from).days // BUCKET_DAYS[cleaned_data['bucket']] > SUMMARY_MAX_BUCKETS:
+                self.add_error('bucket', "Too many buckets for this date range, choose a larger bucket.")
+        return cleaned_data
+
+
+class TransactionImportForm(forms.Form):
+    file = forms.FileField(help_text="CSV or Excel (.xlsx) file, or an OFX/QFX/QIF bank statement.")
+    group = forms.ModelChoiceField(
+        queryset=UserGroup.objects.none(),
+        required=False,
+        empty_label="Personal Transactions (no group)"
+    )
+
+    def __init__(self, *args, **kwargs):
+        memberships = kwargs.pop('memberships')
+        super().__init__(*args, **kwargs)
+        self.fields['group'].queryset = member_groups(memberships)
+
+    def clean_file(self):
+        uploaded = self.cleaned_data['file']
+        if not uploaded.name.lower().endswith(('.csv', '.xlsx', '.ofx', '.qfx', '.qif')):
+            raise forms.ValidationError("Only .csv, .xlsx, .ofx, .qfx and .qif files can be imported.")
+        return uploaded
@@ -0,0 +1,506 @@
+"""
+Bulk import of transactions from CSV and Excel files and OFX/QIF bank statements.
+
+Files are read as a stream of rows. Each row is validated against an
+in-memory map of the user's categories, and valid rows are inserted with
+bulk_create in fixed-size batches. Every batch and its ledger changes are
+written in one database transaction. Invalid rows are skipped and reported
+with their row number. A file that turns out to be unreadable part way
+through raises ImportInterrupted, which carries the result of the batches
+already written.
+
+Rows without a category get the one suggested by finance.suggestions when
+the suggestion is confident enough.
+
+Statement lines also get a fingerprint stored in the unique
+Transaction.fingerprint column. Lines whose fingerprint already exists are
+skipped, so overlapping statements can be imported repeatedly.
+"""
+import csv
+import hashlib
+import io
+import re
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime, time
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple
+
+from django.db import IntegrityError
+from django.utils import timezone
+from openpyxl import load_workbook
+
+from . import ledger, suggestions
+from .catalog import user_categories
+from .models import Transaction, User, UserGroup
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_MAX_ERRORS = 100
+IMPORT_MAX_AMOUNT = Decimal('100000000')  # Transaction.amount has 8 integer digits.
+
+# Header aliases, so files produced by the Excel and CSV exports can be imported back.
+COLUMN_ALIASES = {
+    'type': 't_type',
+    't_type': 't_type',
+    'amount': 'amount',
+    'category': 'category',
+    'description': 'description',
+    'date': 'date',
+}
+REQUIRED_COLUMNS = ('t_type', 'amount')
+
+TYPE_ALIASES = {
+    value.casefold(): key
+    for key, label in Transaction.TYPE_CHOICES
+    for value in (key, label)
+}
+
+
+class ImportFormatError(ValueError):
+    """
+    Raised when a file cannot be imported at all, e.g. because of a missing column.
+    """
+
+
+class ImportInterrupted(ImportFormatError):
+    """
+    Raised when a file becomes unreadable after some of its rows may have been imported.
+    """
+
+    def __init__(self, message: str, result: 'ImportResult'):
+        super().__init__(message)
+        self.result = result
+
+
+class RowError(ValueError):
+    """
+    Raised when a single row is invalid.
+    """
+
+
+class StatementLine(NamedTuple):
+    """
+    A transaction read from a bank statement; negative amounts are debits.
+    """
+    row_number: int
+    date: datetime | None
+    amount: str
+    payee: str
+    memo: str
+    category: str
+    fitid: str
+    account: str
+
+
+@dataclass
+class ImportResult:
+    """
+    Outcome of an import: counts of created, duplicate, rejected and auto-categorized rows and the first row errors.
+    """
+    created: int = 0
+    skipped: int = 0
+    failed: int = 0
+    suggested: int = 0
+    errors: list[tuple[int, str]] = field(default_factory=list)
+
+    def add_error(self, row_number: int, message: str):
+        self.failed += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append((row_number, message))
+
+
+def iter_csv_rows(fileobj):
+    """
+    Yields the rows of a CSV file, decoding it as UTF-8 with an optional BOM.
+    """
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()
+
+
+def iter_xlsx_rows(fileobj):
+    """
+    Yields the rows of the first sheet of an Excel workbook, opened in read-only mode.
+    """
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def load_category_map(user: User) -> dict:
+    """
+    Returns the user's and global categories keyed by (case-folded name, is_income).
+
+    A user's own category wins over a global category of the same name.
+    """
+    mapping = {}
+    for entry in user_categories(user):
+        key = (entry.name.strip().casefold(), entry.is_income)
+        if entry.user_id is not None or key not in mapping:
+            mapping[key] = entry.pk
+    return mapping
+
+
+def import_transactions(user: User, rows, group: UserGroup | None = None, batch_size: int | None = None) -> ImportResult:
+    """
+    Imports transactions from an iterable of rows whose first row is the header.
+
+    All rows are added to the user's personal transactions, or to the given group.
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    rows = iter(rows)
+    columns = _read_header(next(rows, None))
+    categories = load_category_map(user)
+    suggest = suggestions.confident_suggester(user, group)
+    group_id = group.pk if group else None
+    result = ImportResult()
+    batch = []
+
+    with _interruptible(result):
+        for row_number, row in enumerate(rows, start=2):
+            if not any(value not in (None, '') for value in row):
+                continue
+            try:
+                values = _clean_row(row, columns, categories)
+            except RowError as exc:
+                result.add_error(row_number, str(exc))
+                continue
+            _suggest_category(values, suggest, result)
+            batch.append(Transaction(user_id=user.pk, group_id=group_id, **values))
+            if len(batch) >= batch_size:
+                result.created += _write_batch(batch)
+                batch = []
+
+    if batch:
+        result.created += _write_batch(batch)
+    return result
+
+
+@contextmanager
+def _interruptible(result: ImportResult):
+    # Rows are read lazily, so a broken file can fail after earlier batches were committed.
+    try:
+        yield
+    except (UnicodeDecodeError, csv.Error) as exc:
+        raise ImportInterrupted(str(exc), result) from exc
+
+
+def _write_batch(batch: list[Transaction]) -> int:
+    # bulk_create() sends no signals, so the ledger is updated here in the same transaction.
+    with ledger.deferred_ledger():
+        Transaction.objects.bulk_create(batch)
+        ledger.record_many(ledger.entry_for(obj) for obj in batch)
+        suggestions.record_many(suggestions.entry_for(obj) for obj in batch)
+    return len(batch)
+
+
+def _suggest_category(values: dict, suggest, result: ImportResult):
+    if values['category_id'] is None and values['description']:
+        values['category_id'] = suggest(values['description'], values['t_type'])
+        result.suggested += values['category_id'] is not None
+
+
+def _read_header(header) -> dict[str, int]:
+    if header is None:
+        raise ImportFormatError("The file is empty.")
+    columns = {}
+    for index, name in enumerate(header):
+        column = COLUMN_ALIASES.get(str(name or '').strip().casefold())
+        if column and column not in columns:
+            columns[column] = index
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ImportFormatError(
+            "Missing required columns: {}.".format(', '.join('type' if name == 't_type' else name for name in missing))
+        )
+    return columns
+
+
+def _clean_row(row, columns: dict[str, int], categories: dict) -> dict:
+    def cell(name):
+        index = columns.get(name)
+        if index is None or index >= len(row):
+            return None
+        value = row[index]
+        return value.strip() if isinstance(value, str) else value
+
+    t_type = TYPE_ALIASES.get(str(cell('t_type') or '').casefold())
+    if t_type is None:
+        raise RowError("Type must be 'income' or 'expense'.")
+
+    values = {
+        't_type': t_type,
+        'amount': _clean_amount(cell('amount')),
+        'category_id': None,
+        'description': str(cell('description') or ''),
+    }
+
+    category = cell('category')
+    if category not in (None, ''):
+        key = (str(category).casefold(), t_type == 'income')
+        if key not in categories:
+            if (key[0], not key[1]) in categories:
+                raise RowError(f"Category '{category}' does not match the transaction type.")
+            raise RowError(f"Unknown category '{category}'.")
+        values['category_id'] = categories[key]
+
+    moment = _clean_date(cell('date'))
+    if moment is not None:
+        values['date'] = moment
+    return values
+
+
+def _clean_amount(value) -> Decimal:
+    if value in (None, ''):
+        raise RowError("Amount is required.")
+    try:
+        amount = Decimal(value.replace(',', '.').replace(' ', '') if isinstance(value, str) else str(value))
+    except InvalidOperation:
+        raise RowError(f"Invalid amount '{value}'.")
+    if not amount.is_finite() or amount <= 0:
+        raise RowError("Amount must be a positive number.")
+    if amount >= IMPORT_MAX_AMOUNT:
+        raise RowError("Amount is too large.")
+    if amount != amount.quantize(Decimal('0.01')):
+        raise RowError("Amount must have at most two decimal places.")
+    return amount.quantize(Decimal('0.01'))
+
+
+def _clean_date(value) -> datetime | None:
+    if value in (None, ''):
+        return None
+    if isinstance(value, datetime):
+        moment = value
+    elif isinstance(value, date):
+        moment = datetime.combine(value, time.min)
+    else:
+        try:
+            moment = datetime.fromisoformat(str(value))
+        except ValueError:
+            raise RowError(f"Invalid date '{value}', expected YYYY-MM-DD.")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def _decode_stream(fileobj, default: str = 'utf-8'):
+    """
+    Wraps a binary statement file as text, honouring an OFX 1.x CHARSET header.
+    """
+    head = fileobj.read(1024)
+    fileobj.seek(0)
+    encoding = default
+    if re.search(rb'CHARSET:\s*(?:1252|WINDOWS-1252)', head, re.IGNORECASE):
+        encoding = 'cp1252'
+    return io.TextIOWrapper(fileobj, encoding=encoding, errors='replace', newline=None)
+
+
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<\r\n]*)')
+
+
+def iter_ofx_lines(fileobj):
+    """
+    Yields the transactions of an OFX/QFX file, in SGML (1.x) or XML (2.x) syntax.
+
+    The file is scanned tag by tag, so statements covering many years are
+    read without building a document tree.
+    """
+    text = _decode_stream(fileobj)
+    account = ''
+    current = None
+    try:
+        for line_number, line in enumerate(text, start=1):
+            for closing, tag, value in OFX_TAG.findall(line):
+                tag = tag.upper()
+                value = value.strip()
+                if tag == 'STMTTRN':
+                    if closing and current is not None:
+                        yield _ofx_line(current, account)
+                        current = None
+                    elif not closing:
+                        current = {'row_number': line_number}
+                elif closing:
+                    continue
+                elif tag == 'ACCTID':
+                    account = value
+                elif current is not None:
+                    current[tag] = value
+    finally:
+        text.detach()
+
+
+def _ofx_line(fields: dict, account: str) -> StatementLine:
+    posted = fields.get('DTPOSTED', '')
+    digits = re.match(r'\d{8}(?:\d{6})?', posted)
+    moment = None
+    if digits:
+        try:
+            moment = datetime.strptime(digits.group(), '%Y%m%d%H%M%S' if len(digits.group()) == 14 else '%Y%m%d')
+        except ValueError:
+            moment = None
+    return StatementLine(
+        row_number=fields['row_number'],
+        date=moment,
+        amount=fields.get('TRNAMT', ''),
+        payee=fields.get('NAME', '') or fields.get('PAYEE', ''),
+        memo=fields.get('MEMO', ''),
+        category='',
+        fitid=fields.get('FITID', ''),
+        account=account,
+    )
+
+
+def iter_qif_lines(fileobj):
+    """
+    Yields the transactions of a QIF file; records are terminated by a "^" line.
+    """
+    text = _decode_stream(fileobj)
+    fields = {}
+    start = None
+    try:
+        for line_number, line in enumerate(text, start=1):
+            line = line.strip()
+            if not line or line.startswith('!'):
+                continue
+            if line == '^':
+                if fields:
+                    yield _qif_line(fields, start)
+                fields, start = {}, None
+                continue
+            if start is None:
+                start = line_number
+            code, value = line[0], line[1:].strip()
+            if code not in fields:
+                fields[code] = value
+        if fields:
+            yield _qif_line(fields, start)
+    finally:
+        text.detach()
+
+
+def _qif_line(fields: dict, row_number: int) -> StatementLine:
+    try:
+        moment = _parse_qif_date(fields.get('D', ''))
+    except ValueError:
+        moment = None
+    return StatementLine(
+        row_number=row_number,
+        date=moment,
+        amount=fields.get('T', fields.get('U', '')),
+        payee=fields.get('P', ''),
+        memo=fields.get('M', ''),
+        category=fields.get('L', ''),
+        fitid='',
+        account='',
+    )
+
+
+def _parse_qif_date(value: str) -> datetime:
+    """
+    Parses QIF dates: MM/DD/YYYY, MM/DD'YY, DD.MM.YYYY or YYYY-MM-DD.
+    """
+    value = value.replace("'", '/').replace(' ', '')
+    if re.fullmatch(r'\d{4}-\d{1,2}-\d{1,2}', value):
+        return datetime.strptime(value, '%Y-%m-%d')
+    parts = re.split(r'[/.-]', value)
+    if len(parts) != 3 or not all(part.isdigit() for part in parts):
+        raise ValueError(value)
+    if '.' in value:
+        day, month, year = map(int, parts)
+    else:
+        month, day, year = map(int, parts)
+    if year < 100:
+        year += 2000 if year < 70 else 1900
+    return datetime(year, month, day)
+
+
+def statement_fingerprint(scope: str, line: StatementLine, t_type: str, amount: Decimal, occurrence: int) -> str:
+    """
+    Returns the deduplication fingerprint of a statement line within a user's or group's transactions.
+
+    Lines with a bank transaction id (FITID) are identified by it; other
+    lines by their content and how many identical lines precede them in the file.
+    """
+    if line.fitid:
+        raw = f'{scope}|fitid|{line.account}|{line.fitid}'
+    else:
+        raw = f'{scope}|line|{line.date:%Y-%m-%d}|{t_type}|{amount}|{line.payee}|{line.memo}|{occurrence}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def import_statement(user: User, lines, group: UserGroup | None = None, batch_size: int | None = None) -> ImportResult:
+    """
+    Imports the lines of a bank statement, skipping lines imported before.
+
+    Debits become expenses and credits incomes. Each batch is checked for
+    existing fingerprints with a single query.
+    """
+    batch_size = batch_size or IMPORT_BATCH_SIZE
+    categories = load_category_map(user)
+    suggest = suggestions.confident_suggester(user, group)
+    group_id = group.pk if group else None
+    scope = f'group:{group_id}' if group_id else f'user:{user.pk}'
+    occurrences = Counter()
+    result = ImportResult()
+    batch = {}
+
+    with _interruptible(result):
+        for line in lines:
+            try:
+                values = _clean_statement_line(line, categories)
+            except RowError as exc:
+                result.add_error(line.row_number, str(exc))
+                continue
+            _suggest_category(values, suggest, result)
+            key = (line.date.date(), values['t_type'], values['amount'], line.payee, line.memo)
+            occurrences[key] += 1
+            fingerprint = statement_fingerprint(scope, line, values['t_type'], values['amount'], occurrences[key])
+            if fingerprint in batch:
+                result.skipped += 1
+                continue
+            batch[fingerprint] = Transaction(user_id=user.pk, group_id=group_id, fingerprint=fingerprint, **values)
+            if len(batch) >= batch_size:
+                _write_statement_batch(batch, result)
+                batch = {}
+
+    if batch:
+        _write_statement_batch(batch, result)
+    return result
+
+
+def _write_statement_batch(batch: dict[str, Transaction], result: ImportResult):
+    for attempt in range(2):
+        existing = set(Transaction.objects.filter(fingerprint__in=list(batch)).values_list('fingerprint', flat=True))
+        fresh = [obj for fingerprint, obj in batch.items() if fingerprint not in existing]
+        try:
+            created = _write_batch(fresh) if fresh else 0
+        except IntegrityError:
+            # A concurrent import inserted some of these lines after the lookup.
+            if attempt:
+                raise
+            continue
+        result.created += created
+        result.skipped += len(existing)
+        return
+
+
+def _clean_statement_line(line: StatementLine, categories: dict) -> dict:
+    if line.date is None:
+        raise RowError("Missing or invalid date.")
+    if line.amount in (None, ''):
+        raise RowError("Amount is required.")
+    amount = line.amount.replace(',', '') if re.fullmatch(r'-?[\d,]+\.\d+', line.amount) else line.amount
+    t_type = 'expense' if amount.strip().startswith('-') else 'income'
+    values = {
+        't_type': t_type,
+        'amount': _clean_amount(amount.strip().lstrip('+-')),
+        'category_id': categories.get((line.category.strip().casefold(), t_type == 'income')),
+        'description': ' - '.join(part for part in (line.payee, line.memo) if part),
+        'date': timezone.make_aware(line.date),
+    }
+    return values
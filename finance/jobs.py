@@ -0,0 +1,158 @@
+"""
+Background processing of export jobs.
+
+Jobs run on a process-local thread pool, so no external broker is needed.
+A job is handed to the pool once the database transaction that created it
+commits. With EXPORT_JOBS_EAGER enabled (used in tests) it runs synchronously
+instead.
+"""
+import hashlib
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .cache import GLOBAL_VERSION_KEY, get_versions, group_version_key, user_version_key
+from .conditional import user_group_ids
+from .models import BalanceSnapshot, ExportJob, User
+from .services import summarize_snapshots, write_transactions_workbook
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FILENAME = 'transactions.xlsx'
+EXPORT_FAILED_ERROR = 'The export could not be built. Please try again later.'
+EXPORT_EXPIRED_ERROR = 'The export did not finish in time. Please try again.'
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_export_version(user: User) -> str:
+    """
+    Returns a digest of every data version an export of the user's transactions depends on.
+    """
+    group_ids = user_group_ids(user)
+    keys = [user_version_key(user.pk), GLOBAL_VERSION_KEY] + [group_version_key(pk) for pk in group_ids]
+    versions = get_versions(keys)
+    raw = '|'.join(f'{key}={versions[key]}' for key in keys)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def request_export(user: User) -> tuple[ExportJob, bool]:
+    """
+    Returns an export job for the user's current data and whether it was created.
+
+    A finished, pending or running job built from the same data version is
+    reused, so repeated requests do not regenerate an identical file. Jobs that
+    are still unfinished after EXPORT_JOB_TIMEOUT seconds, e.g. because their
+    worker process was restarted, are marked failed first.
+    """
+    expire_stale_jobs(user)
+    version = get_export_version(user)
+    job = (
+        ExportJob.objects.filter(user=user, data_version=version)
+        .exclude(status='failed')
+        .order_by('-created_at')
+        .first()
+    )
+    if job is not None and (job.status != 'done' or (job.file and job.file.storage.exists(job.file.name))):
+        return job, False
+
+    scopes = Q(user=user, group=None) | Q(group__in=user_group_ids(user))
+    job = ExportJob.objects.create(
+        user=user,
+        data_version=version,
+        rows_total=summarize_snapshots(BalanceSnapshot.objects.filter(scopes)).count,
+    )
+    submit(job.pk)
+    job.refresh_from_db()  # An eager run has already finished it.
+    return job, True
+
+
+def expire_stale_jobs(user: User) -> int:
+    """
+    Marks the user's pending or running jobs older than EXPORT_JOB_TIMEOUT as failed and returns their number.
+    """
+    now = timezone.now()
+    deadline = now - timedelta(seconds=getattr(settings, 'EXPORT_JOB_TIMEOUT', 1800))
+    return ExportJob.objects.filter(user=user, status__in=['pending', 'running'], created_at__lt=deadline).update(
+        status='failed', error=EXPORT_EXPIRED_ERROR, finished_at=now,
+    )
+
+
+def submit(job_id: int):
+    """
+    Schedules a job on the worker pool after the current transaction commits.
+    """
+    if getattr(settings, 'EXPORT_JOBS_EAGER', False):
+        run_export_job(job_id)
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, job_id))
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'EXPORT_WORKERS', 2),
+                thread_name_prefix='frognance-export',
+            )
+    return _executor
+
+
+def _run_in_worker(job_id: int):
+    close_old_connections()
+    try:
+        run_export_job(job_id)
+    except Exception:
+        logger.exception("Export job %s crashed", job_id)
+    finally:
+        # Worker threads open their own connection; do not leave it to the garbage collector.
+        connection.close()
+
+
+def run_export_job(job_id: int):
+    """
+    Builds the export file of a pending job and stores it in MEDIA storage.
+    """
+    if not ExportJob.objects.filter(pk=job_id, status='pending').update(status='running'):
+        return  # Already claimed by another worker.
+    job = ExportJob.objects.select_related('user').get(pk=job_id)
+
+    def progress(rows_written):
+        ExportJob.objects.filter(pk=job_id).update(rows_done=rows_written)
+
+    try:
+        with tempfile.TemporaryFile() as fileobj:
+            write_transactions_workbook(job.user, fileobj, progress)
+            fileobj.seek(0)
+            job.file.save(EXPORT_FILENAME, File(fileobj), save=False)
+    except Exception:
+        # The details stay in the log; the job page only shows a generic message.
+        logger.exception("Export job %s failed", job_id)
+        ExportJob.objects.filter(pk=job_id).update(status='failed', error=EXPORT_FAILED_ERROR, finished_at=timezone.now())
+        return
+
+    job.status = 'done'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['file', 'status', 'finished_at'])
+    _discard_previous(job)
+
+
+def _discard_previous(job: ExportJob):
+    """
+    Deletes the user's finished jobs created before this one, and their files, which are superseded by it.
+    """
+    previous = ExportJob.objects.filter(user=job.user_id, status__in=['done', 'failed'], created_at__lt=job.created_at)
+    for old in previous:
+        if old.file:
+            old.file.delete(save=False)
+        old.delete()
@@ -0,0 +1,328 @@
+"""
+Incremental maintenance of the BalanceSnapshot ledger and CategoryRollup table.
+
+Every change to a Transaction is turned into signed deltas for the
+(user, group) snapshot and the (user, group, category, month, type) rollup
+it belongs to. Deltas are applied with F() expressions so concurrent writers
+never overwrite each other's totals. Bulk code paths can wrap their work in
+`deferred_ledger()` to merge all deltas and write each affected row once.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import date as date_type, datetime
+from decimal import Decimal
+from typing import NamedTuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum, Count, Q, DateField
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .cache import bump_versions
+from .models import BalanceSnapshot, CategoryRollup, Transaction
+
+_local = threading.local()
+
+LEDGER_FIELDS = ('user_id', 'group_id', 't_type', 'amount', 'category_id', 'date')
+
+
+class LedgerEntry(NamedTuple):
+    """
+    The part of a transaction that contributes to the ledger tables.
+    """
+    user_id: int
+    group_id: int | None
+    t_type: str
+    amount: Decimal
+    category_id: int | None
+    date: datetime
+
+
+class _Pending:
+    """
+    Deltas collected inside a deferred_ledger() block.
+    """
+
+    def __init__(self):
+        self.snapshots = {}
+        self.rollups = {}
+
+    def add_snapshot(self, key, income, expense, count):
+        totals = self.snapshots.setdefault(key, [Decimal('0'), Decimal('0'), 0])
+        totals[0] += income
+        totals[1] += expense
+        totals[2] += count
+
+    def add_rollup(self, key, total, count):
+        totals = self.rollups.setdefault(key, [Decimal('0'), 0])
+        totals[0] += total
+        totals[1] += count
+
+
+def month_of(value: datetime) -> date_type:
+    """
+    Return the first day of the month a transaction date falls into, in the current time zone.
+    """
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return value.date().replace(day=1)
+
+
+def entry_for(instance: Transaction) -> LedgerEntry | None:
+    """
+    Return the ledger entry of a transaction, or None if its fields are not loaded.
+    """
+    values = instance.__dict__
+    if any(field not in values for field in LEDGER_FIELDS):
+        return None
+    return LedgerEntry(*(values[field] for field in LEDGER_FIELDS))
+
+
+def load_entry(pk: int) -> LedgerEntry | None:
+    """
+    Read the stored ledger entry of a transaction from the database.
+    """
+    row = Transaction.objects.filter(pk=pk).values_list(*LEDGER_FIELDS).first()
+    return LedgerEntry(*row) if row else None
+
+
+@contextmanager
+def deferred_ledger():
+    """
+    Collect ledger changes made inside the block and write them once on exit.
+
+    The block and the ledger writes run in one database transaction. Nested
+    blocks join the outermost one.
+    """
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+
+    _local.pending = _Pending()
+    try:
+        with transaction.atomic():
+            yield
+            pending, _local.pending = _local.pending, None
+            _apply(pending)
+    finally:
+        _local.pending = None
+
+
+def record(entry: LedgerEntry, sign: int = 1):
+    """
+    Add (sign=1) or remove (sign=-1) a transaction's contribution to the ledger.
+    """
+    with deferred_ledger():
+        _add(_local.pending, entry, sign)
+
+
+def record_many(entries, sign: int = 1):
+    """
+    Add or remove the contributions of many transactions, e.g. after bulk_create().
+    """
+    with deferred_ledger():
+        pending = _local.pending
+        for entry in entries:
+            _add(pending, entry, sign)
+
+
+def _add(pending: _Pending, entry: LedgerEntry, sign: int):
+    amount = Decimal(entry.amount) * sign
+    income, expense = (amount, 0) if entry.t_type == 'income' else (0, amount)
+    pending.add_snapshot((entry.user_id, entry.group_id), income, expense, sign)
+    pending.add_rollup(
+        (entry.user_id, entry.group_id, entry.category_id, month_of(entry.date), entry.t_type), amount, sign
+    )
+
+
+def record_change(previous: LedgerEntry | None, current: LedgerEntry | None):
+    """
+    Move a transaction's contribution from its previous state to its current state.
+    """
+    if previous == current:
+        return
+    with deferred_ledger():
+        if previous is not None:
+            record(previous, -1)
+        if current is not None:
+            record(current, 1)
+
+
+def fold_group(group_id: int):
+    """
+    Move every member's share of a group into their personal ledger rows.
+
+    Called before a group is deleted, since its transactions then become
+    personal through on_delete=SET_NULL without any save signals.
+    """
+    shares = BalanceSnapshot.objects.filter(group_id=group_id).values_list('user_id', 'income', 'expense', 'count')
+    rollups = CategoryRollup.objects.filter(group_id=group_id).values_list(
+        'user_id', 'category_id', 'month', 't_type', 'total', 'count'
+    )
+    with deferred_ledger():
+        pending = _local.pending
+        for user_id, income, expense, count in shares:
+            pending.add_snapshot((user_id, None), income, expense, count)
+        for user_id, category_id, month, t_type, total, count in rollups:
+            pending.add_rollup((user_id, None, category_id, month, t_type), total, count)
+
+
+def fold_category(category_id: int):
+    """
+    Move a category's rollups into the uncategorized bucket.
+
+    Called before a category is deleted, since its transactions then lose
+    their category through on_delete=SET_NULL without any save signals.
+    """
+    rollups = CategoryRollup.objects.filter(category_id=category_id).values_list(
+        'user_id', 'group_id', 'month', 't_type', 'total', 'count'
+    )
+    with deferred_ledger():
+        pending = _local.pending
+        for user_id, group_id, month, t_type, total, count in rollups:
+            pending.add_rollup((user_id, group_id, None, month, t_type), total, count)
+
+
+def _bump_scopes(scopes):
+    # Cached dashboards and ETags are keyed by these versions, not by the ledger rows.
+    bump_versions(
+        user_ids=[user_id for user_id, group_id in scopes if group_id is None],
+        group_ids=[group_id for user_id, group_id in scopes],
+    )
+
+
+def _apply(pending: _Pending):
+    now = timezone.now()
+    _bump_scopes(set(pending.snapshots) | {key[:2] for key in pending.rollups})
+    for (user_id, group_id), (income, expense, count) in pending.snapshots.items():
+        if not (income or expense or count):
+            continue
+        _upsert(
+            BalanceSnapshot,
+            {'user_id': user_id, 'group_id': group_id},
+            {'income': income, 'expense': expense, 'count': count},
+            count,
+            updated_at=now,
+        )
+    for (user_id, group_id, category_id, month, t_type), (total, count) in pending.rollups.items():
+        if not (total or count):
+            continue
+        _upsert(
+            CategoryRollup,
+            {'user_id': user_id, 'group_id': group_id, 'category_id': category_id, 'month': month, 't_type': t_type},
+            {'total': total, 'count': count},
+            count,
+        )
+
+
+def _upsert(model, key: dict, deltas: dict, count: int, **extra):
+    rows = model.objects.filter(**key)
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    changes.update(extra)
+    if rows.update(**changes) or count <= 0:
+        # Negative deltas without a row come from cascaded deletes of the owner.
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        rows.update(**changes)
+
+
+def compute_snapshots() -> dict:
+    """
+    Recompute every snapshot from the raw transactions.
+
+    Returns a mapping of (user_id, group_id) to (income, expense, count).
+    """
+    rows = (
+        Transaction.objects.order_by()
+        .values('user_id', 'group_id')
+        .annotate(
+            income=Sum('amount', filter=Q(t_type='income'), default=Decimal('0')),
+            expense=Sum('amount', filter=Q(t_type='expense'), default=Decimal('0')),
+            count=Count('id'),
+        )
+    )
+    return {
+        (row['user_id'], row['group_id']): (row['income'], row['expense'], row['count'])
+        for row in rows
+    }
+
+
+def stored_snapshots() -> dict:
+    """
+    Return the current ledger in the same shape as compute_snapshots().
+    """
+    rows = BalanceSnapshot.objects.values_list('user_id', 'group_id', 'income', 'expense', 'count')
+    return {
+        (user_id, group_id): (income, expense, count)
+        for user_id, group_id, income, expense, count in rows
+        if count or income or expense
+    }
+
+
+def rebuild_snapshots(expected: dict | None = None):
+    """
+    Replace the ledger with totals recomputed from the raw transactions.
+    """
+    if expected is None:
+        expected = compute_snapshots()
+    with transaction.atomic():
+        scopes = set(BalanceSnapshot.objects.values_list('user_id', 'group_id')) | set(expected)
+        BalanceSnapshot.objects.all().delete()
+        BalanceSnapshot.objects.bulk_create(
+            BalanceSnapshot(user_id=user_id, group_id=group_id, income=income, expense=expense, count=count)
+            for (user_id, group_id), (income, expense, count) in expected.items()
+        )
+        _bump_scopes(scopes)
+
+
+def compute_rollups() -> dict:
+    """
+    Recompute every category rollup from the raw transactions.
+
+    Returns a mapping of (user_id, group_id, category_id, month, t_type) to (total, count).
+    """
+    rows = (
+        Transaction.objects.order_by()
+        .annotate(month=TruncMonth('date', output_field=DateField()))
+        .values('user_id', 'group_id', 'category_id', 'month', 't_type')
+        .annotate(total=Sum('amount'), count=Count('id'))
+    )
+    return {
+        (row['user_id'], row['group_id'], row['category_id'], row['month'], row['t_type']): (row['total'], row['count'])
+        for row in rows
+    }
+
+
+def stored_rollups() -> dict:
+    """
+    Return the current rollups in the same shape as compute_rollups().
+    """
+    rows = CategoryRollup.objects.values_list('user_id', 'group_id', 'category_id', 'month', 't_type', 'total', 'count')
+    return {
+        (user_id, group_id, category_id, month, t_type): (total, count)
+        for user_id, group_id, category_id, month, t_type, total, count in rows
+        if count or total
+    }
+
+
+def rebuild_rollups(expected: dict | None = None):
+    """
+    Replace the rollups with totals recomputed from the raw transactions.
+    """
+    if expected is None:
+        expected = compute_rollups()
+    with transaction.atomic():
+        scopes = set(CategoryRollup.objects.values_list('user_id', 'group_id').distinct())
+        scopes |= {key[:2] for key in expected}
+        CategoryRollup.objects.all().delete()
+        CategoryRollup.objects.bulk_create(
+            CategoryRollup(
+                user_id=user_id, group_id=group_id, category_id=category_id, month=month, t_type=t_type,
+                total=total, count=count,
+            )
+            for (user_id, group_id, category_id, month, t_type), (total, count) in expected.items()
+        )
+        _bump_scopes(scopes)
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from finance import ledger, suggestions
+from finance.models import Transaction, User, UserGroup
+
+
+class Command(BaseCommand):
+    """
+    Assigns suggested categories to uncategorized transactions with a description.
+    """
+    help = 'Assigns suggested categories to uncategorized transactions, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Transactions read and updated at a time.')
+        parser.add_argument(
+            '--min-confidence',
+            type=float,
+            default=suggestions.SUGGESTION_MIN_CONFIDENCE,
+            help='Only apply suggestions at least this likely (0 to 1).',
+        )
+        parser.add_argument('--user', type=int, help='Only back-fill the personal and group transactions of this user id.')
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without saving.')
+
+    def handle(self, *args, **options):
+        transactions = Transaction.objects.filter(category=None).exclude(description='')
+        if options['user']:
+            transactions = transactions.filter(user_id=options['user'])
+        users, groups, suggesters = {}, {}, {}
+        last_id, checked, assigned = 0, 0, 0
+
+        while True:
+            rows = list(transactions.filter(id__gt=last_id).order_by('id')
+                        .values_list('id', 't_type', 'description', *ledger.LEDGER_FIELDS)[:options['batch_size']])
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            checked += len(rows)
+            self._load_owners(rows, users, groups)
+
+            updates = []
+            for pk, t_type, description, *fields in rows:
+                entry = ledger.LedgerEntry(*fields)
+                scope = (entry.user_id, entry.group_id)
+                if scope not in suggesters:
+                    suggesters[scope] = suggestions.confident_suggester(
+                        users[entry.user_id], groups.get(entry.group_id), options['min_confidence']
+                    )
+                category_id = suggesters[scope](description, t_type)
+                if category_id is not None:
+                    updates.append((pk, description, entry, category_id))
+            if updates and not options['dry_run']:
+                assigned += self._save(updates)
+            else:
+                assigned += len(updates)
+
+        verb = 'Would assign' if options['dry_run'] else 'Assigned'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} categories to {assigned} of {checked} uncategorized transaction(s)."
+        ))
+
+    def _load_owners(self, rows, users, groups):
+        user_ids = {row[3] for row in rows} - users.keys()
+        group_ids = {row[4] for row in rows if row[4]} - groups.keys()
+        users.update(User.objects.in_bulk(user_ids))
+        groups.update(UserGroup.objects.in_bulk(group_ids))
+
+    def _save(self, updates) -> int:
+        # Rows are locked and read again, so categories assigned since the batch was read are kept and
+        # the ledger starts from the stored state. bulk_update() sends no signals and does not apply
+        # auto_now, so the ledger, the suggesters and the delta sync timestamp are updated here.
+        suggested = {pk: (description, category_id) for pk, description, entry, category_id in updates}
+        now = timezone.now()
+        with ledger.deferred_ledger():
+            rows = (Transaction.objects.select_for_update().filter(pk__in=suggested, category=None)
+                    .values_list('id', 'description', *ledger.LEDGER_FIELDS))
+            changes = []
+            for pk, description, *fields in rows:
+                # A suggestion for a description edited in the meantime no longer applies.
+                if description == suggested[pk][0]:
+                    changes.append((pk, description, ledger.LedgerEntry(*fields), suggested[pk][1]))
+            objects = [Transaction(id=pk, category_id=category_id, updated_at=now) for pk, _, _, category_id in changes]
+            Transaction.objects.bulk_update(objects, ['category', 'updated_at'])
+            for pk, description, entry, category_id in changes:
+                ledger.record_change(entry, entry._replace(category_id=category_id))
+            suggestions.record_many(
+                suggestions.SuggestionEntry(entry.user_id, entry.group_id, category_id, description)
+                for pk, description, entry, category_id in changes
+            )
+        return len(changes)
@@ -0,0 +1,60 @@
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from finance.models import Transaction
+from finance.renderers import FastJSONRenderer
+from finance.serializers import TransactionSerializer, transaction_rows
+
+
+class Command(BaseCommand):
+    """
+    Compares the rows per second of the model serializer and the values() fast path used by list APIs.
+    """
+    help = 'Benchmarks TransactionSerializer against the fast list serialization path on synthetic rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Number of synthetic transactions.')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per path; the best run is reported.')
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        with transaction.atomic():
+            # The synthetic data is rolled back at the end, so the ledger is not touched.
+            user = get_user_model().objects.create_user(username='__serializer_benchmark__')
+            now = timezone.now()
+            Transaction.objects.bulk_create(
+                Transaction(user=user, t_type='income' if i % 3 else 'expense', amount=Decimal(i % 1000) + Decimal('0.25'),
+                            description=f'Benchmark row {i}', date=now - timedelta(minutes=i))
+                for i in range(rows)
+            )
+            queryset = Transaction.objects.filter(user=user).order_by('-date', '-id')
+
+            def current():
+                return JSONRenderer().render(TransactionSerializer(list(queryset), many=True).data)
+
+            def fast():
+                return FastJSONRenderer().render(transaction_rows.serialize(queryset.values_list(*transaction_rows.columns)))
+
+            results = {}
+            for label, run in (('ModelSerializer + JSONRenderer', current), ('values() + FastJSONRenderer', fast)):
+                best = None
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    output = run()
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                results[label] = output
+                self.stdout.write(f"{label}: {rows / best:,.0f} rows/s ({best * 1000:.1f} ms for {rows} rows)")
+
+            transaction.set_rollback(True)
+
+        if len(set(results.values())) != 1:
+            raise CommandError("The two paths produced different output.")
+        self.stdout.write(self.style.SUCCESS("Both paths produced identical output."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from finance.sync import TOMBSTONE_RETENTION, prune_tombstones
+
+
+class Command(BaseCommand):
+    """
+    Deletes sync tombstones older than the retention period.
+    """
+    help = 'Deletes sync tombstones older than the retention period.'
+
+    def handle(self, *args, **options):
+        deleted = prune_tombstones()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted} tombstone(s) older than {TOMBSTONE_RETENTION.days} days."
+        ))
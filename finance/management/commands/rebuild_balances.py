@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from finance import ledger
+
+LEDGERS = (
+    ('balance snapshot', ledger.compute_snapshots, ledger.stored_snapshots, ledger.rebuild_snapshots),
+    ('category rollup', ledger.compute_rollups, ledger.stored_rollups, ledger.rebuild_rollups),
+)
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the balance ledger and category rollups from raw transactions and reports any drift.
+    """
+    help = 'Rebuilds and verifies the balance ledger and category rollups from raw transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only verify the ledger and exit with an error if it has drifted.',
+        )
+
+    def handle(self, *args, **options):
+        drifted_total = 0
+        for label, compute, stored_rows, rebuild in LEDGERS:
+            expected = compute()
+            stored = stored_rows()
+            drifted = [key for key in expected.keys() | stored.keys() if expected.get(key) != stored.get(key)]
+            drifted_total += len(drifted)
+
+            for key in sorted(drifted, key=str):
+                self.stdout.write(f"{label} {key}: stored {stored.get(key)}, expected {expected.get(key)}")
+
+            if options['check']:
+                self.stdout.write(f"Checked {len(expected)} {label} row(s), {len(drifted)} out of date.")
+                continue
+
+            rebuild(expected)
+            self.stdout.write(self.style.SUCCESS(
+                f"Rebuilt {len(expected)} {label} row(s), {len(drifted)} had drifted."
+            ))
+
+        if options['check']:
+            if drifted_total:
+                raise CommandError(f"{drifted_total} ledger row(s) out of date.")
+            self.stdout.write(self.style.SUCCESS("Ledger is consistent."))
@@ -0,0 +1,75 @@
+"""
+Request-scoped access to the current user's group memberships.
+
+MembershipMiddleware puts a lazy Memberships object on each request. The
+user's memberships are read with one query as a {group id: role} dict the
+first time a view calls `request.memberships.is_member(group_id)` or
+`request.memberships.is_admin(group_id)`, and reused for the rest of the
+request. They are deliberately not cached across requests, so a kicked
+member or demoted admin loses access with their next request on any worker.
+"""
+from functools import cached_property
+
+from .models import User, UserGroupMember
+
+
+def user_memberships(user: User) -> dict[int, str]:
+    """
+    Return the roles of a user in their groups, keyed by group id, read from the database.
+    """
+    return dict(UserGroupMember.objects.filter(user=user).order_by('group_id').values_list('group_id', 'role'))
+
+
+class Memberships:
+    """
+    The current user's memberships, loaded on first use; anonymous users have none.
+
+    The user is read when the memberships are first needed, so API requests
+    see the user set by REST framework authentication.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def roles(self) -> dict[int, str]:
+        user = self.request.user
+        return user_memberships(user) if user.is_authenticated else {}
+
+    @property
+    def group_ids(self) -> list[int]:
+        return list(self.roles)
+
+    def role(self, group_id) -> str | None:
+        """
+        Return the user's role in a group, or None if they are not a member.
+        """
+        try:
+            return self.roles.get(int(group_id))
+        except (TypeError, ValueError):
+            return None
+
+    def is_member(self, group_id) -> bool:
+        """
+        Return whether the user belongs to a group.
+        """
+        return self.role(group_id) is not None
+
+    def is_admin(self, group_id) -> bool:
+        """
+        Return whether the user is an admin of a group.
+        """
+        return self.role(group_id) == 'admin'
+
+
+class MembershipMiddleware:
+    """
+    Add the lazy `memberships` attribute to every request; must come after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.memberships = Memberships(request)
+        return self.get_response(request)
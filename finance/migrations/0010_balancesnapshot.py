@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def build_balance_snapshots(apps, schema_editor):
+    """
+    Fills the ledger with totals computed from the existing transactions.
+    """
+    Transaction = apps.get_model('finance', 'Transaction')
+    BalanceSnapshot = apps.get_model('finance', 'BalanceSnapshot')
+
+    rows = (
+        Transaction.objects.order_by()
+        .values('user_id', 'group_id')
+        .annotate(
+            income=Sum('amount', filter=Q(t_type='income'), default=0),
+            expense=Sum('amount', filter=Q(t_type='expense'), default=0),
+            count=Count('id'),
+        )
+    )
+    BalanceSnapshot.objects.bulk_create(
+        BalanceSnapshot(
+            user_id=row['user_id'],
+            group_id=row['group_id'],
+            income=row['income'],
+            expense=row['expense'],
+            count=row['count'],
+        )
+        for row in rows
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0009_add_base_categories'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='finance.usergroup')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'balance_snapshots',
+                'constraints': [models.UniqueConstraint(fields=('user', 'group'), name='unique_group_balance_snapshot'), models.UniqueConstraint(condition=models.Q(('group', None)), fields=('user',), name='unique_personal_balance_snapshot')],
+            },
+        ),
+        migrations.RunPython(build_balance_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+
+
+def build_category_rollups(apps, schema_editor):
+    """
+    Fills the monthly category rollups from the existing transactions.
+    """
+    Transaction = apps.get_model('finance', 'Transaction')
+    CategoryRollup = apps.get_model('finance', 'CategoryRollup')
+
+    rows = (
+        Transaction.objects.order_by()
+        .annotate(month=TruncMonth('date', output_field=DateField()))
+        .values('user_id', 'group_id', 'category_id', 'month', 't_type')
+        .annotate(total=Sum('amount'), count=Count('id'))
+    )
+    CategoryRollup.objects.bulk_create(CategoryRollup(**row) for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0010_balancesnapshot'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('t_type', models.CharField(choices=[('income', 'Доход'), ('expense', 'Расход')], max_length=7)),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='finance.category')),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='category_rollups', to='finance.usergroup')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='category_rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'category_rollups',
+                'indexes': [models.Index(fields=['user', 't_type', 'month'], name='category_ro_user_id_d83de1_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'group', 'category', 'month', 't_type'), name='unique_rollup'), models.UniqueConstraint(condition=models.Q(('group', None)), fields=('user', 'category', 'month', 't_type'), name='unique_personal_rollup'), models.UniqueConstraint(condition=models.Q(('category', None)), fields=('user', 'group', 'month', 't_type'), name='unique_uncategorized_rollup'), models.UniqueConstraint(condition=models.Q(('category', None), ('group', None)), fields=('user', 'month', 't_type'), name='unique_personal_uncategorized_rollup')],
+            },
+        ),
+        migrations.RunPython(build_category_rollups, migrations.RunPython.noop),
+    ]
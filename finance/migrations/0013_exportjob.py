@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:16
+
+import django.db.models.deletion
+import finance.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0012_transaction_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_version', models.CharField(blank=True, max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=10)),
+                ('rows_total', models.IntegerField(default=0)),
+                ('rows_done', models.IntegerField(default=0)),
+                ('file', models.FileField(blank=True, upload_to=finance.models.export_upload_to)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'export_jobs',
+                'indexes': [models.Index(fields=['user', 'data_version'], name='export_jobs_user_id_ca456f_idx')],
+            },
+        ),
+    ]
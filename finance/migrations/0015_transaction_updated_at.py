@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:40
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_updated_at(apps, schema_editor):
+    """
+    Uses the transaction date as the last modification time of existing rows.
+    """
+    Transaction = apps.get_model('finance', 'Transaction')
+    Transaction.objects.update(updated_at=F('date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0014_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
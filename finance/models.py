@@ -1,5 +1,7 @@
+import uuid
+
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
@@ -24,6 +26,7 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     icon = models.CharField(max_length=30, blank=True)
     is_income = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         """
@@ -52,10 +55,25 @@ class Transaction(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     description = models.TextField(blank=True)
     date = models.DateTimeField(default=timezone.now)
+    # Set by bank statement imports, so a re-imported statement line is recognised
+    fingerprint = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'Transaction'
-        indexes = [models.Index(fields=['user', 'group'])]
+        indexes = [
+            models.Index(fields=['user', 'group']),
+            # Personal tables and exports: user's rows without a group, newest first
+            models.Index(fields=['user', '-date', '-id'], condition=models.Q(group=None), name='txn_personal_date_idx'),
+            # Group tables and exports: all rows of a group, newest first
+            models.Index(fields=['group', '-date', '-id'], name='txn_group_date_idx'),
+            # Income list and API: user's rows of one type, newest first
+            models.Index(fields=['user', 't_type', '-date', '-id'], name='txn_user_type_date_idx'),
+            # Delta sync: rows of a scope changed since a point in time
+            models.Index(fields=['user', 'updated_at', 'id'], condition=models.Q(group=None),
+                         name='txn_personal_updated_idx'),
+            models.Index(fields=['group', 'updated_at', 'id'], name='txn_group_updated_idx'),
+        ]
 
     def __str__(self):
         """
@@ -63,6 +81,13 @@ class Transaction(models.Model):
         """
         return f"{self.t_type}: {self.amount}"
 
+    def save(self, *args, **kwargs):
+        """
+        Save the transaction and its balance ledger changes in one database transaction.
+        """
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class UserGroup(models.Model):
     """
@@ -92,6 +117,7 @@ class UserGroupMember(models.Model):
     group = models.ForeignKey(UserGroup, on_delete=models.CASCADE, related_name='members')
     role = models.CharField(max_length=20, default='member', choices=[('admin', 'Admin'), ('member', 'Member')])
     joined_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = 'user_group_members'
@@ -138,3 +164,179 @@ class Invitation(models.Model):
         Return a string representation of the invitation.
         """
         return f"Приглашение от {self.from_user} для {self.to_user} в {self.group}"
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Denormalized running totals of a user's transactions in one scope.
+
+    A snapshot without a group holds the user's personal balance; a snapshot
+    with a group holds the user's share of that group's balance. Rows are kept
+    current by finance.ledger and can be rebuilt with `manage.py rebuild_balances`.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='balance_snapshots')
+    group = models.ForeignKey(UserGroup, on_delete=models.CASCADE, null=True, blank=True,
+                              related_name='balance_snapshots')
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    expense = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'balance_snapshots'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'group'], name='unique_group_balance_snapshot'),
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(group=None),
+                name='unique_personal_balance_snapshot'
+            ),
+        ]
+
+    def __str__(self):
+        """
+        Return a string representation of the snapshot scope and balance.
+        """
+        scope = self.group_id or 'personal'
+        return f"{self.user_id} ({scope}): {self.income - self.expense}"
+
+
+class CategoryRollup(models.Model):
+    """
+    Monthly totals of a user's transactions per category and type in one scope.
+
+    Scopes follow BalanceSnapshot: no group means personal transactions. A
+    missing category collects uncategorized transactions. Rows are kept
+    current by finance.ledger so period reports read a handful of rows
+    instead of scanning the transaction history.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='category_rollups')
+    group = models.ForeignKey(UserGroup, on_delete=models.CASCADE, null=True, blank=True,
+                              related_name='category_rollups')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='rollups')
+    month = models.DateField()  # first day of the month
+    t_type = models.CharField(max_length=7, choices=Transaction.TYPE_CHOICES)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'category_rollups'
+        indexes = [models.Index(fields=['user', 't_type', 'month'])]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'group', 'category', 'month', 't_type'],
+                name='unique_rollup'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'category', 'month', 't_type'],
+                condition=models.Q(group=None),
+                name='unique_personal_rollup'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'group', 'month', 't_type'],
+                condition=models.Q(category=None),
+                name='unique_uncategorized_rollup'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'month', 't_type'],
+                condition=models.Q(group=None, category=None),
+                name='unique_personal_uncategorized_rollup'
+            ),
+        ]
+
+    def __str__(self):
+        """
+        Return a string representation of the rollup bucket and total.
+        """
+        return f"{self.month:%Y-%m} {self.t_type}: {self.total}"
+
+
+def export_upload_to(instance, filename):
+    """
+    Return an unguessable storage path for an export artifact.
+    """
+    return f"exports/{uuid.uuid4().hex}/{filename}"
+
+
+class ExportJob(models.Model):
+    """
+    Represents a transaction export that is built in the background.
+
+    Jobs are processed by finance.jobs and keep the data version they were
+    built from, so an identical request made before the user's data changes
+    can be answered with the existing file.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Ожидает'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+    )
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='export_jobs')
+    data_version = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    rows_total = models.IntegerField(default=0)
+    rows_done = models.IntegerField(default=0)
+    file = models.FileField(upload_to=export_upload_to, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'export_jobs'
+        indexes = [models.Index(fields=['user', 'data_version'])]
+
+    def __str__(self):
+        """
+        Return a string representation of the job and its status.
+        """
+        return f"Export #{self.pk} for {self.user_id} ({self.status})"
+
+    @property
+    def progress(self) -> int:
+        """
+        Return the share of exported rows in percent.
+        """
+        if self.status == 'done':
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(99, self.rows_done * 100 // self.rows_total)
+
+
+class Tombstone(models.Model):
+    """
+    Records a deleted transaction, category or group membership for delta sync.
+
+    The scope (user and group) of the deleted row is kept so clients of every
+    user who could see it learn about the deletion. The user and group are
+    stored without a database constraint, so tombstones outlive them; rows
+    deleted along with their user are recorded while the user still exists.
+    """
+    MODEL_CHOICES = (
+        ('transaction', 'Транзакция'),
+        ('category', 'Категория'),
+        ('membership', 'Участие в группе'),
+    )
+
+    model = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, null=True,
+                             blank=True, related_name='+')
+    group = models.ForeignKey(UserGroup, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                              related_name='+')
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = 'tombstones'
+        indexes = [
+            models.Index(fields=['user', 'deleted_at']),
+            models.Index(fields=['group', 'deleted_at']),
+        ]
+
+    def __str__(self):
+        """
+        Return a string representation of the deleted object.
+        """
+        return f"{self.model} #{self.object_id} deleted at {self.deleted_at:%Y-%m-%d %H:%M}"
@@ -0,0 +1,137 @@
+"""
+Keyset (cursor) pagination over (date, id).
+
+Pages are addressed by an opaque cursor holding the (date, id) of the last
+row shown, so fetching page N costs the same index range scan as page 1
+instead of an OFFSET over all previous rows.
+`KeysetPagination` exposes the same scheme to the REST API.
+"""
+import base64
+import binascii
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+PAGE_SIZE = 25
+
+
+@dataclass(frozen=True)
+class KeysetPage:
+    """
+    One page of rows plus the cursor of the page that follows it.
+    """
+    items: list
+    next_cursor: str | None
+    is_first: bool
+
+
+def encode_cursor(date: datetime, pk: int) -> str:
+    """
+    Encode a (date, id) position as an opaque, URL-safe token.
+    """
+    raw = f"{date.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str | None) -> tuple[datetime, int] | None:
+    """
+    Decode a cursor produced by encode_cursor(), returning None if it is missing or malformed.
+    """
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        date, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(date), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+def keyset_query(queryset: QuerySet, position: tuple[datetime, int] | None, page_size: int = PAGE_SIZE) -> QuerySet:
+    """
+    Return the query for the page after a decoded cursor position, with one extra row to detect a next page.
+    """
+    queryset = queryset.order_by('-date', '-id')
+    if position is not None:
+        date, pk = position
+        queryset = queryset.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+    return queryset[:page_size + 1]
+
+
+def paginate_keyset(queryset: QuerySet, cursor: str | None = None, page_size: int = PAGE_SIZE) -> KeysetPage:
+    """
+    Return the page of a transaction queryset that follows the given cursor, newest first.
+
+    Works on model querysets and on values_list(..., named=True) querysets that include date and id.
+    """
+    position = decode_cursor(cursor)
+    items = list(keyset_query(queryset, position, page_size))
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        next_cursor = encode_cursor(items[-1].date, items[-1].id)
+    return KeysetPage(items=items, next_cursor=next_cursor, is_first=position is None)
+
+
+class KeysetPagination(BasePagination):
+    """
+    DRF pagination over (date, id) that never counts rows or uses OFFSET.
+
+    Clients follow the `next` link, and may pass `page_size` up to max_page_size.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = PAGE_SIZE
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Return the rows of the requested page.
+        """
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor and decode_cursor(cursor) is None:
+            raise ValidationError({self.cursor_query_param: "Invalid cursor."})
+        self.request = request
+        self.page = paginate_keyset(queryset, cursor, self.get_page_size(request))
+        return self.page.items
+
+    def get_page_size(self, request) -> int:
+        """
+        Return the requested page size, clamped to 1..max_page_size.
+        """
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self) -> str | None:
+        """
+        Return the URL of the next page, or None on the last page.
+        """
+        if self.page.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        """
+        Return the page wrapped with the link to the next page.
+        """
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        """
+        Describe the paginated response for schema generators.
+        """
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
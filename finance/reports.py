@@ -0,0 +1,186 @@
+"""
+Time-bucketed transaction totals for reports and charts.
+
+Totals are grouped in the database, by day, week, month or year and
+optionally by category and type. Month and year buckets over whole months
+are read from the CategoryRollup table; everything else is truncated from
+the transactions with Trunc(). Results are columnar: one list of bucket
+labels and one list of values per series, ready for a chart.
+"""
+import calendar
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Case, Count, DateField, F, Sum, When
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .models import Category, CategoryRollup, Transaction, User, UserGroup
+
+BUCKET_CHOICES = (
+    ('day', 'Day'),
+    ('week', 'Week'),
+    ('month', 'Month'),
+    ('year', 'Year'),
+)
+SPLIT_CHOICES = (
+    ('category', 'Category'),
+    ('type', 'Type'),
+)
+BUCKET_DAYS = {'day': 1, 'week': 7, 'month': 28, 'year': 365}
+SUMMARY_MAX_BUCKETS = 3700
+# The day after it and the bucket following it are still representable dates.
+SUMMARY_LAST_DATE = date(9998, 12, 31)
+
+
+class SummaryRangeError(ValueError):
+    """
+    Raised when a summary would have more than SUMMARY_MAX_BUCKETS buckets.
+    """
+
+
+@dataclass
+class Summary:
+    """
+    Totals per bucket in columnar form.
+
+    Each series holds the totals and counts of one (category, type)
+    combination, aligned with labels. Without a type split or filter, totals
+    are net: income minus expense.
+    """
+    bucket: str
+    source: str
+    labels: list
+    series: list
+
+
+def summarize(user: User, bucket: str = 'month', split: tuple = (), group: UserGroup | None = None,
+              t_type: str | None = None, date_from: date | None = None, date_to: date | None = None) -> Summary:
+    """
+    Return the totals of a user's personal transactions, or of a group's, per bucket.
+
+    Raises SummaryRangeError if the buckets between the first and the last date would exceed SUMMARY_MAX_BUCKETS.
+    """
+    by_category = 'category' in split
+    by_type = 'type' in split
+    if _rollups_cover(bucket, date_from, date_to):
+        source = 'rollups'
+        rows = _rollup_rows(user, bucket, group, t_type, date_from, date_to, by_category, by_type)
+    else:
+        source = 'transactions'
+        rows = _transaction_rows(user, bucket, group, t_type, date_from, date_to, by_category, by_type)
+
+    labels = _bucket_labels(bucket, [row['bucket'] for row in rows], date_from, date_to)
+    positions = {label: index for index, label in enumerate(labels)}
+    names = Category.objects.in_bulk({row['category'] for row in rows if row.get('category')}) if by_category else {}
+    series = {}
+    for row in rows:
+        key = (row.get('category'), row.get('t_type'))
+        if key not in series:
+            category = names.get(key[0])
+            series[key] = {
+                'category': key[0],
+                'category_name': category.name if category else None,
+                't_type': key[1],
+                'totals': [Decimal('0')] * len(labels),
+                'counts': [0] * len(labels),
+            }
+        position = positions[row['bucket']]
+        series[key]['totals'][position] += row['total']
+        series[key]['counts'][position] += row['count']
+
+    ordered = sorted(series.values(), key=lambda item: (item['t_type'] or '', -abs(sum(item['totals'])), item['category'] or 0))
+    for item in ordered:
+        if not by_category:
+            del item['category'], item['category_name']
+        if not by_type:
+            del item['t_type']
+    return Summary(bucket=bucket, source=source, labels=labels, series=ordered)
+
+
+def _rollups_cover(bucket: str, date_from: date | None, date_to: date | None) -> bool:
+    if bucket not in ('month', 'year'):
+        return False
+    if date_from and date_from.day != 1:
+        return False
+    return not date_to or date_to.day == calendar.monthrange(date_to.year, date_to.month)[1]
+
+
+def _net(amount: str):
+    return Sum(Case(When(t_type='income', then=F(amount)), default=-F(amount)))
+
+
+def _rollup_rows(user, bucket, group, t_type, date_from, date_to, by_category, by_type) -> list[dict]:
+    rollups = CategoryRollup.objects.filter(count__gt=0)
+    rollups = rollups.filter(group=group) if group else rollups.filter(user=user, group=None)
+    if t_type:
+        rollups = rollups.filter(t_type=t_type)
+    if date_from:
+        rollups = rollups.filter(month__gte=date_from)
+    if date_to:
+        rollups = rollups.filter(month__lte=date_to)
+    bucket_expression = F('month') if bucket == 'month' else Trunc('month', 'year', output_field=DateField())
+    return _group_rows(rollups, bucket_expression, 'total', Sum('count'), by_category, by_type or bool(t_type))
+
+
+def _transaction_rows(user, bucket, group, t_type, date_from, date_to, by_category, by_type) -> list[dict]:
+    transactions = Transaction.objects.filter(group=group) if group else Transaction.objects.filter(user=user, group=None)
+    if t_type:
+        transactions = transactions.filter(t_type=t_type)
+    if date_from:
+        transactions = transactions.filter(date__gte=timezone.make_aware(datetime.combine(date_from, time.min)))
+    if date_to:
+        end = timezone.make_aware(datetime.combine(date_to + timedelta(days=1), time.min))
+        transactions = transactions.filter(date__lt=end)
+    bucket_expression = Trunc('date', bucket, output_field=DateField())
+    return _group_rows(transactions, bucket_expression, 'amount', Count('id'), by_category, by_type or bool(t_type))
+
+
+def _group_rows(queryset, bucket_expression, amount: str, count, by_category: bool, by_type: bool) -> list[dict]:
+    fields = ['bucket'] + (['category'] if by_category else []) + (['t_type'] if by_type else [])
+    total = Sum(amount) if by_type else _net(amount)
+    rows = (queryset.annotate(bucket=bucket_expression).values(*fields)
+            .annotate(total=total, count=count).order_by(*fields))
+    return list(rows)
+
+
+def _bucket_labels(bucket: str, buckets: list[date], date_from: date | None, date_to: date | None) -> list[date]:
+    """
+    Return every bucket from the first to the last one, so empty buckets show up as zeros.
+
+    Open ends are taken from the data, so the range is checked against
+    SUMMARY_MAX_BUCKETS here before any label is built.
+    """
+    first = _bucket_start(bucket, date_from) if date_from else min(buckets, default=None)
+    last = _bucket_start(bucket, date_to) if date_to else max(buckets, default=None)
+    if first is None or last is None:
+        return []
+    if (last - first).days // BUCKET_DAYS[bucket] > SUMMARY_MAX_BUCKETS:
+        raise SummaryRangeError("Too many buckets for this date range, choose a larger bucket or narrow the dates.")
+    labels = []
+    current = first
+    while current <= last:
+        labels.append(current)
+        current = _next_bucket(bucket, current)
+    return labels
+
+
+def _bucket_start(bucket: str, value: date) -> date:
+    if bucket == 'week':
+        return value - timedelta(days=value.weekday())
+    if bucket == 'month':
+        return value.replace(day=1)
+    if bucket == 'year':
+        return value.replace(month=1, day=1)
+    return value
+
+
+def _next_bucket(bucket: str, value: date) -> date:
+    if bucket == 'day':
+        return value + timedelta(days=1)
+    if bucket == 'week':
+        return value + timedelta(days=7)
+    if bucket == 'month':
+        return (value.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return value.replace(year=value.year + 1)
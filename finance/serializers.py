@@ -1,5 +1,10 @@
+import decimal
+
 from rest_framework import serializers
-from .models import Transaction, Category
+from rest_framework.fields import ISO_8601
+from rest_framework.settings import api_settings
+
+from .models import Transaction, Category, UserGroupMember
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -18,3 +23,138 @@ class TransactionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Transaction
         fields = '__all__'
+
+
+class UserGroupMemberSerializer(serializers.ModelSerializer):
+    """
+    Serializer for the UserGroupMember model.
+    """
+    class Meta:
+        model = UserGroupMember
+        fields = '__all__'
+
+
+class BalanceSummarySerializer(serializers.Serializer):
+    """
+    Serializer for a finance.services.BalanceSummary.
+    """
+    income = serializers.DecimalField(max_digits=14, decimal_places=2)
+    expense = serializers.DecimalField(max_digits=14, decimal_places=2)
+    balance = serializers.DecimalField(max_digits=14, decimal_places=2)
+    count = serializers.IntegerField()
+
+
+class TransactionWriteSerializer(serializers.Serializer):
+    """
+    Validates the fields of a transaction create or update in a batch.
+
+    Categories and groups are plain ids here; finance.batch resolves them
+    for the whole batch at once.
+    """
+    t_type = serializers.ChoiceField(choices=Transaction.TYPE_CHOICES)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    category = serializers.IntegerField(allow_null=True, required=False)
+    group = serializers.IntegerField(allow_null=True, required=False)
+    description = serializers.CharField(allow_blank=True, required=False, trim_whitespace=False)
+    date = serializers.DateTimeField(required=False)
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    """
+    Validates the shape of one operation of a transaction batch.
+    """
+    op = serializers.ChoiceField(choices=['create', 'update', 'delete'])
+    id = serializers.IntegerField(required=False)
+    data = serializers.DictField(required=False)
+
+    def validate(self, attrs):
+        """
+        Require an id for updates and deletes and data for creates and updates.
+        """
+        if attrs['op'] != 'create' and 'id' not in attrs:
+            raise serializers.ValidationError({'id': "This field is required."})
+        if attrs['op'] != 'delete' and 'data' not in attrs:
+            raise serializers.ValidationError({'data': "This field is required."})
+        return attrs
+
+
+class ValuesSerializer:
+    """
+    Read-only fast path producing the same output as a ModelSerializer from values_list() rows.
+
+    The model serializer's fields are compiled once into (name, column,
+    converter) entries, so listing rows needs neither model instances nor
+    per-field dispatch. Fields without a known fast converter fall back to
+    their own to_representation().
+    """
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.fields = []
+        for name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.RelatedField):
+                column = f'{field.source}_id'
+            else:
+                column = field.source
+            self.fields.append((name, column, field))
+        self.columns = tuple(column for name, column, field in self.fields)
+
+    def compile(self):
+        """
+        Return (name, converter) pairs for the current request; converters are None for pass-through values.
+        """
+        return [(name, self._converter(field)) for name, column, field in self.fields]
+
+    def serialize(self, rows) -> list[dict]:
+        """
+        Return the representation of rows selected with values_list(*self.columns).
+        """
+        converters = self.compile()
+        data = []
+        for row in rows:
+            item = {}
+            for (name, convert), value in zip(converters, row):
+                item[name] = value if convert is None or value is None else convert(value)
+            data.append(item)
+        return data
+
+    @staticmethod
+    def _converter(field):
+        if isinstance(field, (serializers.RelatedField, serializers.ChoiceField, serializers.IntegerField,
+                              serializers.CharField)):
+            return None  # Stored values already are their representation.
+        if isinstance(field, serializers.DecimalField):
+            return _decimal_converter(field)
+        if isinstance(field, serializers.DateTimeField):
+            return _datetime_converter(field)
+        return field.to_representation
+
+
+def _decimal_converter(field):
+    coerce_to_string = getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.normalize_output or field.decimal_places is None:
+        return field.to_representation
+    exponent = decimal.Decimal('.1') ** field.decimal_places
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+    rounding = field.rounding
+
+    def convert(value):
+        return f'{value.quantize(exponent, rounding=rounding, context=context):f}'
+    return convert
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return field.to_representation
+
+    def convert(value):
+        value = value.astimezone(field_timezone).isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    return convert
+
+
+transaction_rows = ValuesSerializer(TransactionSerializer)
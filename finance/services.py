@@ -1,77 +1,375 @@
-from django.db.models import Sum
+import csv
+import json
+from dataclasses import dataclass
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import DecimalField, F, FilteredRelation, IntegerField, Sum, Count, Q, QuerySet, Value
+from django.db.models.functions import Coalesce
 from openpyxl import Workbook
-from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
-from .models import Transaction, UserGroup, UserGroupMember, User
-
-
-def get_personal_balance(user: User):
-    """
-    Calculates the financial balance for a user's personal transactions.
-    """
-    transactions = Transaction.objects.filter(user=user, group=None).select_related('category').order_by('-date')
-    income = transactions.filter(t_type='income').aggregate(total=Sum('amount'))['total'] or 0
-    expense = transactions.filter(t_type='expense').aggregate(total=Sum('amount'))['total'] or 0
-    return transactions, income, expense, income - expense
-
-
-def get_group_balance(user: User):
-    """
-    Calculates the financial balance for the group a user is a member of.
-    """
-    member = UserGroupMember.objects.filter(user=user).first()
-    if not member:
-        return None, None, None, None, None
-        
-    transactions = Transaction.objects.filter(group=member.group).select_related('category', 'user').order_by('-date')
-    income = transactions.filter(t_type='income').aggregate(total=Sum('amount'))['total'] or 0
-    expense = transactions.filter(t_type='expense').aggregate(total=Sum('amount'))['total'] or 0
-    return transactions, income, expense, income - expense, member.group
-
-
-def export_transactions(user: User) -> HttpResponse:
-    """
-    Exports a user's personal and group transactions to an Excel file.
-    """
-    wb = Workbook()
-    ws_personal = wb.active
-    ws_personal.title = "Personal Transactions"
-    headers = ['ID', 'Type', 'Amount', 'Category', 'Description', 'Date']
-    ws_personal.append(headers)
-
-    personal_transactions = Transaction.objects.filter(user=user, group=None).select_related('category')
-    for transaction in personal_transactions:
-        row = [
-            transaction.id,
-            transaction.t_type,
-            float(transaction.amount),
-            transaction.category.name if transaction.category else '',
-            transaction.description,
-            transaction.date.strftime('%Y-%m-%d'),
-        ]
-        ws_personal.append(row)
-
-    member = UserGroupMember.objects.filter(user=user).first()
-    if member:
-        ws_group = wb.create_sheet(title="Group Transactions")
-        ws_group.append(headers)
-
-        group_transactions = Transaction.objects.filter(group=member.group).select_related('category')
-        for transaction in group_transactions:
-            row = [
-                transaction.id,
-                transaction.t_type,
-                float(transaction.amount),
-                transaction.category.name if transaction.category else '',
-                transaction.description,
-                transaction.date.strftime('%Y-%m-%d'),
-            ]
-            ws_group.append(row)
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename="transactions.xlsx"'
-    wb.save(response)
-    return response
+from django.utils import timezone
+from .models import Transaction, UserGroup, UserGroupMember, User, BalanceSnapshot, CategoryRollup
+
+
+PERIOD_CHOICES = (
+    ('month', 'This month'),
+    ('12m', 'Last 12 months'),
+    ('all', 'All time'),
+)
+
+
+@dataclass(frozen=True)
+class BalanceSummary:
+    """
+    Immutable income/expense totals for a set of transactions.
+    """
+    income: Decimal = Decimal('0')
+    expense: Decimal = Decimal('0')
+    count: int = 0
+
+    @property
+    def balance(self) -> Decimal:
+        """
+        Return the difference between income and expense.
+        """
+        return self.income - self.expense
+
+
+def summarize_transactions(transactions: QuerySet) -> BalanceSummary:
+    """
+    Calculates income, expense and transaction count of a queryset in a single query.
+    """
+    totals = transactions.aggregate(
+        income=Sum('amount', filter=Q(t_type='income'), default=Decimal('0')),
+        expense=Sum('amount', filter=Q(t_type='expense'), default=Decimal('0')),
+        count=Count('id'),
+    )
+    return BalanceSummary(**totals)
+
+
+def get_personal_transactions(user: User) -> QuerySet:
+    """
+    Returns a user's personal (non-group) transactions, newest first.
+    """
+    return Transaction.objects.filter(user=user, group=None).select_related('category').order_by('-date')
+
+
+def get_group_transactions(group: UserGroup) -> QuerySet:
+    """
+    Returns all transactions of a group, newest first.
+    """
+    return Transaction.objects.filter(group=group).select_related('category', 'user').order_by('-date')
+
+
+def summarize_snapshots(snapshots: QuerySet) -> BalanceSummary:
+    """
+    Adds up balance ledger rows in a single query.
+    """
+    totals = snapshots.aggregate(
+        income=Sum('income', default=Decimal('0')),
+        expense=Sum('expense', default=Decimal('0')),
+        count=Sum('count', default=0),
+    )
+    return BalanceSummary(**totals)
+
+
+def get_personal_balance(user: User) -> BalanceSummary:
+    """
+    Reads the financial balance for a user's personal transactions from the ledger.
+    """
+    snapshot = BalanceSnapshot.objects.filter(user=user, group=None).values('income', 'expense', 'count').first()
+    return BalanceSummary(**snapshot) if snapshot else BalanceSummary()
+
+
+def get_user_groups(user: User) -> list[UserGroup]:
+    """
+    Returns every group a user is a member of, in the order they joined.
+    """
+    return list(UserGroup.objects.filter(members__user=user).order_by('members__joined_at', 'id'))
+
+
+def get_group_summaries(groups: list[UserGroup]) -> dict[int, BalanceSummary]:
+    """
+    Reads the financial balance of several groups from the ledger in a single grouped query.
+    """
+    rows = (
+        BalanceSnapshot.objects.filter(group__in=groups)
+        .values('group_id')
+        .annotate(
+            income=Sum('income', default=Decimal('0')),
+            expense=Sum('expense', default=Decimal('0')),
+            count=Sum('count', default=0),
+        )
+        .order_by()
+    )
+    summaries = {group.pk: BalanceSummary() for group in groups}
+    for row in rows:
+        group_id = row.pop('group_id')
+        summaries[group_id] = BalanceSummary(**row)
+    return summaries
+
+
+def get_group_balances(user: User) -> list[tuple[UserGroup, BalanceSummary]]:
+    """
+    Reads the financial balance of every group a user is a member of.
+    """
+    groups = get_user_groups(user)
+    summaries = get_group_summaries(groups) if groups else {}
+    return [(group, summaries[group.pk]) for group in groups]
+
+
+MEMBER_SORTS = {
+    'role': ('role', 'joined_at', 'id'),
+    'name': ('user__username', 'id'),
+    'joined': ('joined_at', 'id'),
+    'income': ('-income', 'id'),
+    'expense': ('-expense', 'id'),
+    'count': ('-transaction_count', 'id'),
+}
+MEMBER_STAT_SORTS = ('income', 'expense', 'count')
+MEMBERS_PAGE_SIZE = 48
+
+
+def get_group_members(group: UserGroup, sort: str = 'role') -> QuerySet:
+    """
+    Returns the memberships of a group with their users and each member's income, expense and transaction count in it.
+
+    The totals are the member's share of the group ledger (BalanceSnapshot),
+    joined in the same query, so listing any number of members is one query.
+    """
+    share = FilteredRelation('user__balance_snapshots', condition=Q(user__balance_snapshots__group=F('group')))
+    money = DecimalField(max_digits=14, decimal_places=2)
+    return (
+        UserGroupMember.objects.filter(group=group)
+        .select_related('user')
+        .only('id', 'role', 'joined_at', 'group_id', 'user__id', 'user__username')
+        .annotate(
+            share=share,
+            income=Coalesce('share__income', Value(Decimal('0')), output_field=money),
+            expense=Coalesce('share__expense', Value(Decimal('0')), output_field=money),
+            transaction_count=Coalesce('share__count', Value(0), output_field=IntegerField()),
+        )
+        .order_by(*MEMBER_SORTS.get(sort, MEMBER_SORTS['role']))
+    )
+
+
+def get_group_summary(group: UserGroup) -> BalanceSummary:
+    """
+    Reads the financial balance of a group from the ledger.
+    """
+    return summarize_snapshots(BalanceSnapshot.objects.filter(group=group))
+
+
+def get_period_start(period: str) -> date | None:
+    """
+    Returns the first month covered by a reporting period, or None for all time.
+    """
+    this_month = timezone.localdate().replace(day=1)
+    if period == 'month':
+        return this_month
+    if period == '12m':
+        year, month = divmod(this_month.year * 12 + this_month.month - 1 - 11, 12)
+        return date(year, month + 1, 1)
+    return None
+
+
+def get_category_totals(user: User, t_type: str = 'expense', period: str = 'all',
+                        group: UserGroup | None = None) -> list[tuple[str | None, Decimal]]:
+    """
+    Returns (category name, total) pairs for a scope and period from the monthly rollups, largest first.
+
+    Without a group the user's personal transactions are reported, otherwise
+    the transactions of every member of the group.
+    """
+    rollups = CategoryRollup.objects.filter(t_type=t_type, count__gt=0)
+    rollups = rollups.filter(group=group) if group else rollups.filter(user=user, group=None)
+    since = get_period_start(period)
+    if since:
+        rollups = rollups.filter(month__gte=since)
+    rows = rollups.values('category__name').annotate(amount=Sum('total')).order_by('-amount')
+    return [(row['category__name'], row['amount']) for row in rows]
+
+
+EXPORT_HEADERS = ['ID', 'Type', 'Amount', 'Category', 'Description', 'Date']
+EXPORT_FIELDS = ('id', 't_type', 'amount', 'category__name', 'description', 'date')
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_STREAM_BLOCK_SIZE = 64 * 1024
+EXPORT_PROGRESS_INTERVAL = 5000
+
+
+def iter_export_rows(transactions: QuerySet, with_group: bool = False):
+    """
+    Yields spreadsheet rows for a transaction queryset, reading it with a server-side cursor.
+
+    With with_group, each row ends with the name of the transaction's group.
+    """
+    fields = EXPORT_FIELDS + ('group__name',) if with_group else EXPORT_FIELDS
+    rows = transactions.order_by('-date', '-id').values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for pk, t_type, amount, category_name, description, created, *group in rows:
+        yield [pk, t_type, float(amount), category_name or '', description, created.strftime('%Y-%m-%d'), *group]
+
+
+def write_transactions_workbook(user: User, fileobj, progress=None):
+    """
+    Writes a user's personal transactions and those of all their groups as an Excel workbook to a file object.
+
+    Uses a write-only workbook, so rows are flushed to disk as they are
+    appended and memory use does not grow with the number of transactions.
+    If given, progress(rows_written) is called every EXPORT_PROGRESS_INTERVAL rows.
+    """
+    wb = Workbook(write_only=True)
+    sheets = [("Personal Transactions", Transaction.objects.filter(user=user, group=None), False)]
+    group_ids = list(UserGroupMember.objects.filter(user=user).values_list('group_id', flat=True))
+    if group_ids:
+        group_rows = TransactionScans([Transaction.objects.filter(group=group_id) for group_id in group_ids])
+        sheets.append(("Group Transactions", group_rows, True))
+
+    written = 0
+    for title, transactions, with_group in sheets:
+        ws = wb.create_sheet(title=title)
+        ws.append(EXPORT_HEADERS + ['Group'] if with_group else EXPORT_HEADERS)
+        for row in iter_export_rows(transactions, with_group):
+            ws.append(row)
+            written += 1
+            if progress and written % EXPORT_PROGRESS_INTERVAL == 0:
+                progress(written)
+
+    wb.save(fileobj)
+    if progress:
+        progress(written)
+
+
+STREAM_FIELDS = ('id', 'date', 't_type', 'amount', 'category__name', 'description', 'group_id', 'user__username')
+STREAM_HEADERS = ['id', 'date', 'type', 'amount', 'category', 'description', 'group', 'user']
+STREAM_BATCH_SIZE = 500
+
+
+class TransactionScans:
+    """
+    Transactions of several scopes read as a UNION ALL of one scan per scope, newest first.
+
+    An OR of the scopes cannot be read in (date, id) order from any index, but
+    each scope can, from its own (scope, date, id) index, so the database only
+    has to merge the branches. filter() and values_list() apply to every
+    branch; slicing and iteration run the combined query.
+    """
+
+    def __init__(self, scans: list[QuerySet], ordering: tuple[str, ...] = ('-date', '-id')):
+        self.scans = scans or [Transaction.objects.none()]
+        self.ordering = ordering
+
+    def _map(self, method: str, *args, **kwargs) -> 'TransactionScans':
+        return TransactionScans([getattr(scan, method)(*args, **kwargs) for scan in self.scans], self.ordering)
+
+    def filter(self, *args, **kwargs) -> 'TransactionScans':
+        return self._map('filter', *args, **kwargs)
+
+    def values_list(self, *fields, **kwargs) -> 'TransactionScans':
+        return self._map('values_list', *fields, **kwargs)
+
+    def order_by(self, *fields) -> 'TransactionScans':
+        return TransactionScans(self.scans, fields)
+
+    def combined(self) -> QuerySet:
+        """
+        Return the single query that merges the scans in order.
+        """
+        first, *rest = self.scans
+        if rest:
+            first = first.union(*rest, all=True)
+        return first.order_by(*self.ordering)
+
+    def count(self) -> int:
+        return sum(scan.count() for scan in self.scans)
+
+    def iterator(self, chunk_size: int | None = None):
+        return self.combined().iterator(chunk_size=chunk_size)
+
+    def __iter__(self):
+        return iter(self.combined())
+
+    def __getitem__(self, key):
+        return self.combined()[key]
+
+
+def filter_transactions(user: User, filters: dict) -> TransactionScans:
+    """
+    Returns the transactions visible to a user that match cleaned TransactionQueryForm data.
+
+    Personal transactions and every group are read as separate scans.
+    """
+    scope = filters.get('scope') or 'all'
+    group = filters.get('group')
+    scans = []
+    if scope != 'group' and not group:
+        scans.append(Transaction.objects.filter(user=user, group=None))
+    if scope != 'personal' or group:
+        group_ids = [group.pk] if group else UserGroupMember.objects.filter(user=user).values_list('group_id', flat=True)
+        scans += [Transaction.objects.filter(group=group_id) for group_id in group_ids]
+
+    transactions = TransactionScans(scans)
+    if filters.get('date_from'):
+        start = timezone.make_aware(datetime.combine(filters['date_from'], time.min))
+        transactions = transactions.filter(date__gte=start)
+    if filters.get('date_to'):
+        end = timezone.make_aware(datetime.combine(filters['date_to'] + timedelta(days=1), time.min))
+        transactions = transactions.filter(date__lt=end)
+    if filters.get('t_type'):
+        transactions = transactions.filter(t_type=filters['t_type'])
+    if filters.get('category'):
+        transactions = transactions.filter(category=filters['category'])
+    if filters.get('amount_min') is not None:
+        transactions = transactions.filter(amount__gte=filters['amount_min'])
+    if filters.get('amount_max') is not None:
+        transactions = transactions.filter(amount__lte=filters['amount_max'])
+    return transactions
+
+
+def _iter_stream_rows(transactions: QuerySet):
+    rows = transactions.order_by('-date', '-id').values_list(*STREAM_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for pk, created, t_type, amount, category_name, description, group_id, username in rows:
+        yield [pk, created.isoformat(), t_type, str(amount), category_name or '', description, group_id, username]
+
+
+def _batched(lines, size: int = STREAM_BATCH_SIZE):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+class _Echo:
+    """
+    A file-like object whose write() returns the written value, for streaming csv.writer output.
+    """
+
+    def write(self, value):
+        return value
+
+
+def iter_transactions_csv(transactions: QuerySet):
+    """
+    Yields a CSV export of a transaction queryset, the header first and then batches of rows.
+    """
+    writer = csv.writer(_Echo())
+    # The header goes out before the query runs, so the client gets its first byte immediately.
+    yield writer.writerow(STREAM_HEADERS)
+    yield from _batched(writer.writerow(row) for row in _iter_stream_rows(transactions))
+
+
+def iter_transactions_ndjson(transactions: QuerySet):
+    """
+    Yields a newline-delimited JSON export of a transaction queryset in batches of rows.
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    yield from _batched(
+        encoder.encode(dict(zip(STREAM_HEADERS, row))) + '\n' for row in _iter_stream_rows(transactions)
+    )
 
 
 def create_group_and_add_admin(name: str, user: User) -> UserGroup:
@@ -0,0 +1,160 @@
+from django.db.models.signals import post_init, pre_save, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from . import ledger, suggestions
+from .authentication import evict_token, evict_user
+from .cache import bump_versions
+from .models import Transaction, UserGroup, UserGroupMember, Category, User
+from .sync import record_deletions, record_moves
+
+
+@receiver(post_init, sender=Transaction)
+def remember_ledger_entry(sender, instance, **kwargs):
+    """
+    Remember the loaded state of a transaction so edits can be turned into ledger and suggester deltas.
+    """
+    instance._ledger_entry = ledger.entry_for(instance)
+    instance._suggestion_entry = suggestions.entry_for(instance)
+
+
+@receiver(pre_save, sender=Transaction)
+def capture_previous_entry(sender, instance, **kwargs):
+    """
+    Resolve the state a transaction had before it is written.
+    """
+    if instance._state.adding:
+        instance._ledger_previous = None
+        instance._suggestion_previous = None
+        return
+    if instance._ledger_entry is not None:
+        instance._ledger_previous = instance._ledger_entry
+    else:
+        instance._ledger_previous = ledger.load_entry(instance.pk)
+    if instance._suggestion_entry is not None:
+        instance._suggestion_previous = instance._suggestion_entry
+    else:
+        instance._suggestion_previous = suggestions.load_entry(instance.pk)
+
+
+@receiver(post_save, sender=Transaction)
+def update_ledger_on_save(sender, instance, **kwargs):
+    """
+    Apply a created or edited transaction to the balance ledger.
+    """
+    # Instances with deferred fields only write the loaded ones, so the stored row is read back.
+    current = ledger.entry_for(instance) or ledger.load_entry(instance.pk)
+    previous = getattr(instance, '_ledger_previous', None)
+    ledger.record_change(previous, current)
+    record_moves([(instance.pk, previous, current)])
+    instance._ledger_entry = current
+
+    current = suggestions.entry_for(instance) or suggestions.load_entry(instance.pk)
+    suggestions.record_change(getattr(instance, '_suggestion_previous', None), current)
+    instance._suggestion_entry = current
+
+
+@receiver(pre_delete, sender=Transaction)
+def capture_deleted_entry(sender, instance, **kwargs):
+    """
+    Resolve the stored state of a transaction about to be deleted, also when some of its fields are deferred.
+    """
+    instance._ledger_deleted = instance._ledger_entry or ledger.load_entry(instance.pk)
+    instance._suggestion_deleted = instance._suggestion_entry or suggestions.load_entry(instance.pk)
+
+
+@receiver(post_delete, sender=Transaction)
+def update_ledger_on_delete(sender, instance, **kwargs):
+    """
+    Remove a deleted transaction from the balance ledger.
+    """
+    previous = getattr(instance, '_ledger_deleted', None)
+    ledger.record_change(previous, None)
+    if previous is not None:
+        record_deletions('transaction', [(instance.pk, previous.user_id, previous.group_id)])
+    suggestions.record_change(getattr(instance, '_suggestion_deleted', None), None)
+
+
+@receiver(pre_delete, sender=UserGroup)
+def fold_group_ledger(sender, instance, **kwargs):
+    """
+    Move a deleted group's balances and rollups to its members' personal scope.
+    """
+    ledger.fold_group(instance.pk)
+    # The group is cleared with a queryset update, so the rows are marked as changed for delta sync here.
+    now = timezone.now()
+    Transaction.objects.filter(group=instance).update(updated_at=now)
+    Category.objects.filter(group=instance).update(updated_at=now)
+
+
+@receiver(pre_delete, sender=Category)
+def fold_category_ledger(sender, instance, **kwargs):
+    """
+    Move a deleted category's rollups to the uncategorized bucket.
+    """
+    ledger.fold_category(instance.pk)
+    Transaction.objects.filter(category=instance).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def bump_category_version(sender, instance, **kwargs):
+    """
+    Invalidate cached data of the scope that owns a changed category.
+    """
+    bump_versions(
+        user_ids=[instance.user_id],
+        group_ids=[instance.group_id],
+        global_categories=instance.user_id is None,
+    )
+
+
+@receiver(post_save, sender=UserGroupMember)
+@receiver(post_delete, sender=UserGroupMember)
+def bump_membership_version(sender, instance, **kwargs):
+    """
+    Invalidate cached data of both the member and the group when a membership changes.
+    """
+    bump_versions(user_ids=[instance.user_id], group_ids=[instance.group_id])
+
+
+@receiver(post_save, sender=UserGroup)
+def bump_group_version(sender, instance, **kwargs):
+    """
+    Invalidate cached data that shows a renamed group.
+    """
+    bump_versions(group_ids=[instance.pk])
+
+
+@receiver(post_delete, sender=Category)
+def record_category_tombstone(sender, instance, **kwargs):
+    """
+    Record a deleted category for delta sync.
+    """
+    record_deletions('category', [(instance.pk, instance.user_id, instance.group_id)])
+
+
+@receiver(post_delete, sender=UserGroupMember)
+def record_membership_tombstone(sender, instance, **kwargs):
+    """
+    Record a left, kicked or cascaded membership for delta sync.
+    """
+    record_deletions('membership', [(instance.pk, instance.user_id, instance.group_id)])
+
+
+@receiver(post_delete, sender=Token)
+def evict_deleted_token(sender, instance, **kwargs):
+    """
+    Stop serving a deleted or rotated API token from the authentication cache.
+    """
+    evict_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_user_token(sender, instance, **kwargs):
+    """
+    Drop the cached token of a changed user, so deactivation takes effect on the next request.
+    """
+    evict_user(instance.pk)
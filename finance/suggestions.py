@@ -0,0 +1,227 @@
+"""
+Category suggestions from transaction descriptions.
+
+Every personal account and every group has its own multinomial naive Bayes
+classifier over the words of the descriptions of its categorized
+transactions. A classifier is trained from the latest SUGGESTER_TRAINING_LIMIT
+transactions when it is first needed, kept in the cache and then updated
+incrementally: transaction writes add and remove their word counts once
+their database transaction commits. Updates are read-modify-write on the
+cache, so concurrent writers may lose one; SUGGESTER_TIMEOUT bounds how long
+such drift lasts before the classifier is retrained.
+
+Only categories the user can still pick and that match the transaction
+type are suggested.
+"""
+import math
+import re
+from collections import Counter
+from functools import partial
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .catalog import CatalogEntry, user_categories
+from .models import Transaction, User, UserGroup
+
+SUGGESTION_FIELDS = ('user_id', 'group_id', 'category_id', 'description')
+SUGGESTER_TRAINING_LIMIT = 5000
+SUGGESTER_TIMEOUT = 24 * 60 * 60
+SUGGESTION_LIMIT = 3
+# Imports and the backfill command only apply suggestions at least this likely.
+SUGGESTION_MIN_CONFIDENCE = 0.6
+SMOOTHING = 1.0
+
+_WORD = re.compile(r'[^\W\d_]{2,}')
+
+
+class SuggestionEntry(NamedTuple):
+    """
+    The part of a transaction the category suggester learns from.
+    """
+    user_id: int
+    group_id: int | None
+    category_id: int | None
+    description: str
+
+
+def tokenize(description: str) -> Counter:
+    """
+    Return the words of a description with their number of occurrences; digits and punctuation are dropped.
+    """
+    return Counter(_WORD.findall((description or '').casefold()))
+
+
+class CategorySuggester:
+    """
+    Multinomial naive Bayes classifier mapping description words to category ids, stored as sparse counts.
+    """
+
+    def __init__(self):
+        self.documents = Counter()  # category -> transactions
+        self.words = {}  # category -> word -> occurrences
+        self.totals = Counter()  # category -> word occurrences
+        self.vocabulary = Counter()  # word -> occurrences in all categories
+
+    def learn(self, category_id: int | None, description: str, sign: int = 1) -> None:
+        """
+        Add (sign=1) or remove (sign=-1) a categorized description.
+        """
+        words = tokenize(description)
+        if category_id is None or not words:
+            return
+        counts = self.words.setdefault(category_id, Counter())
+        for word, occurrences in words.items():
+            counts[word] += sign * occurrences
+            self.vocabulary[word] += sign * occurrences
+            if counts[word] <= 0:
+                del counts[word]
+            if self.vocabulary[word] <= 0:
+                del self.vocabulary[word]
+        self.documents[category_id] += sign
+        self.totals[category_id] += sign * words.total()
+        if self.documents[category_id] <= 0 or not counts:
+            del self.documents[category_id], self.totals[category_id], self.words[category_id]
+
+    def predict(self, description: str, category_ids=None) -> list[tuple[int, float]]:
+        """
+        Return (category id, probability) pairs for a description, most likely first.
+
+        Only words seen in training count, and nothing is returned unless the
+        best category has seen one of them. category_ids restricts the candidates.
+        """
+        words = {word: occurrences for word, occurrences in tokenize(description).items() if word in self.vocabulary}
+        candidates = [pk for pk in self.documents if category_ids is None or pk in category_ids]
+        if not words or not candidates:
+            return []
+        size = len(self.vocabulary)
+        documents = sum(self.documents[pk] for pk in candidates)
+        scores = {}
+        for pk in candidates:
+            counts = self.words[pk]
+            denominator = math.log(self.totals[pk] + SMOOTHING * size)
+            scores[pk] = math.log(self.documents[pk] / documents) + sum(
+                occurrences * (math.log(counts.get(word, 0) + SMOOTHING) - denominator)
+                for word, occurrences in words.items()
+            )
+        best = max(scores.values())
+        weights = {pk: math.exp(score - best) for pk, score in scores.items()}
+        total = sum(weights.values())
+        ranked = sorted(((pk, weight / total) for pk, weight in weights.items()), key=lambda item: -item[1])
+        if not any(word in self.words[ranked[0][0]] for word in words):
+            return []
+        return ranked
+
+
+def scope_key(user_id: int, group_id: int | None) -> str:
+    """
+    Return the cache key of the classifier of a group, or of a user's personal transactions.
+    """
+    return f'finance:suggester:group:{group_id}' if group_id else f'finance:suggester:user:{user_id}'
+
+
+def train(user_id: int, group_id: int | None) -> CategorySuggester:
+    """
+    Train a classifier from the latest categorized transactions of a scope.
+    """
+    transactions = Transaction.objects.filter(group_id=group_id) if group_id else \
+        Transaction.objects.filter(user_id=user_id, group=None)
+    rows = (transactions.filter(category__isnull=False).exclude(description='')
+            .order_by('-id').values_list('category_id', 'description')[:SUGGESTER_TRAINING_LIMIT])
+    suggester = CategorySuggester()
+    for category_id, description in rows:
+        suggester.learn(category_id, description)
+    return suggester
+
+
+def get_suggester(user: User, group: UserGroup | None = None) -> CategorySuggester:
+    """
+    Return the cached classifier of a group, or of the user's personal transactions, training it if needed.
+    """
+    key = scope_key(user.pk, group.pk if group else None)
+    suggester = cache.get(key)
+    if suggester is None:
+        suggester = train(user.pk, group.pk if group else None)
+        cache.set(key, suggester, SUGGESTER_TIMEOUT)
+    return suggester
+
+
+def suggest_categories(user: User, description: str, group: UserGroup | None = None, t_type: str | None = None,
+                       limit: int = SUGGESTION_LIMIT) -> list[tuple[CatalogEntry, float]]:
+    """
+    Return up to limit (category, probability) suggestions for a new transaction of a user.
+    """
+    entries = {
+        entry.pk: entry for entry in user_categories(user)
+        if t_type is None or entry.is_income == (t_type == 'income')
+    }
+    predictions = get_suggester(user, group).predict(description, entries)
+    return [(entries[pk], probability) for pk, probability in predictions[:limit]]
+
+
+def confident_suggester(user: User, group: UserGroup | None = None, min_confidence: float = SUGGESTION_MIN_CONFIDENCE):
+    """
+    Return a function mapping (description, t_type) to a suggested category id, or None below min_confidence.
+
+    The classifier and the categories are read once, for bulk work.
+    """
+    suggester = get_suggester(user, group)
+    by_type = {t_type: set() for t_type, label in Transaction.TYPE_CHOICES}
+    for entry in user_categories(user):
+        by_type['income' if entry.is_income else 'expense'].add(entry.pk)
+
+    def suggest(description: str, t_type: str) -> int | None:
+        predictions = suggester.predict(description, by_type.get(t_type, ()))
+        if predictions and predictions[0][1] >= min_confidence:
+            return predictions[0][0]
+        return None
+    return suggest
+
+
+def entry_for(instance: Transaction) -> SuggestionEntry | None:
+    """
+    Return the suggestion entry of a transaction, or None if its fields are not loaded.
+    """
+    values = instance.__dict__
+    if any(field not in values for field in SUGGESTION_FIELDS):
+        return None
+    return SuggestionEntry(*(values[field] for field in SUGGESTION_FIELDS))
+
+
+def load_entry(pk: int) -> SuggestionEntry | None:
+    """
+    Read the stored suggestion entry of a transaction from the database.
+    """
+    row = Transaction.objects.filter(pk=pk).values_list(*SUGGESTION_FIELDS).first()
+    return SuggestionEntry(*row) if row else None
+
+
+def record_many(entries, sign: int = 1) -> None:
+    """
+    Add or remove the contributions of many transactions to the cached classifiers once the transaction commits.
+    """
+    changes = [(entry, sign) for entry in entries if entry is not None and entry.category_id and entry.description]
+    if changes:
+        transaction.on_commit(partial(_apply, changes))
+
+
+def record_change(previous: SuggestionEntry | None, current: SuggestionEntry | None) -> None:
+    """
+    Move a transaction's contribution from its previous state to its current state.
+    """
+    if previous != current:
+        record_many([previous], -1)
+        record_many([current], 1)
+
+
+def _apply(changes) -> None:
+    # Classifiers that are not cached are trained from the committed data when needed.
+    keys = {scope_key(entry.user_id, entry.group_id) for entry, sign in changes}
+    suggesters = cache.get_many(keys)
+    for entry, sign in changes:
+        suggester = suggesters.get(scope_key(entry.user_id, entry.group_id))
+        if suggester is not None:
+            suggester.learn(entry.category_id, entry.description, sign)
+    if suggesters:
+        cache.set_many(suggesters, SUGGESTER_TIMEOUT)
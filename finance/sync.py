@@ -0,0 +1,174 @@
+"""
+Delta sync of the transactions, categories and group memberships a user can see.
+
+A sync token is a signed (since, start, cursor) triple. `since` is the time
+the previous sync cycle started, `start` the time the current one started
+and `cursor` the (updated_at, id) of the last transaction sent when a cycle
+spans several pages. Changes are found through the `updated_at` columns and
+deletions through Tombstone rows, so a sync reads only what changed.
+
+Clients apply `deleted` before the changed rows. A deleted membership of the
+requesting user means the data of that group is no longer visible to them.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from django.core import signing
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Category, Tombstone, Transaction, User, UserGroupMember
+from .serializers import CategorySerializer, UserGroupMemberSerializer, transaction_rows
+
+SYNC_PAGE_SIZE = 500
+SYNC_MAX_PAGE_SIZE = 2000
+# Rows are stamped before their transaction commits, so each cycle looks back a little.
+SYNC_OVERLAP = timedelta(seconds=60)
+TOMBSTONE_RETENTION = timedelta(days=90)
+SYNC_TOKEN_SALT = 'finance.sync'
+
+
+class InvalidSyncToken(Exception):
+    """
+    Raised for a sync token that was not issued by this server.
+    """
+
+
+@dataclass
+class SyncPage:
+    """
+    The changes returned for one sync request.
+    """
+    token: str
+    has_more: bool
+    reset: bool
+    transactions: list = field(default_factory=list)
+    categories: list = field(default_factory=list)
+    memberships: list = field(default_factory=list)
+    deleted: dict = field(default_factory=dict)
+
+
+def record_deletions(model: str, scopes) -> None:
+    """
+    Store tombstones for deleted rows given as (object_id, user_id, group_id) triples.
+    """
+    Tombstone.objects.bulk_create(
+        Tombstone(model=model, object_id=pk, user_id=user_id, group_id=group_id) for pk, user_id, group_id in scopes
+    )
+
+
+def record_moves(changes) -> None:
+    """
+    Store tombstones for transactions that left a group or personal scope, given as (pk, previous, current) entries.
+    """
+    record_deletions('transaction', [
+        (pk, previous.user_id, previous.group_id)
+        for pk, previous, current in changes
+        if previous is not None and current is not None and previous.group_id != current.group_id
+    ])
+
+
+def encode_token(since: datetime | None, start: datetime, cursor: tuple[datetime, int] | None = None) -> str:
+    """
+    Return the signed token describing a sync position.
+    """
+    return signing.dumps({
+        'since': since.isoformat() if since else None,
+        'start': start.isoformat(),
+        'cursor': [cursor[0].isoformat(), cursor[1]] if cursor else None,
+    }, salt=SYNC_TOKEN_SALT, compress=True)
+
+
+def decode_token(token: str):
+    """
+    Return the (since, start, cursor) of a token, raising InvalidSyncToken if it is malformed or tampered with.
+    """
+    try:
+        payload = signing.loads(token, salt=SYNC_TOKEN_SALT)
+        since = datetime.fromisoformat(payload['since']) if payload['since'] else None
+        start = datetime.fromisoformat(payload['start'])
+        cursor = payload['cursor']
+        if cursor is not None:
+            cursor = (datetime.fromisoformat(cursor[0]), int(cursor[1]))
+    except (signing.BadSignature, KeyError, TypeError, ValueError, IndexError):
+        raise InvalidSyncToken("Invalid sync token.")
+    return since, start, cursor
+
+
+def sync_changes(user: User, token: str | None = None, page_size: int = SYNC_PAGE_SIZE) -> SyncPage:
+    """
+    Return the changes visible to a user since the position described by token, or everything if it is None.
+
+    Categories, memberships and deletions come with the first page of a
+    cycle; transactions are paged by (updated_at, id) until has_more is false.
+    """
+    now = timezone.now()
+    since, start, cursor = decode_token(token) if token else (None, now, None)
+    if since is not None and since - SYNC_OVERLAP < now - TOMBSTONE_RETENTION:
+        # Deletions since then may already be pruned: start over with a full sync.
+        since, cursor = None, None
+    if cursor is None:
+        start = now
+    lower = since - SYNC_OVERLAP if since else None
+
+    memberships = list(UserGroupMember.objects.filter(user=user).values_list('group_id', 'joined_at'))
+    group_ids = [group_id for group_id, joined_at in memberships]
+    # Everything of a group joined during this cycle is new to the client.
+    new_group_ids = [group_id for group_id, joined_at in memberships if lower is None or joined_at > lower]
+    old_group_ids = [group_id for group_id in group_ids if group_id not in new_group_ids]
+
+    if lower is None:
+        changed = Q(user=user, group=None) | Q(group__in=group_ids)
+    else:
+        changed = (Q(user=user, group=None, updated_at__gt=lower) | Q(group__in=old_group_ids, updated_at__gt=lower)
+                   | Q(group__in=new_group_ids))
+    transactions = Transaction.objects.filter(changed, updated_at__lte=start)
+    if cursor is not None:
+        updated_at, pk = cursor
+        transactions = transactions.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=pk))
+    rows = list(transactions.order_by('updated_at', 'id').values_list(*transaction_rows.columns, named=True)[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    page = SyncPage(
+        token=encode_token(since, start, (rows[-1].updated_at, rows[-1].id)) if has_more else encode_token(start, start),
+        has_more=has_more,
+        reset=lower is None and cursor is None,
+        transactions=transaction_rows.serialize(rows),
+        deleted={'transactions': [], 'categories': [], 'memberships': []},
+    )
+    if cursor is None:
+        # The same scope as finance.catalog.user_categories: global, own and group categories.
+        categories = Category.objects.filter(Q(user=user) | Q(user=None) | Q(group__in=group_ids))
+        members = UserGroupMember.objects.filter(group__in=group_ids)
+        if lower is not None:
+            categories = categories.filter(Q(updated_at__gt=lower) | Q(group__in=new_group_ids))
+            members = members.filter(Q(updated_at__gt=lower) | Q(group__in=new_group_ids))
+            _collect_deleted(page.deleted, user, group_ids, lower)
+        page.categories = CategorySerializer(categories.order_by('id'), many=True).data
+        page.memberships = UserGroupMemberSerializer(members.order_by('id'), many=True).data
+    return page
+
+
+def _collect_deleted(deleted: dict, user: User, group_ids: list[int], lower: datetime) -> None:
+    visible = (
+        Q(model='transaction') & (Q(user=user, group=None) | Q(group__in=group_ids))
+        | Q(model='category') & (Q(user=user) | Q(user=None) | Q(group__in=group_ids))
+        | Q(model='membership') & (Q(user=user) | Q(group__in=group_ids))
+    )
+    tombstones = Tombstone.objects.filter(visible, deleted_at__gt=lower).order_by('id').values_list('model', 'object_id')
+    keys = {'transaction': 'transactions', 'category': 'categories', 'membership': 'memberships'}
+    seen = {key: {} for key in deleted}
+    for model, object_id in tombstones:
+        seen[keys[model]][object_id] = None
+    for key, ids in seen.items():
+        deleted[key] = list(ids)
+
+
+def prune_tombstones(now: datetime | None = None) -> int:
+    """
+    Delete tombstones older than the retention period and return how many were removed.
+    """
+    cutoff = (now or timezone.now()) - TOMBSTONE_RETENTION
+    deleted, _ = Tombstone.objects.filter(deleted_at__lt=cutoff).delete()
+    return deleted
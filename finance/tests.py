@@ -1,3 +1,1858 @@
-from django.test import TestCase
+import csv
+import json
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db.models import Q
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+from rest_framework import generics
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from finance.api_views import FastListMixin, IncomeListAPI
+from finance.authentication import token_cache_key
+from finance.checks import check_shared_cache
+from finance.forms import TransactionForm
+from finance.jobs import (EXPORT_EXPIRED_ERROR, EXPORT_FAILED_ERROR, expire_stale_jobs, get_export_version,
+                         request_export, run_export_job)
+from finance.memberships import Memberships
+from finance import catalog
+from finance.cache import dashboard_stats
+from finance import ledger, suggestions
+from finance.models import Transaction, UserGroupMember, BalanceSnapshot, Category, CategoryRollup, ExportJob, Tombstone
+from finance.pagination import keyset_query, paginate_keyset, decode_cursor
+from finance.renderers import FastJSONRenderer
+from finance.services import (
+    create_group_and_add_admin, get_group_balances, get_group_summaries, get_personal_balance, summarize_transactions, get_category_totals,
+    write_transactions_workbook, leave_group, filter_transactions, get_group_transactions, get_personal_transactions,
+    STREAM_FIELDS,
+)
+from finance.suggestions import get_suggester, suggest_categories
+from finance.sync import TOMBSTONE_RETENTION, encode_token
+from finance.throttling import USAGE_PERIOD, record_usage, throttle_cache, top_consumers
+
+User = get_user_model()
+
+
+class BalanceServiceTests(TestCase):
+    """
+    Tests for the single-query balance summaries.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        UserGroupMember.objects.create(user=cls.other, group=cls.group)
+
+        Transaction.objects.create(user=cls.user, t_type='income', amount=Decimal('100.00'))
+        Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('30.50'))
+        Transaction.objects.create(user=cls.user, group=cls.group, t_type='expense', amount=Decimal('20.00'))
+        Transaction.objects.create(user=cls.other, group=cls.group, t_type='income', amount=Decimal('50.00'))
+        Transaction.objects.create(user=cls.other, t_type='income', amount=Decimal('999.00'))
+
+    def test_personal_balance_is_one_query(self):
+        with self.assertNumQueries(1):
+            summary = get_personal_balance(self.user)
+        self.assertEqual(summary.income, Decimal('100.00'))
+        self.assertEqual(summary.expense, Decimal('30.50'))
+        self.assertEqual(summary.balance, Decimal('69.50'))
+        self.assertEqual(summary.count, 2)
+
+    def test_group_balance_is_one_query_after_membership_lookup(self):
+        # One query resolves the memberships, one computes the totals of all groups.
+        with self.assertNumQueries(2):
+            [(group, summary)] = get_group_balances(self.user)
+        self.assertEqual(group, self.group)
+        self.assertEqual(summary.income, Decimal('50.00'))
+        self.assertEqual(summary.expense, Decimal('20.00'))
+        self.assertEqual(summary.count, 2)
+
+    def test_empty_scope_returns_zero_summary(self):
+        loner = User.objects.create_user(username='newt', password='pass', email='newt@example.com')
+        summary = get_personal_balance(loner)
+        self.assertEqual((summary.income, summary.expense, summary.balance, summary.count), (0, 0, 0, 0))
+        self.assertEqual(get_group_balances(loner), [])
+
+    def test_summarize_arbitrary_queryset(self):
+        with self.assertNumQueries(1):
+            summary = summarize_transactions(Transaction.objects.filter(user=self.user, t_type='income'))
+        self.assertEqual(summary.income, Decimal('100.00'))
+        self.assertEqual(summary.expense, Decimal('0'))
+
+    def test_dashboard_shows_summaries(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['personal_summary'].balance, Decimal('69.50'))
+        self.assertEqual(response.context['groups'][0][1].balance, Decimal('30.00'))
+
+
+class BalanceLedgerTests(TestCase):
+    """
+    Tests for the incrementally maintained BalanceSnapshot ledger.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+
+    def assertLedgerConsistent(self):
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_create_edit_and_delete_update_snapshot(self):
+        transaction = Transaction.objects.create(user=self.user, t_type='income', amount=Decimal('40.00'))
+        self.assertEqual(get_personal_balance(self.user).income, Decimal('40.00'))
+
+        transaction.t_type = 'expense'
+        transaction.amount = Decimal('15.00')
+        transaction.save()
+        summary = get_personal_balance(self.user)
+        self.assertEqual((summary.income, summary.expense, summary.count), (0, Decimal('15.00'), 1))
+
+        transaction.group = self.group
+        transaction.save()
+        self.assertEqual(get_personal_balance(self.user).count, 0)
+        self.assertEqual(get_group_balances(self.user)[0][1].expense, Decimal('15.00'))
+
+        transaction.delete()
+        self.assertEqual(get_group_balances(self.user)[0][1].count, 0)
+        self.assertLedgerConsistent()
+
+    def test_instances_with_deferred_fields_keep_the_ledger_correct(self):
+        Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('12.00'), description='Flies')
+
+        partial = Transaction.objects.only('id', 'description').get()
+        partial.description = 'More flies'
+        partial.save()
+        summary = get_personal_balance(self.user)
+        self.assertEqual((summary.expense, summary.count), (Decimal('12.00'), 1))
+        self.assertLedgerConsistent()
+
+        Transaction.objects.only('id').get().delete()
+        summary = get_personal_balance(self.user)
+        self.assertEqual((summary.expense, summary.count), (0, 0))
+        self.assertLedgerConsistent()
+        self.assertTrue(Tombstone.objects.filter(model='transaction', user=self.user).exists())
+
+    def test_deleting_group_moves_balance_to_personal(self):
+        Transaction.objects.create(user=self.user, group=self.group, t_type='income', amount=Decimal('10.00'))
+        self.group.delete()
+        self.assertEqual(get_personal_balance(self.user).income, Decimal('10.00'))
+        self.assertLedgerConsistent()
+
+    def test_rebuild_repairs_drift(self):
+        Transaction.objects.create(user=self.user, t_type='income', amount=Decimal('5.00'))
+        BalanceSnapshot.objects.update(income=Decimal('999.00'))
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('dashboard')).context['personal_summary'].income, Decimal('999.00'))
+        with self.assertRaises(CommandError):
+            call_command('rebuild_balances', check=True, stdout=StringIO())
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(get_personal_balance(self.user).income, Decimal('5.00'))
+        # Cached dashboards are invalidated by the rebuild.
+        self.assertEqual(self.client.get(reverse('dashboard')).context['personal_summary'].income, Decimal('5.00'))
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    Tests for (date, id) cursor pagination.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        same_moment = timezone.now()
+        for i in range(7):
+            # Shared timestamps make sure ties are broken by id.
+            Transaction.objects.create(user=cls.user, t_type='income', amount=i + 1, date=same_moment if i % 2 else timezone.now())
+
+    def test_pages_cover_all_rows_once(self):
+        queryset = Transaction.objects.filter(user=self.user)
+        seen, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                page = paginate_keyset(queryset, cursor, page_size=3)
+            seen.extend(item.pk for item in page.items)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        expected = list(queryset.order_by('-date', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursor_falls_back_to_first_page(self):
+        self.assertIsNone(decode_cursor('not-a-cursor'))
+        self.assertTrue(paginate_keyset(Transaction.objects.all(), '%%%').is_first)
+
+    def test_income_list_total_covers_all_pages(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('income_list'), {'cursor': paginate_keyset(
+            Transaction.objects.filter(user=self.user), page_size=2).next_cursor})
+        self.assertEqual(response.context['total_income'], Decimal('28.00'))
+        self.assertFalse(response.context['page'].is_first)
+
+
+class CategoryRollupTests(TestCase):
+    """
+    Tests for the monthly category rollups behind the dashboard chart.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.food = Category.objects.create(user=cls.user, name='Flies')
+        cls.fun = Category.objects.create(user=cls.user, name='Lily pads')
+        now = timezone.now()
+        Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('12.00'), category=cls.food)
+        Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('3.00'), category=cls.food,
+                                   date=now - timedelta(days=800))
+        Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('5.00'), category=cls.fun)
+        Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('1.00'))
+
+    def test_totals_by_period(self):
+        with self.assertNumQueries(1):
+            totals = get_category_totals(self.user, 'expense', 'all')
+        self.assertEqual(totals, [('Flies', Decimal('15.00')), ('Lily pads', Decimal('5.00')), (None, Decimal('1.00'))])
+        self.assertEqual(get_category_totals(self.user, 'expense', 'month')[0], ('Flies', Decimal('12.00')))
+
+    def test_recategorizing_and_deleting_category_moves_totals(self):
+        transaction = Transaction.objects.get(category=self.fun)
+        transaction.category = self.food
+        transaction.save()
+        self.assertEqual(get_category_totals(self.user, 'expense', 'all')[0], ('Flies', Decimal('20.00')))
+
+        self.food.delete()
+        self.assertEqual(get_category_totals(self.user, 'expense', 'all'), [(None, Decimal('21.00'))])
+        call_command('rebuild_balances', check=True, stdout=StringIO())
+
+    def test_dashboard_period_selection(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('dashboard'), {'period': '12m'})
+        self.assertEqual(response.context['chart_period'], '12m')
+        self.assertEqual(json.loads(response.context['chart_data']), [12.0, 5.0, 1.0])
+
+
+class DashboardCacheTests(TestCase):
+    """
+    Tests for the versioned dashboard cache.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get_dashboard(self, **params):
+        return self.client.get(reverse('dashboard'), params)
+
+    def test_repeat_view_is_served_from_cache(self):
+        self.assertEqual(self.get_dashboard()['X-Dashboard-Cache'], 'miss')
+        with self.assertNumQueries(2):
+            # Session and user; no finance data queries, the filter form's categories come from the catalog.
+            response = self.get_dashboard()
+        self.assertEqual(response['X-Dashboard-Cache'], 'hit')
+
+    def test_personal_transaction_invalidates_cache(self):
+        self.get_dashboard()
+        Transaction.objects.create(user=self.user, t_type='income', amount=Decimal('7.00'))
+        response = self.get_dashboard()
+        self.assertEqual(response['X-Dashboard-Cache'], 'miss')
+        self.assertEqual(response.context['personal_summary'].income, Decimal('7.00'))
+
+    def test_group_transaction_by_other_member_invalidates_cache(self):
+        UserGroupMember.objects.create(user=self.other, group=self.group)
+        self.get_dashboard()
+        Transaction.objects.create(user=self.other, group=self.group, t_type='expense', amount=Decimal('2.00'))
+        response = self.get_dashboard()
+        self.assertEqual(response['X-Dashboard-Cache'], 'miss')
+        self.assertEqual(response.context['groups'][0][1].expense, Decimal('2.00'))
+
+    def test_membership_change_invalidates_cache(self):
+        self.get_dashboard()
+        UserGroupMember.objects.filter(user=self.user).delete()
+        response = self.get_dashboard()
+        self.assertEqual(response['X-Dashboard-Cache'], 'miss')
+        self.assertEqual(response.context['groups'], [])
+
+    def test_stats_count_hits_and_misses(self):
+        before = dashboard_stats.as_dict()
+        self.get_dashboard()
+        self.get_dashboard()
+        after = dashboard_stats.as_dict()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+
+class MultiGroupDashboardTests(TestCase):
+    """
+    Tests for the dashboard of a user who belongs to several groups.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.outsider = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.pond = create_group_and_add_admin('Pond', cls.user)
+        cls.swamp = create_group_and_add_admin('Swamp', cls.user)
+        cls.river = create_group_and_add_admin('River', cls.outsider)
+        Transaction.objects.create(user=cls.user, group=cls.pond, t_type='income', amount=Decimal('4.00'))
+        Transaction.objects.create(user=cls.user, group=cls.swamp, t_type='expense', amount=Decimal('6.00'))
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_balances_of_all_groups_in_one_query(self):
+        with self.assertNumQueries(1):
+            summaries = get_group_summaries([self.pond, self.swamp])
+        self.assertEqual(summaries[self.pond.pk].income, Decimal('4.00'))
+        self.assertEqual(summaries[self.swamp.pk].expense, Decimal('6.00'))
+
+    def test_group_id_selects_expanded_group(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([group for group, summary in response.context['groups']], [self.pond, self.swamp])
+        self.assertEqual(response.context['expanded_group'], self.pond)
+
+        response = self.client.get(reverse('dashboard'), {'group_id': self.swamp.pk})
+        self.assertEqual(response.context['expanded_group'], self.swamp)
+        self.assertEqual(response.context['group_page'].items[0].amount, Decimal('6.00'))
+
+        response = self.client.get(reverse('dashboard'), {'group_id': self.river.pk})
+        self.assertEqual(response.context['expanded_group'], self.pond)
+
+    def test_group_table_fragment_requires_membership(self):
+        response = self.client.get(reverse('group_transactions', args=[self.swamp.pk]))
+        self.assertEqual(response.context['group_page'].items[0].amount, Decimal('6.00'))
+        response = self.client.get(reverse('group_transactions', args=[self.river.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN regression tests for the hot transaction queries.
+
+    Each query must be answered from an index, without a sequential scan of
+    the transaction table or a separate sort step. On PostgreSQL sequential
+    scans are disabled for the test so the small seeded dataset does not hide
+    a missing index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(username=f'frog{i}', password='pass', email=f'frog{i}@example.com')
+            for i in range(4)
+        ]
+        cls.group = create_group_and_add_admin('Pond', cls.users[0])
+        cls.other_group = create_group_and_add_admin('River', cls.users[0])
+        cls.category = Category.objects.create(user=cls.users[0], name='Flies')
+        now = timezone.now()
+        Transaction.objects.bulk_create(
+            Transaction(
+                user=cls.users[i % 4],
+                group=cls.group if i % 3 == 0 else cls.other_group if i % 7 == 0 else None,
+                t_type='income' if i % 2 else 'expense',
+                amount=Decimal(i % 50 + 1),
+                category=cls.category if i % 5 == 0 else None,
+                date=now - timedelta(hours=i),
+            )
+            for i in range(2000)
+        )
+        ledger.rebuild_snapshots()
+        ledger.rebuild_rollups()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def hot_queries(self):
+        user, group = self.users[0], self.group
+        position = (timezone.now() - timedelta(hours=500), 1500)
+        personal = get_personal_transactions(user)
+        group_rows = get_group_transactions(group)
+        incomes = Transaction.objects.filter(user=user, t_type='income').select_related('category')
+        visible = filter_transactions(user, {})
+        return {
+            'personal first page': keyset_query(personal, None),
+            'personal next page': keyset_query(personal, position),
+            'personal by category': keyset_query(personal.filter(category=self.category), None),
+            'group first page': keyset_query(group_rows, None),
+            'group next page': keyset_query(group_rows, position),
+            'income list': keyset_query(incomes, None),
+            'income api': keyset_query(IncomeListAPI(request=SimpleNamespace(user=user)).get_queryset(), None),
+            'personal export': filter_transactions(user, {'scope': 'personal'}).order_by('-date', '-id').combined(),
+            'group export': filter_transactions(user, {'group': group}).order_by('-date', '-id').combined(),
+            'all scopes first page': keyset_query(visible, None),
+            'all scopes next page': keyset_query(visible, position),
+            'all scopes by type': keyset_query(filter_transactions(user, {'t_type': 'income'}), None),
+            'all scopes export': visible.values_list(*STREAM_FIELDS).order_by('-date', '-id').combined(),
+            'personal balance': BalanceSnapshot.objects.filter(user=user, group=None),
+            'expense chart': CategoryRollup.objects.filter(user=user, group=None, t_type='expense',
+                                                           month__gte=timezone.localdate().replace(day=1)),
+        }
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def assertUsesIndex(self, name, plan):
+        if connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan, f"{name} scans the whole table:\n{plan}")
+            self.assertNotRegex(plan, r'(?m)^\s*(->\s*)?Sort', f"{name} needs a sort step:\n{plan}")
+        elif connection.vendor == 'sqlite':
+            self.assertNotRegex(plan, r'\bSCAN (?!.*USING (COVERING )?INDEX)', f"{name} scans the whole table:\n{plan}")
+            self.assertNotIn('TEMP B-TREE', plan, f"{name} needs a sort step:\n{plan}")
+        else:
+            self.skipTest(f"No plan expectations for {connection.vendor}")
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                self.assertUsesIndex(name, self.explain(queryset))
+
+
+@override_settings(EXPORT_JOBS_EAGER=True)
+class ExportTests(TestCase):
+    """
+    Tests for the background Excel export jobs.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        cls.category = Category.objects.create(user=cls.user, name='Flies')
+        Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('2.50'), category=cls.category,
+                                   description='Lunch')
+        Transaction.objects.create(user=cls.user, group=cls.group, t_type='income', amount=Decimal('9.00'))
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(self.user)
+
+    def test_export_builds_personal_and_group_sheets(self):
+        response = self.client.get(reverse('export_operation'))
+        job = ExportJob.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('export_job_download', args=[job.pk]), fetch_redirect_response=False)
+        self.assertEqual((job.status, job.rows_total, job.rows_done, job.progress), ('done', 2, 2, 100))
+
+        response = self.client.get(reverse('export_job_download', args=[job.pk]))
+        workbook = load_workbook(BytesIO(b''.join(response.streaming_content)), read_only=True)
+        self.assertEqual(workbook.sheetnames, ['Personal Transactions', 'Group Transactions'])
+        personal = list(workbook['Personal Transactions'].values)
+        self.assertEqual(personal[0], ('ID', 'Type', 'Amount', 'Category', 'Description', 'Date'))
+        self.assertEqual(personal[1][1:5], ('expense', 2.5, 'Flies', 'Lunch'))
+        group = list(workbook['Group Transactions'].values)
+        self.assertEqual(group[1][1:4], ('income', 9, None))
+
+    def test_export_covers_every_group(self):
+        river = create_group_and_add_admin('River', self.user)
+        Transaction.objects.create(user=self.other, group=river, t_type='expense', amount=Decimal('4.00'))
+
+        job, created = request_export(self.user)
+        self.assertEqual((job.status, job.rows_total, job.rows_done), ('done', 3, 3))
+        with job.file.open('rb') as fileobj:
+            workbook = load_workbook(BytesIO(fileobj.read()), read_only=True)
+        group = list(workbook['Group Transactions'].values)
+        self.assertEqual(group[0][-1], 'Group')
+        self.assertEqual(sorted((row[1], row[-1]) for row in group[1:]), [('expense', 'River'), ('income', 'Pond')])
+
+    def test_unchanged_data_reuses_the_export(self):
+        self.client.get(reverse('export_operation'))
+        job = ExportJob.objects.get(user=self.user)
+        with patch('finance.jobs.write_transactions_workbook') as write:
+            self.client.get(reverse('export_operation'))
+        write.assert_not_called()
+        self.assertEqual(list(ExportJob.objects.values_list('pk', flat=True)), [job.pk])
+
+        Transaction.objects.create(user=self.user, t_type='income', amount=Decimal('1.00'))
+        self.client.get(reverse('export_operation'))
+        new_job = ExportJob.objects.get(user=self.user)
+        self.assertNotEqual(new_job.pk, job.pk)
+        self.assertEqual(new_job.rows_total, 3)
+
+    def test_failed_job_records_the_error(self):
+        with patch('finance.jobs.write_transactions_workbook', side_effect=OSError('disk full')), \
+                self.assertLogs('finance.jobs', 'ERROR'):
+            response = self.client.get(reverse('export_operation'))
+        job = ExportJob.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('export_job', args=[job.pk]), fetch_redirect_response=False)
+        self.assertEqual((job.status, job.error), ('failed', EXPORT_FAILED_ERROR))
+        status = self.client.get(reverse('export_job', args=[job.pk]), {'format': 'json'}).json()
+        self.assertEqual((status['status'], status['download_url']), ('failed', None))
+        self.assertNotContains(self.client.get(reverse('export_job', args=[job.pk])), 'disk full')
+
+    @override_settings(EXPORT_JOB_TIMEOUT=60)
+    def test_stale_unfinished_jobs_are_replaced(self):
+        version = get_export_version(self.user)
+        lost = ExportJob.objects.create(user=self.user, data_version=version, status='running')
+        recent = ExportJob.objects.create(user=self.user, data_version='other', status='pending')
+        ExportJob.objects.filter(pk=lost.pk).update(created_at=timezone.now() - timedelta(seconds=61))
+
+        self.assertEqual(expire_stale_jobs(self.user), 1)
+        lost.refresh_from_db()
+        recent.refresh_from_db()
+        self.assertEqual((lost.status, lost.error), ('failed', EXPORT_EXPIRED_ERROR))
+        self.assertEqual(recent.status, 'pending')
+
+        ExportJob.objects.filter(pk=lost.pk).update(status='running')
+        job, created = request_export(self.user)
+        self.assertTrue(created)
+        self.assertNotEqual(job.pk, lost.pk)
+        self.assertEqual(job.status, 'done')
+
+    def test_finishing_a_job_keeps_newer_jobs(self):
+        older = ExportJob.objects.create(user=self.user, data_version='old')
+        ExportJob.objects.filter(pk=older.pk).update(created_at=timezone.now() - timedelta(minutes=5))
+        stale = ExportJob.objects.create(user=self.user, data_version='stale', status='failed')
+        ExportJob.objects.filter(pk=stale.pk).update(created_at=timezone.now() - timedelta(minutes=10))
+        newer = ExportJob.objects.create(user=self.user, data_version='new', status='done')
+
+        run_export_job(older.pk)
+        self.assertEqual(set(ExportJob.objects.values_list('pk', flat=True)), {older.pk, newer.pk})
+
+    def test_jobs_are_private(self):
+        self.client.get(reverse('export_operation'))
+        job = ExportJob.objects.get(user=self.user)
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(reverse('export_job', args=[job.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('export_job_download', args=[job.pk])).status_code, 404)
+
+
+class StreamingExportTests(TestCase):
+    """
+    Tests for the filtered CSV and NDJSON exports.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        cls.foreign_group = create_group_and_add_admin('River', cls.other)
+        cls.old = Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('1.10'),
+                                             date=timezone.now() - timedelta(days=40))
+        cls.recent = Transaction.objects.create(user=cls.user, t_type='income', amount=Decimal('2.20'),
+                                                description='Salary, June')
+        cls.shared = Transaction.objects.create(user=cls.other, group=cls.group, t_type='expense',
+                                                amount=Decimal('3.30'))
+        Transaction.objects.create(user=cls.other, group=cls.foreign_group, t_type='expense', amount=Decimal('4.40'))
+        Transaction.objects.create(user=cls.other, t_type='expense', amount=Decimal('5.50'))
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def export_csv(self, **params):
+        response = self.client.get(reverse('export_csv'), params)
+        return list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_csv_covers_visible_scopes(self):
+        rows = self.export_csv()
+        self.assertEqual({row['id'] for row in rows}, {str(self.old.pk), str(self.recent.pk), str(self.shared.pk)})
+        self.assertEqual(next(row for row in rows if row['id'] == str(self.recent.pk))['description'], 'Salary, June')
+
+    def test_csv_filters(self):
+        since = (timezone.localdate() - timedelta(days=7)).isoformat()
+        self.assertEqual([row['id'] for row in self.export_csv(date_from=since, scope='personal')],
+                         [str(self.recent.pk)])
+        self.assertEqual([row['amount'] for row in self.export_csv(scope='group')], ['3.30'])
+        self.assertEqual([row['amount'] for row in self.export_csv(t_type='expense', scope='personal')], ['1.10'])
+
+    def test_ndjson_rows(self):
+        response = self.client.get(reverse('export_ndjson'), {'scope': 'group', 'group': self.group.pk})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows, [{
+            'id': self.shared.pk, 'date': self.shared.date.isoformat(), 'type': 'expense', 'amount': '3.30',
+            'category': '', 'description': '', 'group': self.group.pk, 'user': 'toad',
+        }])
+
+    def test_foreign_group_is_rejected(self):
+        response = self.client.get(reverse('export_ndjson'), {'group': self.foreign_group.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('group', response.json()['errors'])
+
+
+class ImportTests(TestCase):
+    """
+    Tests for the bulk CSV and Excel import.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        cls.flies = Category.objects.create(user=cls.user, name='Flies')
+        cls.salary = Category.objects.create(name='Salary', is_income=True)
+
+    def upload(self, name, content, **data):
+        self.client.force_login(self.user)
+        return self.client.post(reverse('import_transactions'), {'file': SimpleUploadedFile(name, content), **data})
+
+    def test_csv_rows_are_imported_in_batches_and_errors_reported(self):
+        content = (
+            'type,amount,category,description,date\n'
+            'expense,2.50,flies,Lunch,2024-03-05\n'
+            'income,"1000,00",Salary,,2024-03-01\n'
+            'expense,abc,,,\n'
+            'expense,3,Salary,,\n'
+            'gift,1,,,\n'
+            ',,,,\n'
+            'Расход,4,Unknown,,\n'
+            'expense,5,,Snack,\n'
+        ).encode()
+        with patch('finance.importers.IMPORT_BATCH_SIZE', 2), CaptureQueriesContext(connection) as queries:
+            response = self.upload('t.csv', content)
+        inserts = [query for query in queries if query['sql'].startswith('INSERT INTO "Transaction"')]
+        self.assertEqual(len(inserts), 2)
+        result = response.context['result']
+        self.assertEqual((result.created, result.failed), (3, 4))
+        self.assertEqual([row for row, message in result.errors], [4, 5, 6, 8])
+
+        lunch = Transaction.objects.get(description='Lunch')
+        self.assertEqual((lunch.category, lunch.amount, lunch.group), (self.flies, Decimal('2.50'), None))
+        self.assertEqual(timezone.localtime(lunch.date).date().isoformat(), '2024-03-05')
+        self.assertEqual(Transaction.objects.get(t_type='income').category, self.salary)
+        self.assertEqual(ledger.stored_snapshots(), ledger.compute_snapshots())
+        self.assertEqual(ledger.stored_rollups(), ledger.compute_rollups())
+
+    def test_exported_workbook_can_be_imported_into_a_group(self):
+        Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('7.25'), category=self.flies,
+                                   description='Dinner')
+        exported = BytesIO()
+        write_transactions_workbook(self.user, exported)
+
+        response = self.upload('export.xlsx', exported.getvalue(), group=self.group.pk)
+        self.assertEqual(response.context['result'].created, 1)
+        imported = Transaction.objects.get(group=self.group)
+        self.assertEqual((imported.amount, imported.category, imported.description),
+                         (Decimal('7.25'), self.flies, 'Dinner'))
+        self.assertEqual(get_group_summaries([self.group])[self.group.pk].expense, Decimal('7.25'))
+
+    def test_missing_columns_reject_the_file(self):
+        response = self.upload('t.csv', b'amount,description\n1,x\n')
+        self.assertIsNone(response.context['result'])
+        self.assertFormError(response.context['form'], 'file', "The file could not be read: Missing required columns: type.")
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_unreadable_tail_reports_the_rows_already_imported(self):
+        content = b'type,amount\n' + b'expense,1.00\n' * 1000 + b'expense,\xff\n'
+        with patch('finance.importers.IMPORT_BATCH_SIZE', 100):
+            response = self.upload('t.csv', content)
+        result = response.context['result']
+        created = Transaction.objects.count()
+        self.assertGreater(created, 0)
+        self.assertEqual(result.created, created)
+        self.assertContains(response, f'Imported {created} transactions.')
+        self.assertIn(f'Transactions imported before the error were kept: {created}.',
+                      response.context['form'].errors['file'][0])
+        self.assertEqual(ledger.stored_snapshots(), ledger.compute_snapshots())
+
+
+OFX_STATEMENT = b"""OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+CHARSET:1252
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<BANKACCTFROM><BANKID>123<ACCTID>000111<ACCTTYPE>CHECKING</BANKACCTFROM>
+<BANKTRANLIST><DTSTART>20221201<DTEND>20240131
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20221215120000[-5:EST]<TRNAMT>-12.50<FITID>A1<NAME>Caf\xe9<MEMO>Coffee</STMTTRN>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20240105<TRNAMT>1,000.00<FITID>A2<NAME>Payroll</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>bad<TRNAMT>-1.00<FITID>A3</STMTTRN>
+</BANKTRANLIST>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+QIF_STATEMENT = """!Type:Bank
+D03/01'24
+T-4.00
+PBakery
+^
+D03/01'24
+T-4.00
+PBakery
+^
+D03/02/2024
+T25.00
+PRefund
+LSalary
+^
+"""
+
+
+class StatementImportTests(TestCase):
+    """
+    Tests for the OFX/QIF import and its fingerprint deduplication.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        cls.salary = Category.objects.create(name='Salary', is_income=True)
+
+    def upload(self, name, content, **data):
+        self.client.force_login(self.user)
+        return self.client.post(reverse('import_transactions'), {'file': SimpleUploadedFile(name, content), **data})
+
+    def test_ofx_reimport_skips_known_lines(self):
+        result = self.upload('bank.ofx', OFX_STATEMENT).context['result']
+        self.assertEqual((result.created, result.skipped, result.failed), (2, 0, 1))
+
+        coffee = Transaction.objects.get(t_type='expense')
+        self.assertEqual((coffee.amount, coffee.description), (Decimal('12.50'), 'Café - Coffee'))
+        self.assertEqual(timezone.localtime(coffee.date).year, 2022)
+        self.assertEqual(Transaction.objects.get(t_type='income').amount, Decimal('1000.00'))
+
+        with CaptureQueriesContext(connection) as queries:
+            result = self.upload('bank.ofx', OFX_STATEMENT).context['result']
+        self.assertEqual((result.created, result.skipped, result.failed), (0, 2, 1))
+        lookups = [query for query in queries if 'fingerprint' in query['sql'] and query['sql'].startswith('SELECT')]
+        self.assertEqual(len(lookups), 1)
+        self.assertEqual(get_personal_balance(self.user).count, 2)
+
+    def test_ofx_impossible_dates_are_rejected_rows(self):
+        statement = OFX_STATEMENT.replace(b'<DTPOSTED>20240105', b'<DTPOSTED>20241399')
+        response = self.upload('bank.ofx', statement)
+
+        self.assertEqual(response.status_code, 200)
+        result = response.context['result']
+        self.assertEqual((result.created, result.failed), (1, 2))
+
+    def test_qif_identical_lines_are_kept_once_per_occurrence(self):
+        result = self.upload('bank.qif', QIF_STATEMENT.encode(), group=self.group.pk).context['result']
+        self.assertEqual((result.created, result.skipped), (3, 0))
+        self.assertEqual(Transaction.objects.get(t_type='income').category, self.salary)
+
+        overlapping = QIF_STATEMENT + 'D03/03/2024\nT-1.00\nPBus\n^\n'
+        with patch('finance.importers.IMPORT_BATCH_SIZE', 2):
+            result = self.upload('bank.qif', overlapping.encode(), group=self.group.pk).context['result']
+        self.assertEqual((result.created, result.skipped), (1, 3))
+        self.assertEqual(Transaction.objects.filter(group=self.group).count(), 4)
+        self.assertEqual(get_group_summaries([self.group])[self.group.pk].expense, Decimal('9.00'))
+
+        # The same lines are new for the user's personal transactions.
+        result = self.upload('bank.qif', QIF_STATEMENT.encode()).context['result']
+        self.assertEqual((result.created, result.skipped), (3, 0))
+
+
+class TransactionAPITests(TestCase):
+    """
+    Tests for the cursor-paginated transactions API.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        UserGroupMember.objects.create(user=cls.other, group=cls.group)
+        cls.flies = Category.objects.create(user=cls.user, name='Flies')
+        now = timezone.now()
+        for day in range(6):
+            Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal(10 + day), category=cls.flies,
+                                       date=now - timedelta(days=day))
+        Transaction.objects.create(user=cls.other, group=cls.group, t_type='income', amount=Decimal('50'), date=now)
+        Transaction.objects.create(user=cls.other, t_type='income', amount=Decimal('70'), date=now)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def get(self, **params):
+        return self.client.get(reverse('api_transactions'), params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_pages_cover_personal_and_group_rows_without_counting(self):
+        ids = []
+        response = self.get(page_size=3)
+        with CaptureQueriesContext(connection) as queries:
+            while True:
+                self.assertEqual(response.status_code, 200)
+                ids += [row['id'] for row in response.json()['results']]
+                if not response.json()['next']:
+                    break
+                response = self.client.get(response.json()['next'], HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        expected = Transaction.objects.filter(Q(user=self.user, group=None) | Q(group=self.group))
+        self.assertEqual(ids, list(expected.order_by('-date', '-id').values_list('id', flat=True)))
+        self.assertEqual(len(ids), 7)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql'] or 'OFFSET' in query['sql']])
+
+    def test_filters(self):
+        results = self.get(t_type='expense', amount_min='11', amount_max='13', category=self.flies.pk).json()['results']
+        self.assertEqual(sorted(Decimal(row['amount']) for row in results), [11, 12, 13])
+        results = self.get(scope='group').json()['results']
+        self.assertEqual([Decimal(row['amount']) for row in results], [50])
+        date_from = timezone.localdate() - timedelta(days=1)
+        results = self.get(scope='personal', date_from=date_from.isoformat()).json()['results']
+        self.assertEqual(len(results), 2)
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.get(cursor='not-a-cursor').status_code, 400)
+        response = self.get(amount_min='5', amount_max='1')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('amount_max', response.json())
+        self.assertEqual(len(self.get(page_size='100000').json()['results']), 7)
+
+
+class TransactionBatchAPITests(TestCase):
+    """
+    Tests for the batch write API.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        cls.foreign_group = create_group_and_add_admin('Swamp', cls.other)
+        cls.flies = Category.objects.create(user=cls.user, name='Flies')
+        cls.salary = Category.objects.create(name='Salary', is_income=True)
+        cls.private = Category.objects.create(user=cls.other, name='Private')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.lunch = Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('5'), category=self.flies)
+        self.old = Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('3'))
+
+    def post(self, operations):
+        return self.client.post(reverse('api_transactions_batch'), {'operations': operations},
+                                content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_batch_is_applied_in_one_transaction(self):
+        operations = [
+            {'op': 'create', 'data': {'t_type': 'income', 'amount': '100.00', 'category': self.salary.pk}},
+            {'op': 'create', 'data': {'t_type': 'expense', 'amount': '7.50', 'group': self.group.pk}},
+            {'op': 'update', 'id': self.lunch.pk, 'data': {'amount': '6.00', 'description': 'Lunch'}},
+            {'op': 'delete', 'id': self.old.pk},
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(operations)
+        self.assertEqual(response.status_code, 200)
+        statuses = [result['status'] for result in response.json()['results']]
+        self.assertEqual(statuses, ['created', 'created', 'updated', 'deleted'])
+        self.assertEqual(response.json()['results'][2]['transaction']['description'], 'Lunch')
+        # One lookup of the targets, then the delete (with its collector select), one insert and one update.
+        writes = [query for query in queries if '"Transaction"' in query['sql'].split(' WHERE ')[0]]
+        self.assertEqual(len(writes), 5)
+
+        self.lunch.refresh_from_db()
+        self.assertEqual(self.lunch.amount, Decimal('6.00'))
+        self.assertFalse(Transaction.objects.filter(pk=self.old.pk).exists())
+        personal = get_personal_balance(self.user)
+        self.assertEqual((personal.income, personal.expense, personal.count), (Decimal('100'), Decimal('6'), 2))
+        self.assertEqual(get_group_summaries([self.group])[self.group.pk].expense, Decimal('7.50'))
+        self.assertEqual(ledger.stored_rollups(), ledger.compute_rollups())
+
+    def test_invalid_item_rejects_the_whole_batch(self):
+        not_mine = Transaction.objects.create(user=self.other, t_type='expense', amount=Decimal('1'))
+        operations = [
+            {'op': 'create', 'data': {'t_type': 'expense', 'amount': '1.00'}},
+            {'op': 'create', 'data': {'t_type': 'expense', 'amount': '1.00', 'category': self.salary.pk}},
+            {'op': 'create', 'data': {'t_type': 'expense', 'amount': '1.00', 'category': self.private.pk}},
+            {'op': 'create', 'data': {'t_type': 'expense', 'amount': '1.00', 'group': self.foreign_group.pk}},
+            {'op': 'update', 'id': self.lunch.pk, 'data': {'t_type': 'income'}},
+            {'op': 'delete', 'id': not_mine.pk},
+            {'op': 'delete', 'id': self.old.pk},
+            {'op': 'delete', 'id': self.old.pk},
+            {'op': 'create', 'data': {'amount': 'x'}},
+            {'op': 'rename'},
+        ]
+        response = self.post(operations)
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['skipped'] + ['error'] * 4 + ['error', 'skipped', 'error', 'error', 'error'])
+        self.assertIn('category', results[1]['errors']['data'])
+        self.assertEqual(results[2]['errors']['data']['category'], ["Category not found."])
+        self.assertIn('group', results[3]['errors']['data'])
+        self.assertIn('category', results[4]['errors']['data'])
+        self.assertEqual(results[5]['errors']['id'], ["Transaction not found."])
+        self.assertIn('amount', results[8]['errors']['data'])
+        self.assertIn('op', results[9]['errors'])
+        self.assertEqual(Transaction.objects.filter(user=self.user).count(), 2)
+
+    def test_group_categories_are_validated_like_the_form(self):
+        UserGroupMember.objects.create(user=self.other, group=self.group)
+        shared = Category.objects.create(user=self.other, group=self.group, name='Pond snacks')
+        foreign = Category.objects.create(user=self.other, group=self.foreign_group, name='Swamp snacks')
+        for category, valid in ((shared, True), (foreign, False)):
+            with self.subTest(category.name):
+                data = {'t_type': 'expense', 'amount': '1.00', 'category': category.pk, 'group': self.group.pk}
+                memberships = Memberships(SimpleNamespace(user=self.user))
+                self.assertEqual(TransactionForm(data, user=self.user, memberships=memberships).is_valid(), valid)
+                response = self.post([{'op': 'create', 'data': data}])
+                self.assertEqual(response.status_code, 200 if valid else 400)
+
+    def test_batch_size_is_limited(self):
+        operations = [{'op': 'delete', 'id': self.old.pk}] * 501
+        self.assertEqual(self.post(operations).status_code, 400)
+        self.assertEqual(self.post([]).status_code, 400)
+
+
+class FastSerializationTests(TestCase):
+    """
+    Tests that the values() fast path renders exactly what the model serializer renders.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        cls.salary = Category.objects.create(name='Salary', is_income=True)
+        descriptions = ['', 'Зарплата "март"', 'line\nbreak\ttab \\    \x01 \U0001f438', '<b>&</b>']
+        for i, description in enumerate(descriptions):
+            Transaction.objects.create(
+                user=cls.user, group=cls.group if i % 2 else None, t_type='income', amount=Decimal('1234567.8') / (i + 1),
+                category=cls.salary if i % 2 else None, description=description,
+                date=timezone.now() - timedelta(days=i, microseconds=i * 7),
+            )
+        Transaction.objects.filter(pk=Transaction.objects.order_by('pk').first().pk).update(fingerprint='f' * 64)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def render_both(self, url_name, **params):
+        fast = self.client.get(reverse(url_name), params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        with patch.object(FastListMixin, 'list', generics.ListAPIView.list), \
+                patch.object(FastListMixin, 'renderer_classes', [JSONRenderer]):
+            slow = self.client.get(reverse(url_name), params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return fast.content, slow.content
+
+    def test_list_endpoints_are_byte_compatible(self):
+        for url_name in ('api_income_list', 'api_transactions'):
+            for zone in ('UTC', 'Europe/Moscow'):
+                with self.subTest(url_name, zone=zone), timezone.override(zone):
+                    fast, slow = self.render_both(url_name, page_size=3)
+                    self.assertEqual(fast, slow)
+                    self.assertIn(b'\\u2028', fast)
+
+    def test_renderer_matches_json_renderer(self):
+        data = {'a': [1, None, True, 'ü', ' '], 'b': Decimal('1.50'), 'c': timezone.now(), 'd': 2 ** 70}
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+
+class ConditionalGetTests(TestCase):
+    """
+    Tests for ETag / Last-Modified handling of the dashboard and list views.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        UserGroupMember.objects.create(user=cls.other, group=cls.group)
+        Transaction.objects.create(user=cls.user, t_type='income', amount=Decimal('10'))
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def api_get(self, url_name, **headers):
+        return self.client.get(reverse(url_name), HTTP_AUTHORIZATION=f'Token {self.token.key}', **headers)
+
+    def test_api_answers_304_without_queries(self):
+        for url_name in ('api_income_list', 'api_transactions', 'api_balance'):
+            with self.subTest(url_name):
+                response = self.api_get(url_name)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('private', response['Cache-Control'])
+                etag = response['ETag']
+                # The token was cached by the first request.
+                with self.assertNumQueries(0):
+                    response = self.api_get(url_name, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+    def test_writes_in_any_visible_scope_change_the_etag(self):
+        etag = self.api_get('api_transactions')['ETag']
+        Transaction.objects.create(user=self.other, group=self.group, t_type='expense', amount=Decimal('1'))
+        response = self.api_get('api_transactions', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        Category.objects.create(name='Global')
+        self.assertEqual(self.api_get('api_transactions', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_dashboard_304_needs_no_queries_beyond_the_session(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        # Session and user lookups only.
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(reverse('dashboard'), {'period': 'month'},
+                                         HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_pages_are_revalidated_after_a_new_csrf_token_or_profile_change(self):
+        self.client.force_login(self.user)
+        etag = self.client.get(reverse('dashboard'))['ETag']
+        self.assertEqual(self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Logging in again rotates the CSRF secret embedded in the sign-out form.
+        self.client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 32
+        response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        User.objects.filter(pk=self.user.pk).update(username='frogger')
+        response = self.client.get(reverse('dashboard'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, 'Hi, frogger')
+
+    def test_if_modified_since(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('income_list'))
+        with patch('finance.cache.time.time', return_value=time.time() + 2):
+            last_modified = self.client.get(reverse('income_list'))['Last-Modified']
+            response = self.client.get(reverse('income_list'), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_last_modified_is_withheld_within_the_second_of_a_write(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('income_list'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        etag = response['ETag']
+
+        Transaction.objects.create(user=self.user, t_type='income', amount=Decimal('5'))
+        response = self.client.get(reverse('income_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_updated_at_tracks_modifications(self):
+        transaction = Transaction.objects.get(user=self.user)
+        before = transaction.updated_at
+        self.client.post(reverse('api_transactions_batch'),
+                         {'operations': [{'op': 'update', 'id': transaction.pk, 'data': {'amount': '11.00'}}]},
+                         content_type='application/json', HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        transaction.refresh_from_db()
+        self.assertGreater(transaction.updated_at, before)
+
+
+class SyncAPITests(TestCase):
+    """
+    Tests for the delta sync API.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.stranger = User.objects.create_user(username='newt', password='pass', email='newt@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        cls.membership = UserGroupMember.objects.create(user=cls.other, group=cls.group)
+        cls.flies = Category.objects.create(user=cls.user, name='Flies')
+        cls.personal = Transaction.objects.create(user=cls.user, t_type='expense', amount=Decimal('10'), category=cls.flies)
+        cls.shared = Transaction.objects.create(user=cls.other, group=cls.group, t_type='income', amount=Decimal('50'))
+        cls.hidden = Transaction.objects.create(user=cls.other, t_type='income', amount=Decimal('70'))
+        # Everything above was synced an hour ago.
+        cls.synced_at = timezone.now() - timedelta(minutes=30)
+        earlier = timezone.now() - timedelta(hours=1)
+        Transaction.objects.update(updated_at=earlier)
+        Category.objects.update(updated_at=earlier)
+        UserGroupMember.objects.update(updated_at=earlier, joined_at=earlier)
+        cls.tokens = {user.pk: Token.objects.create(user=user) for user in (cls.user, cls.other, cls.stranger)}
+
+    def sync(self, user=None, **params):
+        token = self.tokens[(user or self.user).pk]
+        return self.client.get(reverse('api_sync'), params, HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def delta(self, user=None):
+        response = self.sync(user, token=encode_token(self.synced_at, self.synced_at))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_initial_sync_returns_everything_visible(self):
+        response = self.sync()
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertTrue(data['reset'])
+        self.assertFalse(data['has_more'])
+        self.assertEqual({row['id'] for row in data['transactions']}, {self.personal.pk, self.shared.pk})
+        self.assertIn(self.flies.pk, [row['id'] for row in data['categories']])
+        self.assertEqual(len(data['memberships']), 2)
+
+    def test_delta_returns_only_changes_and_deletions(self):
+        created = Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('3'))
+        self.shared.amount = Decimal('55')
+        self.shared.save()
+        deleted_id = self.personal.pk
+        self.personal.delete()
+
+        data = self.delta()
+
+        self.assertFalse(data['reset'])
+        self.assertEqual({row['id'] for row in data['transactions']}, {created.pk, self.shared.pk})
+        self.assertEqual(data['categories'], [])
+        self.assertEqual(data['memberships'], [])
+        self.assertEqual(data['deleted']['transactions'], [deleted_id])
+
+    def test_following_the_returned_token_yields_no_changes(self):
+        token = self.sync().json()['token']
+        with patch('finance.sync.SYNC_OVERLAP', timedelta(0)):
+            data = self.sync(token=token).json()
+
+        self.assertEqual(data['transactions'], [])
+        Transaction.objects.create(user=self.user, t_type='income', amount=Decimal('1'))
+        with patch('finance.sync.SYNC_OVERLAP', timedelta(0)):
+            data = self.sync(token=data['token']).json()
+        self.assertEqual(len(data['transactions']), 1)
+
+    def test_leaving_a_group_is_seen_by_both_sides(self):
+        leave_group(self.other, self.group.pk)
+
+        self.assertEqual(self.delta()['deleted']['memberships'], [self.membership.pk])
+        self.assertEqual(self.delta(self.other)['deleted']['memberships'], [self.membership.pk])
+
+    def test_kicked_member_gets_a_tombstone(self):
+        self.client.login(username='frog', password='pass')
+        self.client.post(reverse('group_members', args=[self.group.pk]), {'member_id': self.membership.pk})
+
+        self.assertFalse(UserGroupMember.objects.filter(pk=self.membership.pk).exists())
+        self.assertEqual(self.delta(self.other)['deleted']['memberships'], [self.membership.pk])
+
+    def test_joining_a_group_sends_its_existing_data(self):
+        UserGroupMember.objects.create(user=self.stranger, group=self.group)
+
+        data = self.delta(self.stranger)
+
+        self.assertEqual([row['id'] for row in data['transactions']], [self.shared.pk])
+        self.assertEqual(len(data['memberships']), 3)
+
+    def test_moving_a_transaction_out_of_a_group_deletes_it_for_other_members(self):
+        self.shared.group = None
+        self.shared.save()
+
+        self.assertEqual(self.delta()['deleted']['transactions'], [self.shared.pk])
+        self.assertEqual([row['id'] for row in self.delta(self.other)['transactions']], [self.shared.pk])
+
+    def test_deleting_a_category_touches_its_transactions(self):
+        category_id = self.flies.pk
+        self.flies.delete()
+
+        data = self.delta()
+        self.assertEqual(data['deleted']['categories'], [category_id])
+        self.assertEqual(data['transactions'][0]['category'], None)
+
+    def test_group_categories_are_synced_and_deleted(self):
+        snacks = Category.objects.create(user=self.other, group=self.group, name='Pond snacks')
+        Category.objects.create(user=self.stranger, name='Hidden')
+        self.assertIn(snacks.pk, [row['id'] for row in self.delta()['categories']])
+
+        snacks_id = snacks.pk
+        snacks.delete()
+        self.assertEqual(self.delta()['deleted']['categories'], [snacks_id])
+        self.assertEqual(self.delta(self.stranger)['deleted']['categories'], [])
+
+    def test_deleting_a_user_with_data_tells_other_members(self):
+        shared_id, membership_id = self.shared.pk, self.membership.pk
+        self.other.delete()
+
+        self.assertFalse(Transaction.objects.filter(pk=shared_id).exists())
+        deleted = self.delta()['deleted']
+        self.assertEqual(deleted['transactions'], [shared_id])
+        self.assertEqual(deleted['memberships'], [membership_id])
+
+    def test_pages_cover_all_changes_with_lists_on_the_first_page(self):
+        for amount in range(5):
+            Transaction.objects.create(user=self.user, t_type='income', amount=Decimal(amount + 1))
+        ids, pages = [], []
+        response = self.sync(page_size=2)
+        while True:
+            data = response.json()
+            pages.append(data)
+            ids += [row['id'] for row in data['transactions']]
+            if not data['has_more']:
+                break
+            response = self.sync(page_size=2, token=data['token'])
+
+        self.assertEqual(len(ids), 7)
+        self.assertEqual(len(set(ids)), 7)
+        self.assertTrue(pages[0]['categories'])
+        self.assertTrue(all(page['categories'] == [] for page in pages[1:]))
+
+    def test_invalid_or_expired_tokens(self):
+        self.assertEqual(self.sync(token='forged').status_code, 400)
+        self.assertEqual(self.sync(page_size='many').status_code, 400)
+
+        long_ago = timezone.now() - TOMBSTONE_RETENTION - timedelta(days=1)
+        data = self.sync(token=encode_token(long_ago, long_ago)).json()
+        self.assertTrue(data['reset'])
+        self.assertEqual(len(data['transactions']), 2)
+
+    def test_requires_authentication(self):
+        self.assertEqual(self.client.get(reverse('api_sync')).status_code, 401)
+        self.assertFalse(Tombstone.objects.exists())
+
+
+class SummaryAPITests(TestCase):
+    """
+    Tests for the time-bucketed summary API.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.user)
+        UserGroupMember.objects.create(user=cls.other, group=cls.group)
+        cls.flies = Category.objects.create(user=cls.user, name='Flies')
+        cls.salary = Category.objects.create(user=cls.user, name='Salary', is_income=True)
+        tz = timezone.get_current_timezone()
+        for year, month, day, t_type, amount, category in [
+            (2026, 1, 5, 'income', '100', cls.salary),
+            (2026, 1, 6, 'expense', '30', cls.flies),
+            (2026, 1, 20, 'expense', '10', None),
+            (2026, 3, 2, 'expense', '5', cls.flies),
+        ]:
+            Transaction.objects.create(user=cls.user, t_type=t_type, amount=Decimal(amount), category=category,
+                                       date=datetime(year, month, day, 12, tzinfo=tz))
+        Transaction.objects.create(user=cls.other, group=cls.group, t_type='expense', amount=Decimal('7'),
+                                   date=datetime(2026, 2, 1, 12, tzinfo=tz))
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, **params):
+        return self.client.get(reverse('api_summary'), params, HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_monthly_net_totals_fill_empty_months(self):
+        data = self.get().json()
+
+        self.assertEqual(data['source'], 'rollups')
+        self.assertEqual(data['labels'], ['2026-01-01', '2026-02-01', '2026-03-01'])
+        self.assertEqual(data['series'], [{'totals': ['60.00', '0.00', '-5.00'], 'counts': [3, 0, 1]}])
+
+    def test_rollups_and_transactions_agree(self):
+        from_rollups = self.get(by=['category', 'type'], date_from='2026-01-01', date_to='2026-03-31').json()
+        from_transactions = self.get(by=['category', 'type'], date_from='2026-01-01', date_to='2026-03-30').json()
+
+        self.assertEqual(from_rollups['source'], 'rollups')
+        self.assertEqual(from_transactions['source'], 'transactions')
+        self.assertEqual(from_rollups['series'], from_transactions['series'])
+
+    def test_expenses_by_category_for_a_chart(self):
+        data = self.get(bucket='year', by='category', t_type='expense').json()
+
+        self.assertEqual(data['labels'], ['2026-01-01'])
+        self.assertEqual(
+            [(series['category_name'], series['totals']) for series in data['series']],
+            [('Flies', ['35.00']), (None, ['10.00'])],
+        )
+
+    def test_weekly_and_daily_buckets_are_truncated_in_the_database(self):
+        weeks = self.get(bucket='week', by='type', date_from='2026-01-01', date_to='2026-01-11').json()
+        self.assertEqual(weeks['source'], 'transactions')
+        self.assertEqual(weeks['labels'], ['2025-12-29', '2026-01-05'])
+        self.assertEqual(weeks['series'], [
+            {'t_type': 'expense', 'totals': ['0.00', '30.00'], 'counts': [0, 1]},
+            {'t_type': 'income', 'totals': ['0.00', '100.00'], 'counts': [0, 1]},
+        ])
+
+        days = self.get(bucket='day', date_from='2026-01-05', date_to='2026-01-07').json()
+        self.assertEqual(days['labels'], ['2026-01-05', '2026-01-06', '2026-01-07'])
+        self.assertEqual(days['series'][0]['totals'], ['100.00', '-30.00', '0.00'])
+
+    def test_group_scope_requires_membership(self):
+        data = self.get(group=self.group.pk, by='type').json()
+        self.assertEqual(data['labels'], ['2026-02-01'])
+        self.assertEqual(data['series'], [{'t_type': 'expense', 'totals': ['7.00'], 'counts': [1]}])
+
+        stranger = User.objects.create_user(username='newt', password='pass')
+        token = Token.objects.create(user=stranger)
+        response = self.client.get(reverse('api_summary'), {'group': self.group.pk},
+                                   HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(response.status_code, 400)
+
+    def test_rejects_invalid_parameters(self):
+        self.assertEqual(self.get(bucket='hour').status_code, 400)
+        self.assertEqual(self.get(bucket='day', date_from='1900-01-01', date_to='2026-01-01').status_code, 400)
+
+    def test_open_ranges_are_bounded(self):
+        response = self.get(bucket='day', date_from='0001-01-01')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('bucket', response.json())
+        self.assertEqual(self.get(bucket='day', date_to='9998-12-31').status_code, 400)
+        self.assertEqual(len(self.get(bucket='day', date_from='2026-01-01').json()['labels']), 61)
+
+    def test_dates_near_the_end_of_the_calendar_do_not_overflow(self):
+        self.assertEqual(self.get(bucket='year', date_to='9999-12-31').status_code, 400)
+        response = self.get(bucket='year', date_from='7000-01-01', date_to='9998-12-31')
+        self.assertEqual(response.json()['labels'][-1], '9998-01-01')
+        response = self.get(bucket='day', date_from='9998-12-01', date_to='9998-12-31')
+        self.assertEqual((response.status_code, response.json()['source']), (200, 'transactions'))
+        self.assertEqual(response.json()['labels'][-1], '9998-12-31')
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    """
+    Tests for the cached, expiring API token authentication.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+
+    def setUp(self):
+        cache.clear()
+        self.token = Token.objects.create(user=self.user)
+
+    def get(self, key=None):
+        return self.client.get(reverse('api_balance'), HTTP_AUTHORIZATION=f'Token {key or self.token.key}')
+
+    def test_token_is_resolved_from_the_cache(self):
+        self.assertEqual(self.get().status_code, 200)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get().status_code, 200)
+        self.assertFalse(any('authtoken_token' in query['sql'] for query in queries.captured_queries))
+        self.assertNotIn(self.token.key, token_cache_key(self.token.key))
+
+    def test_deleted_token_is_evicted(self):
+        self.get()
+        self.token.delete()
+
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_deactivated_user_is_evicted(self):
+        self.get()
+        self.user.is_active = False
+        self.user.save()
+
+        self.assertEqual(self.get().status_code, 401)
+
+    def test_expired_token_is_rejected_even_when_cached(self):
+        self.assertEqual(self.get().status_code, 200)
+
+        with override_settings(AUTH_TOKEN_TTL=timedelta(days=1)):
+            with patch('finance.authentication.timezone.now', return_value=timezone.now() + timedelta(days=2)):
+                response = self.get()
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()['detail'], 'Token has expired.')
+
+    def test_rotation_replaces_the_token(self):
+        self.get()
+        response = self.client.post(reverse('api_token_rotate'), HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+        self.assertEqual(response.status_code, 201)
+        new_key = response.json()['token']
+        self.assertNotEqual(new_key, self.token.key)
+        self.assertIsNotNone(response.json()['expires_at'])
+        self.assertEqual(self.get().status_code, 401)
+        self.assertEqual(self.get(new_key).status_code, 200)
+
+    def test_logged_in_user_can_rotate_without_a_token(self):
+        self.client.login(username='frog', password='pass')
+
+        response = self.client.post(reverse('api_token_rotate'))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+
+
+@override_settings(
+    EXPORT_JOBS_EAGER=True,
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {'api': '6/min', 'export': '3/hour'}},
+)
+class CostThrottlingTests(TestCase):
+    """
+    Tests for the cost-weighted throttling of the API and the exports.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        with ledger.deferred_ledger():
+            rows = Transaction.objects.bulk_create(
+                Transaction(user=cls.user, t_type='expense', amount=Decimal('1')) for _ in range(250)
+            )
+            ledger.record_many(ledger.entry_for(row) for row in rows)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        throttle_cache().clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get(self, url_name, token=None, **params):
+        return self.client.get(reverse(url_name), params, HTTP_AUTHORIZATION=f'Token {(token or self.token).key}')
+
+    def test_cheap_requests_are_counted_once(self):
+        for _ in range(6):
+            self.assertEqual(self.get('api_balance').status_code, 200)
+
+        response = self.get('api_balance')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_rows_returned_are_charged(self):
+        # 1 unit plus 2 for 200 rows: the bucket of 6 is full after two pages.
+        self.assertEqual(self.get('api_transactions', page_size=200).status_code, 200)
+        self.assertEqual(self.get('api_transactions', page_size=200).status_code, 200)
+
+        response = self.get('api_transactions', page_size=200)
+        self.assertEqual(response.status_code, 429)
+        self.assertLessEqual(int(response['Retry-After']), 30)
+
+    def test_buckets_are_per_user(self):
+        for _ in range(7):
+            self.get('api_balance')
+
+        self.assertEqual(self.get('api_balance', token=Token.objects.create(user=self.other)).status_code, 200)
+
+    def test_exports_are_charged_by_size(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('export_operation')).status_code, 302)
+
+        response = self.client.get(reverse('export_operation'))
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_streaming_exports_are_charged_by_rows(self):
+        self.client.force_login(self.user)
+        # 1 unit plus 2 for 250 rows fills the export bucket of 3.
+        response = self.client.get(reverse('export_csv'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 251)
+
+        response = self.client.get(reverse('export_ndjson'))
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+
+    def test_admin_lists_top_consumers(self):
+        self.get('api_transactions', page_size=200)
+        self.get('api_balance', token=Token.objects.create(user=self.other))
+        admin_user = User.objects.create_superuser(username='heron', password='pass', email='heron@example.com')
+        self.client.force_login(admin_user)
+
+        response = self.client.get(reverse('admin_throttle_usage'))
+
+        self.assertEqual(response.status_code, 200)
+        rows = response.context['scopes'][0]['rows']
+        self.assertEqual([(row['user'], row['cost']) for row in rows], [(self.user, 3), (self.other, 1)])
+
+    def test_usage_counters_are_kept_per_user_with_a_bounded_index(self):
+        with patch('finance.throttling.USAGE_MAX_USERS', 2):
+            for ident, cost in (('1', 2), ('2', 5), ('3', 9), ('1', 4)):
+                record_usage('api', ident, cost=cost)
+        since, consumers = top_consumers('api')
+        self.assertEqual([(ident, counters['cost']) for ident, counters in consumers], [('1', 6), ('2', 5)])
+        self.assertEqual(since % USAGE_PERIOD, 0)
+        self.assertEqual(throttle_cache().get(f'finance:throttle-usage:api:{int(since)}:3')['cost'], 9)
+
+
+class CategoryCatalogTests(TestCase):
+    """
+    Tests for the cached category catalog used by forms and views.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.flies = Category.objects.create(user=cls.user, name='Flies')
+        cls.foreign = Category.objects.create(user=cls.other, name='Worms')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def category_queries(self, url_name):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse(url_name)).status_code, 200)
+        return [query for query in queries.captured_queries if 'FROM "finance_category"' in query['sql']]
+
+    def test_pages_read_categories_once_and_then_from_the_cache(self):
+        self.assertEqual(len(self.category_queries('add_transaction')), 1)
+        self.assertEqual(self.category_queries('add_transaction'), [])
+        self.assertEqual(self.category_queries('dashboard'), [])
+
+    def test_choices_contain_global_and_own_categories_only(self):
+        response = self.client.get(reverse('add_transaction'))
+
+        choices = dict(response.context['form'].fields['category'].choices)
+        del choices['']
+        self.assertIn(self.flies.pk, choices)
+        self.assertNotIn(self.foreign.pk, choices)
+        self.assertTrue(Category.objects.filter(user=None, pk__in=choices).exists())
+
+    def test_new_categories_show_up(self):
+        catalog.user_categories(self.user)
+        own = Category.objects.create(user=self.user, name='Beetles')
+        shared = Category.objects.create(name='Rain', is_income=True)
+
+        pks = [entry.pk for entry in catalog.user_categories(self.user)]
+        self.assertIn(own.pk, pks)
+        self.assertIn(shared.pk, pks)
+
+    def test_form_saves_the_chosen_category_and_rejects_foreign_ones(self):
+        response = self.client.post(reverse('add_transaction'),
+                                    {'t_type': 'expense', 'amount': '4.00', 'category': self.flies.pk})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        self.assertEqual(Transaction.objects.get(user=self.user).category, self.flies)
+
+        response = self.client.post(reverse('add_transaction'),
+                                    {'t_type': 'expense', 'amount': '4.00', 'category': self.foreign.pk})
+        self.assertIn('category', response.context['form'].errors)
+
+
+class CategoryAutocompleteTests(TestCase):
+    """
+    Tests for the category autocomplete endpoint and its in-memory index.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.other = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.other)
+        UserGroupMember.objects.create(user=cls.user, group=cls.group)
+        cls.flies = Category.objects.create(user=cls.user, name='Flies')
+        cls.fuel = Category.objects.create(user=cls.user, name='Gas/Fuel')
+        cls.salary = Category.objects.create(user=cls.user, name='Fly Salary', is_income=True)
+        cls.shared = Category.objects.create(user=cls.other, group=cls.group, name='Pond Fees')
+        cls.foreign = Category.objects.create(user=cls.other, name='Flies of Toad')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def search(self, **params):
+        response = self.client.get(reverse('category_autocomplete'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_prefix_matches_rank_before_word_matches(self):
+        names = [result['name'] for result in self.search(q='fl')]
+
+        self.assertEqual(names[:2], ['Flies', 'Fly Salary'])
+        self.assertNotIn('Flies of Toad', names)
+        self.assertIn(self.fuel.pk, [result['id'] for result in self.search(q='fuel')])
+
+    def test_typos_and_substrings_are_matched(self):
+        self.assertEqual(self.search(q='flise')[0]['id'], self.flies.pk)
+        self.assertIn(self.fuel.pk, [result['id'] for result in self.search(q='s/fu')])
+
+    def test_type_filter_and_limit(self):
+        results = self.search(q='fl', type='income')
+        self.assertEqual([result['id'] for result in results], [self.salary.pk])
+        self.assertEqual(len(self.search(limit='2')), 2)
+
+    def test_group_categories_are_included(self):
+        result = self.search(q='pond')[0]
+
+        self.assertEqual((result['id'], result['scope']), (self.shared.pk, 'group'))
+        self.assertEqual(self.search(q='flies')[0]['scope'], 'personal')
+
+    def test_warm_requests_run_no_category_query(self):
+        self.search(q='fl')
+        with CaptureQueriesContext(connection) as queries:
+            self.search(q='gas')
+        self.assertFalse([query for query in queries.captured_queries if 'finance_category' in query['sql']])
+
+        Category.objects.create(user=self.user, name='Gnats')
+        self.assertEqual(self.search(q='gna')[0]['name'], 'Gnats')
+
+    def test_form_embeds_only_the_selected_category(self):
+        response = self.client.get(reverse('add_transaction'))
+        self.assertContains(response, f'data-autocomplete-url="{reverse("category_autocomplete")}"')
+        self.assertNotContains(response, 'Flies')
+
+        response = self.client.get(reverse('dashboard'), {'category': self.flies.pk})
+        self.assertContains(response, f'<option value="{self.flies.pk}" selected>Flies</option>', html=True)
+        self.assertNotContains(response, 'Gas/Fuel')
+
+
+class CategorySuggestionTests(TestCase):
+    """
+    Tests for the description-based category suggester, its endpoint, imports and the backfill command.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.coffee = Category.objects.create(user=cls.user, name='Coffee')
+        cls.fuel = Category.objects.create(user=cls.user, name='Fuel')
+        cls.salary = Category.objects.create(user=cls.user, name='Pay', is_income=True)
+        for description, category in [('Starbucks latte', cls.coffee), ('Latte and croissant', cls.coffee),
+                                      ('Shell fuel station', cls.fuel), ('Fuel 40L diesel', cls.fuel),
+                                      ('Monthly salary', cls.salary)]:
+            Transaction.objects.create(user=cls.user, t_type='income' if category.is_income else 'expense',
+                                       amount=Decimal('5'), category=category, description=description)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_suggestions_follow_the_description_and_type(self):
+        suggested = suggest_categories(self.user, 'LATTE #123', t_type='expense')
+        self.assertEqual(suggested[0][0].pk, self.coffee.pk)
+        self.assertGreater(suggested[0][1], 0.6)
+
+        self.assertEqual(suggest_categories(self.user, 'diesel')[0][0].pk, self.fuel.pk)
+        self.assertEqual(suggest_categories(self.user, 'latte', t_type='income'), [])
+        self.assertEqual(suggest_categories(self.user, 'unknown words'), [])
+
+    def test_cached_suggester_is_updated_incrementally(self):
+        get_suggester(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            snack = Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('3'),
+                                               category=self.coffee, description='Espresso')
+        with CaptureQueriesContext(connection) as queries:
+            suggester = get_suggester(self.user)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(suggester.predict('espresso')[0][0], self.coffee.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            snack.category = self.fuel
+            snack.save()
+        self.assertEqual(get_suggester(self.user).predict('espresso')[0][0], self.fuel.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            snack.delete()
+        self.assertEqual(get_suggester(self.user).predict('espresso'), [])
+
+    def test_endpoint_returns_ranked_suggestions(self):
+        response = self.client.get(reverse('category_suggestions'), {'description': 'Shell', 'type': 'expense'})
+
+        results = response.json()['results']
+        self.assertEqual(results[0]['id'], self.fuel.pk)
+        self.assertEqual(results[0]['name'], 'Fuel')
+        self.assertLessEqual(len(results), 3)
+
+    def test_imports_fill_in_confident_suggestions(self):
+        content = (
+            'type,amount,category,description\n'
+            'expense,2.50,,Starbucks latte\n'
+            'expense,3,,Something new\n'
+        ).encode()
+        response = self.client.post(reverse('import_transactions'), {'file': SimpleUploadedFile('t.csv', content)})
+
+        self.assertEqual(response.context['result'].suggested, 1)
+        self.assertEqual(Transaction.objects.get(amount=Decimal('2.50')).category_id, self.coffee.pk)
+        self.assertIsNone(Transaction.objects.get(amount=Decimal('3')).category_id)
+
+    def test_backfill_command_categorizes_history_in_batches(self):
+        pending = [Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('2'), description=text)
+                   for text in ('latte', 'diesel', 'latte to go', 'gift')]
+        before = pending[0].updated_at
+
+        call_command('backfill_categories', '--dry-run', stdout=StringIO())
+        self.assertEqual(Transaction.objects.filter(category=None).count(), 4)
+
+        output = StringIO()
+        with CaptureQueriesContext(connection) as queries:
+            call_command('backfill_categories', '--batch-size', '2', stdout=output)
+        self.assertIn('3 of 4', output.getvalue())
+        batches = [query for query in queries
+                   if 'WHERE ("Transaction"."category_id" IS NULL' in query['sql'] and 'LIMIT 2' in query['sql']]
+        self.assertEqual(len(batches), 3)
+        categories = {obj.description: obj.category_id for obj in Transaction.objects.filter(pk__in=[t.pk for t in pending])}
+        self.assertEqual(categories, {'latte': self.coffee.pk, 'diesel': self.fuel.pk, 'latte to go': self.coffee.pk,
+                                      'gift': None})
+        self.assertGreater(Transaction.objects.get(pk=pending[0].pk).updated_at, before)
+        self.assertEqual(ledger.stored_rollups(), ledger.compute_rollups())
+
+    def test_backfill_keeps_categories_assigned_while_it_runs(self):
+        pending = Transaction.objects.create(user=self.user, t_type='expense', amount=Decimal('2'), description='latte')
+        real_suggester = suggestions.confident_suggester
+
+        def suggester_racing_with_the_user(*args):
+            suggest = real_suggester(*args)
+
+            def racing(description, t_type):
+                edited = Transaction.objects.get(pk=pending.pk)
+                edited.category = self.fuel
+                edited.save()
+                return suggest(description, t_type)
+            return racing
+
+        output = StringIO()
+        with patch('finance.suggestions.confident_suggester', suggester_racing_with_the_user):
+            call_command('backfill_categories', stdout=output)
+
+        self.assertIn('0 of 1', output.getvalue())
+        self.assertEqual(Transaction.objects.get(pk=pending.pk).category_id, self.fuel.pk)
+        self.assertEqual(ledger.stored_rollups(), ledger.compute_rollups())
+
+
+class MembershipResolverTests(TestCase):
+    """
+    Tests for the request-scoped membership resolver and the group views using it.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.member = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.admin)
+        cls.membership = UserGroupMember.objects.create(user=cls.member, group=cls.group)
+
+    def setUp(self):
+        cache.clear()
+
+    def membership_queries(self, url, user):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [query for query in queries if 'FROM "user_group_members"' in query['sql']]
+
+    def test_group_pages_check_access_with_one_cached_query(self):
+        url = reverse('group_members', args=[self.group.pk])
+        response, queries = self.membership_queries(url, self.admin)
+        self.assertTrue(response.context['is_admin'])
+        # The admin's memberships, then the member count and page.
+        self.assertEqual(len(queries), 3)
+
+        response, queries = self.membership_queries(url, self.admin)
+        self.assertEqual(len(queries), 3)
+
+    def test_roles_are_enforced(self):
+        response, queries = self.membership_queries(reverse('invite_to_group', args=[self.group.pk]), self.member)
+        self.assertEqual(response.status_code, 403)
+        response, queries = self.membership_queries(reverse('group_members', args=[self.group.pk]), self.member)
+        self.assertFalse(response.context['is_admin'])
+
+        stranger = User.objects.create_user(username='newt', password='pass', email='newt@example.com')
+        response, queries = self.membership_queries(reverse('group_members', args=[self.group.pk]), stranger)
+        self.assertEqual(response.status_code, 403)
+        response, queries = self.membership_queries(reverse('group_transactions', args=[self.group.pk]), stranger)
+        self.assertEqual(response.status_code, 404)
+
+    def test_membership_changes_are_seen_by_the_next_request(self):
+        url = reverse('group_members', args=[self.group.pk])
+        self.assertEqual(self.membership_queries(url, self.member)[0].status_code, 200)
+
+        self.client.force_login(self.admin)
+        self.client.post(url, {'member_id': self.membership.pk})
+
+        self.assertEqual(self.membership_queries(url, self.member)[0].status_code, 403)
+        response = self.client.get(reverse('leave_group', args=[self.group.pk]))
+        self.assertContains(response, "You are not a member of this group.")
+
+    def test_access_does_not_depend_on_cache_invalidation(self):
+        url = reverse('group_members', args=[self.group.pk])
+        self.assertEqual(self.membership_queries(url, self.member)[0].status_code, 200)
+
+        # Another worker with its own local cache never sees the version bump.
+        with patch('finance.signals.bump_versions'):
+            self.membership.delete()
+
+        self.assertEqual(self.membership_queries(url, self.member)[0].status_code, 403)
+
+
+    def test_forms_take_group_choices_from_the_request_memberships(self):
+        self.client.force_login(self.member)
+        for url in (reverse('add_transaction'), reverse('import_transactions')):
+            with self.subTest(url), CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(list(response.context['form'].fields['group'].queryset), [self.group])
+            self.assertFalse([query for query in queries if 'JOIN "user_group_members"' in query['sql']])
+
+
+class GroupMembersPageTests(TestCase):
+    """
+    Tests for the sorted, paginated group members page with per-member totals.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='frog', password='pass', email='frog@example.com')
+        cls.member = User.objects.create_user(username='toad', password='pass', email='toad@example.com')
+        cls.group = create_group_and_add_admin('Pond', cls.admin)
+        UserGroupMember.objects.create(user=cls.member, group=cls.group)
+        for t_type, amount in [('income', '10'), ('expense', '3')]:
+            Transaction.objects.create(user=cls.member, group=cls.group, t_type=t_type, amount=Decimal(amount))
+
+    def setUp(self):
+        cache.clear()
+
+    def add_members(self, count, prefix):
+        users = User.objects.bulk_create(User(username=f'{prefix}{index:03}') for index in range(count))
+        UserGroupMember.objects.bulk_create(UserGroupMember(user=user, group=self.group) for user in users)
+
+    def get(self, user, **params):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('group_members', args=[self.group.pk]), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_query_count_does_not_grow_with_members(self):
+        response, small = self.get(self.admin)
+        self.add_members(120, 'newt')
+        cache.clear()
+        response, large = self.get(self.admin, sort='name', page=2)
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(response.context['members']), 48)
+        self.assertEqual(response.context['members'].paginator.count, 122)
+
+    def test_admins_see_and_sort_by_member_totals(self):
+        self.add_members(3, 'newt')
+        response, queries = self.get(self.admin, sort='income')
+
+        first = response.context['members'][0]
+        self.assertEqual(first.user.username, 'toad')
+        self.assertEqual((first.income, first.expense, first.transaction_count), (Decimal('10'), Decimal('3'), 2))
+        self.assertEqual(response.context['members'][1].income, Decimal('0'))
+        self.assertContains(response, '2 transactions')
+
+    def test_members_cannot_sort_by_or_see_totals(self):
+        response, queries = self.get(self.member, sort='income')
+
+        self.assertEqual(response.context['sort'], 'role')
+        self.assertEqual(response.context['members'][0].user.username, 'frog')
+        self.assertNotContains(response, 'transactions</span>')
+
+
+class SharedCacheCheckTests(TestCase):
+    """
+    Tests for the system check requiring a shared cache with several worker processes.
+    """
+
+    def test_local_memory_cache_is_rejected_with_several_workers(self):
+        with override_settings(WEB_CONCURRENCY=4):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['finance.E001'])
+        with override_settings(WEB_CONCURRENCY=1):
+            self.assertEqual(check_shared_cache(None), [])
+
+        shared = {**settings.CACHES, 'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.gettempdir(),
+        }}
+        with override_settings(WEB_CONCURRENCY=4, CACHES=shared):
+            self.assertEqual(check_shared_cache(None), [])
@@ -0,0 +1,226 @@
+"""
+Cost-weighted throttling for the API and the exports.
+
+Every user has a token bucket per scope that holds as many cost units as
+the scope's rate in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] allows per
+period and drains at that rate. A request is admitted while the bucket has
+room for one unit and is charged its cost once the response is known: one unit plus
+one per ROWS_PER_COST_UNIT rows returned or exported. A user who pulls many
+rows therefore waits proportionally longer than one making cheap requests.
+
+Buckets and the usage counters shown in the admin live in the `throttle`
+cache (local memory by default), so limits and counters are per process.
+"""
+import math
+import time
+from dataclasses import dataclass
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+THROTTLE_CACHE_ALIAS = 'throttle'
+ROWS_PER_COST_UNIT = 100
+USAGE_PERIOD = 24 * 60 * 60
+USAGE_MAX_USERS = 1000
+
+
+def throttle_cache():
+    """
+    Return the cache holding throttle state, falling back to the default cache.
+    """
+    return caches[THROTTLE_CACHE_ALIAS if THROTTLE_CACHE_ALIAS in settings.CACHES else 'default']
+
+
+def rows_cost(rows: int) -> int:
+    """
+    Return the cost of a request that returned or exported the given number of rows.
+    """
+    return 1 + rows // ROWS_PER_COST_UNIT
+
+
+def count_rows(data) -> int:
+    """
+    Return the number of rows in response data: list lengths, summed over the values of a dict.
+    """
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        return sum(count_rows(value) for value in data.values())
+    return 0
+
+
+@dataclass
+class CostBucket:
+    """
+    The token bucket of one user in one throttle scope.
+    """
+    scope: str
+    ident: str
+    capacity: int
+    duration: int
+
+    @property
+    def key(self) -> str:
+        return f'finance:throttle:{self.scope}:{self.ident}'
+
+    @property
+    def drain_rate(self) -> float:
+        return self.capacity / self.duration
+
+    def level(self, now: float | None = None) -> float:
+        """
+        Return the cost units currently in the bucket.
+        """
+        now = now or time.time()
+        level, stamp = throttle_cache().get(self.key, (0.0, now))
+        return max(0.0, level - (now - stamp) * self.drain_rate)
+
+    def wait(self) -> int | None:
+        """
+        Return the seconds until the bucket has room for another unit, or None if it has now.
+        """
+        excess = self.level() + 1 - self.capacity
+        if excess <= 0:
+            return None
+        return max(1, math.ceil(excess / self.drain_rate))
+
+    def charge(self, cost: int) -> None:
+        """
+        Add the cost of an admitted request to the bucket.
+        """
+        now = time.time()
+        level = self.level(now) + cost
+        throttle_cache().set(self.key, (level, now), math.ceil(level / self.drain_rate) + 1)
+        record_usage(self.scope, self.ident, cost=cost)
+
+
+def _usage_prefix(scope: str, now: float) -> tuple[float, str]:
+    # Counters start over in every USAGE_PERIOD window; old windows expire from the cache.
+    since = now - now % USAGE_PERIOD
+    return since, f'finance:throttle-usage:{scope}:{int(since)}'
+
+
+def record_usage(scope: str, ident: str, cost: int = 0, throttled: bool = False) -> None:
+    """
+    Add a request to a user's usage counters of a scope, which are reset every USAGE_PERIOD seconds.
+
+    Each user's counters have their own key. The index of users is only
+    touched on a user's first request of the period and holds at most
+    USAGE_MAX_USERS idents; users after that are counted but not listed.
+    """
+    cache = throttle_cache()
+    now = time.time()
+    since, prefix = _usage_prefix(scope, now)
+    key = f'{prefix}:{ident}'
+    counters = cache.get(key)
+    if counters is None:
+        counters = {'cost': 0, 'requests': 0, 'throttled': 0, 'last_seen': now}
+        idents = cache.get(prefix, [])
+        if ident not in idents and len(idents) < USAGE_MAX_USERS:
+            cache.set(prefix, idents + [ident], USAGE_PERIOD)
+    counters['cost'] += cost
+    counters['requests'] += 0 if throttled else 1
+    counters['throttled'] += 1 if throttled else 0
+    counters['last_seen'] = now
+    cache.set(key, counters, USAGE_PERIOD)
+
+
+def top_consumers(scope: str, limit: int = 50) -> tuple[float | None, list[tuple[str, dict]]]:
+    """
+    Return when the counters of a scope were reset and its heaviest users with their counters, by cost.
+    """
+    cache = throttle_cache()
+    since, prefix = _usage_prefix(scope, time.time())
+    idents = cache.get(prefix)
+    if not idents:
+        return None, []
+    counters = cache.get_many([f'{prefix}:{ident}' for ident in idents])
+    usage = [(ident, counters[f'{prefix}:{ident}']) for ident in idents if f'{prefix}:{ident}' in counters]
+    ranked = sorted(usage, key=lambda item: item[1]['cost'], reverse=True)
+    return since, ranked[:limit]
+
+
+class CostRateThrottle(SimpleRateThrottle):
+    """
+    Throttle admitting requests while the user's cost bucket for the view's throttle_scope has room.
+
+    Views charge the cost in finalize_response(); see
+    finance.api_views.CostThrottledMixin.
+    """
+    scope_attr = 'throttle_scope'
+
+    def __init__(self):
+        # The rate depends on the view, so it is resolved in allow_request().
+        pass
+
+    def get_rate(self):
+        """
+        Return the rate of the current scope, read at request time.
+        """
+        return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+
+    def allow_request(self, request, view):
+        """
+        Return whether the user's bucket admits the request, remembering it on the request for charging.
+        """
+        self.scope = getattr(view, self.scope_attr, 'api')
+        self.num_requests, self.duration = self.parse_rate(self.get_rate())
+        bucket = CostBucket(self.scope, user_ident(request), self.num_requests, self.duration)
+        self.wait_seconds = bucket.wait()
+        if self.wait_seconds is not None:
+            record_usage(bucket.scope, bucket.ident, throttled=True)
+            return False
+        request.cost_buckets = getattr(request, 'cost_buckets', []) + [bucket]
+        return True
+
+    def wait(self):
+        """
+        Return the seconds to send in Retry-After.
+        """
+        return self.wait_seconds
+
+
+def get_cost_rate(scope: str) -> tuple[int, int]:
+    """
+    Return the (cost units, seconds) budget of a throttle scope.
+    """
+    return CostRateThrottle().parse_rate(api_settings.DEFAULT_THROTTLE_RATES[scope])
+
+
+def user_ident(request) -> str:
+    """
+    Return the bucket identity of a request: the user id, or the client address for anonymous requests.
+    """
+    if request.user and request.user.is_authenticated:
+        return str(request.user.pk)
+    return f"anon:{CostRateThrottle().get_ident(request)}"
+
+
+def cost_throttled(scope: str):
+    """
+    Throttle a Django view by cost; the view may set request.throttle_cost, otherwise a request costs one unit.
+
+    Rejected requests get a 429 response with Retry-After.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            capacity, duration = get_cost_rate(scope)
+            bucket = CostBucket(scope, user_ident(request), capacity, duration)
+            wait = bucket.wait()
+            if wait is not None:
+                record_usage(scope, bucket.ident, throttled=True)
+                response = HttpResponse(
+                    f"Too many requests. Please try again in {wait} seconds.", status=429, content_type='text/plain'
+                )
+                response['Retry-After'] = str(wait)
+                return response
+            response = view_func(request, *args, **kwargs)
+            bucket.charge(getattr(request, 'throttle_cost', 1))
+            return response
+        return wrapper
+    return decorator
@@ -1,14 +1,23 @@
 from django.urls import path
 from .views import dashboard, add_transaction, transaction_detail, add_category, export_operation_to_excel, \
     create_group, join_group, group_list, leave_group, invite_to_group, invitations_list, accept_invitation, \
-    reject_invitation, group_members, income_list
+    reject_invitation, group_members, income_list, group_transactions, export_csv, export_ndjson, \
+    export_job, export_job_download, import_transactions, category_autocomplete, \
+    category_suggestions
 
 urlpatterns = [
     path('dashboard/', dashboard, name='dashboard'),
     path('add_transaction/', add_transaction, name='add_transaction'),
+    path('import_transactions/', import_transactions, name='import_transactions'),
     path('transaction/<int:pk>', transaction_detail, name='transaction_detail'),
     path('add_category/', add_category, name='add_category'),
+    path('categories/autocomplete/', category_autocomplete, name='category_autocomplete'),
+    path('categories/suggest/', category_suggestions, name='category_suggestions'),
     path('export_operation/', export_operation_to_excel, name='export_operation'),
+    path('export/jobs/<int:job_id>/', export_job, name='export_job'),
+    path('export/jobs/<int:job_id>/download/', export_job_download, name='export_job_download'),
+    path('export/csv/', export_csv, name='export_csv'),
+    path('export/ndjson/', export_ndjson, name='export_ndjson'),
     path('create_group/', create_group, name='create_group'),
     path('join_group/<int:group_id>/', join_group, name='join_group'),
     path('group_list/', group_list, name='group_list'),
@@ -19,4 +28,5 @@ urlpatterns = [
     path('reject_invitation/<int:invitation_id>/', reject_invitation, name='reject_invitation'),
     path('group_members/<int:group_id>/', group_members, name='group_members'),
     path('income_list/', income_list, name='income_list'),
+    path('group_transactions/<int:group_id>/', group_transactions, name='group_transactions'),
 ]
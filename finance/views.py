@@ -1,13 +1,30 @@
+import csv
 import json
+import zipfile
+
 from django.contrib.auth.decorators import login_required
-from django.db.models import Sum, Q
-from django.http import HttpResponse, HttpResponseForbidden
+from django.core.paginator import Paginator
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
-
-from finance.forms import TransactionForm, CategoryForm, UserGroupForm, InvitationForm, User, TransactionFilterForm
-from finance.models import Transaction, UserGroupMember, UserGroup, Invitation, Category
-from finance.services import create_group_and_add_admin, export_transactions, get_personal_balance, get_group_balance, \
-    join_group as join_group_service, leave_group as leave_group_service
+from django.urls import reverse
+
+from finance.forms import TransactionForm, CategoryForm, UserGroupForm, InvitationForm, User, TransactionFilterForm, \
+    TransactionQueryForm, TransactionImportForm
+from finance.models import Transaction, UserGroupMember, UserGroup, Invitation, ExportJob
+from finance.pagination import paginate_keyset
+from finance.cache import get_dashboard_data, get_versioned, group_version_key
+from finance.catalog import AUTOCOMPLETE_LIMIT, AUTOCOMPLETE_MAX_LIMIT, category_index
+from finance.conditional import user_data_condition
+from finance.importers import ImportFormatError, ImportInterrupted, iter_csv_rows, iter_xlsx_rows, iter_ofx_lines, \
+    iter_qif_lines, import_statement, import_transactions as import_transactions_service
+from finance.jobs import EXPORT_FILENAME, request_export
+from finance.services import create_group_and_add_admin, get_personal_balance, \
+    get_user_groups, get_group_summaries, get_personal_transactions, get_group_transactions, summarize_transactions, \
+    get_category_totals, PERIOD_CHOICES, filter_transactions, iter_transactions_csv, iter_transactions_ndjson, \
+    join_group as join_group_service, leave_group as leave_group_service, EXPORT_STREAM_BLOCK_SIZE, \
+    get_group_members, MEMBER_SORTS, MEMBER_STAT_SORTS, MEMBERS_PAGE_SIZE
+from finance.suggestions import suggest_categories
+from finance.throttling import cost_throttled, rows_cost
 
 
 def home(request):
@@ -19,72 +36,110 @@ def home(request):
     return render(request, 'home.html')
 
 
+def _group_page(group, cursor=None, category=None):
+    """
+    Returns a page of a group's transactions; the unfiltered first page is cached per group version.
+    """
+    if cursor or category:
+        transactions = get_group_transactions(group)
+        if category:
+            transactions = transactions.filter(category=category)
+        return paginate_keyset(transactions, cursor)
+    return get_versioned(
+        f'finance:group-page:{group.pk}',
+        [group_version_key(group.pk)],
+        lambda: paginate_keyset(get_group_transactions(group)),
+    )
+
+
 @login_required
+@user_data_condition
 def dashboard(request):
     """
     Displays the main dashboard, handles transaction filtering, and prepares chart data.
     """
-    # 1. Get all base data (unfiltered)
-    personal_transactions_all, personal_income, personal_expense, personal_balance = get_personal_balance(request.user)
-    group_transactions_all, group_income, group_expense, group_balance, group = get_group_balance(request.user)
-
-    # 2. Handle filtering form
+    period = request.GET.get('period')
+    if period not in dict(PERIOD_CHOICES):
+        period = 'all'
+
+    def build(groups):
+        summaries = get_group_summaries(groups) if groups else {}
+        expense_by_category = get_category_totals(request.user, 'expense', period)
+        return {
+            'personal_summary': get_personal_balance(request.user),
+            'groups': [(group, summaries[group.pk]) for group in groups],
+            'personal_page': paginate_keyset(get_personal_transactions(request.user)),
+            'chart_labels': [name or 'Uncategorized' for name, total in expense_by_category],
+            'chart_data': [float(total) for name, total in expense_by_category],
+        }
+
+    # 1. Base data (unfiltered totals, chart and first page), cached per data version
+    data, cache_hit = get_dashboard_data(request.user, period, lambda: get_user_groups(request.user), build)
+
+    # 2. Handle filtering form and pagination; the cached first page covers the unfiltered case
     filter_form = TransactionFilterForm(request.GET or None, user=request.user)
-    personal_transactions_filtered = personal_transactions_all
-    group_transactions_filtered = group_transactions_all
+    selected_category = filter_form.cleaned_data.get('category') if filter_form.is_valid() else None
 
-    if filter_form.is_valid():
-        selected_category = filter_form.cleaned_data.get('category')
+    personal_page = data['personal_page']
+    personal_cursor = request.GET.get('personal_cursor')
+    if selected_category or personal_cursor:
+        personal_transactions = get_personal_transactions(request.user)
         if selected_category:
-            personal_transactions_filtered = personal_transactions_all.filter(category=selected_category)
-            if group_transactions_filtered:
-                group_transactions_filtered = group_transactions_all.filter(category=selected_category)
-
-    # 3. Prepare chart data (always unfiltered)
-    expense_by_category = (
-        Transaction.objects.filter(user=request.user, t_type='expense', group=None)
-        .values('category__name')
-        .annotate(total=Sum('amount'))
-        .order_by('-total')
-    )
-    chart_labels = [item['category__name'] or 'Uncategorized' for item in expense_by_category]
-    chart_data = [float(item['total']) for item in expense_by_category]
+            personal_transactions = personal_transactions.filter(category=selected_category)
+        personal_page = paginate_keyset(personal_transactions, personal_cursor)
+
+    # 3. Only the selected group's table is rendered; the others load when expanded
+    groups = data['groups']
+    expanded_group = next((group for group, summary in groups if str(group.pk) == request.GET.get('group_id')), None)
+    if expanded_group is None and groups:
+        expanded_group = groups[0][0]
+    group_page = _group_page(expanded_group, request.GET.get('group_cursor'), selected_category) \
+        if expanded_group else None
 
     context = {
         # Base data (unfiltered totals)
-        'personal_income': personal_income,
-        'personal_expense': personal_expense,
-        'personal_balance': personal_balance,
-        'group_income': group_income,
-        'group_expense': group_expense,
-        'group_balance': group_balance,
-        'group': group,
-        # Filtered transaction lists
-        'personal_transactions': personal_transactions_filtered,
-        'group_transactions': group_transactions_filtered,
+        'personal_summary': data['personal_summary'],
+        'groups': groups,
+        'expanded_group': expanded_group,
+        # Filtered, paginated transaction lists
+        'personal_page': personal_page,
+        'group_page': group_page,
         # Chart data
-        'chart_labels': json.dumps(chart_labels),
-        'chart_data': json.dumps(chart_data),
+        'chart_labels': json.dumps(data['chart_labels']),
+        'chart_data': json.dumps(data['chart_data']),
+        'chart_period': period,
+        'period_choices': PERIOD_CHOICES,
         # Form
         'filter_form': filter_form,
     }
-    return render(request, 'operation/dashboard.html', context)
+    response = render(request, 'operation/dashboard.html', context)
+    response['X-Dashboard-Cache'] = 'hit' if cache_hit else 'miss'
+    return response
 
 
 @login_required
-def add_transaction(request):
+def group_transactions(request, group_id):
     """
-    Handles the creation of a new financial transaction.
+    Renders the transaction table of one group, loaded when it is expanded on the dashboard.
     """
-    user_categories = Category.objects.filter(Q(user=request.user) | Q(user=None))
-    
-    categories_json = json.dumps({
-        cat.pk: {'name': cat.name, 'is_income': cat.is_income}
-        for cat in user_categories
+    if not request.memberships.is_member(group_id):
+        raise Http404("No group matches the given query.")
+    group = get_object_or_404(UserGroup, id=group_id)
+    filter_form = TransactionFilterForm(request.GET or None, user=request.user)
+    selected_category = filter_form.cleaned_data.get('category') if filter_form.is_valid() else None
+    return render(request, 'operation/_group_transactions.html', {
+        'group': group,
+        'group_page': _group_page(group, request.GET.get('group_cursor'), selected_category),
     })
 
+
+@login_required
+def add_transaction(request):
+    """
+    Handles the creation of a new financial transaction.
+    """
     if request.method == 'POST':
-        form = TransactionForm(request.POST, user=request.user)
+        form = TransactionForm(request.POST, user=request.user, memberships=request.memberships)
         if form.is_valid():
             transaction = form.save(commit=False)
             transaction.user = request.user
@@ -92,13 +147,41 @@ def add_transaction(request):
             transaction.save()
             return redirect('dashboard')
     else:
-        form = TransactionForm(user=request.user)
+        form = TransactionForm(user=request.user, memberships=request.memberships)
 
-    context = {
-        'form': form,
-        'categories_json': categories_json,
-    }
-    return render(request, 'operation/add_transaction.html', context)
+    return render(request, 'operation/add_transaction.html', {'form': form})
+
+
+@login_required
+def import_transactions(request):
+    """
+    Imports transactions from an uploaded CSV, Excel or bank statement file and reports rejected rows.
+    """
+    result = None
+    if request.method == 'POST':
+        form = TransactionImportForm(request.POST, request.FILES, memberships=request.memberships)
+        if form.is_valid():
+            uploaded = form.cleaned_data['file']
+            group = form.cleaned_data['group']
+            extension = uploaded.name.lower().rsplit('.', 1)[-1]
+            try:
+                if extension in ('ofx', 'qfx'):
+                    result = import_statement(request.user, iter_ofx_lines(uploaded), group=group)
+                elif extension == 'qif':
+                    result = import_statement(request.user, iter_qif_lines(uploaded), group=group)
+                else:
+                    rows = iter_xlsx_rows(uploaded) if extension == 'xlsx' else iter_csv_rows(uploaded)
+                    result = import_transactions_service(request.user, rows, group=group)
+            except ImportInterrupted as exc:
+                result = exc.result
+                form.add_error('file', f"The file could not be read to the end: {exc}. "
+                                       f"Transactions imported before the error were kept: {result.created}.")
+            except (ImportFormatError, UnicodeDecodeError, csv.Error, zipfile.BadZipFile) as exc:
+                form.add_error('file', f"The file could not be read: {exc}")
+    else:
+        form = TransactionImportForm(memberships=request.memberships)
+
+    return render(request, 'operation/import_transactions.html', {'form': form, 'result': result})
 
 
 @login_required
@@ -129,14 +212,113 @@ def add_category(request):
 
 
 @login_required
+def category_autocomplete(request):
+    """
+    Returns the categories of the user matching the `q` prefix or a typo of it, optionally of one `type`.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', AUTOCOMPLETE_LIMIT)), 1), AUTOCOMPLETE_MAX_LIMIT)
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    is_income = {'income': True, 'expense': False}.get(request.GET.get('type'))
+    entries = category_index(request.user).search(request.GET.get('q', ''), is_income=is_income, limit=limit)
+    return JsonResponse({'results': [
+        {'id': entry.pk, 'name': entry.name, 'is_income': entry.is_income, 'scope': entry.scope} for entry in entries
+    ]})
+
+
+@login_required
+def category_suggestions(request):
+    """
+    Returns the categories most likely for a new transaction with the `description`, `type` and `group` given.
+    """
+    group_id = request.GET.get('group')
+    group = UserGroup.objects.filter(pk=group_id).first() if request.memberships.is_member(group_id) else None
+    t_type = request.GET.get('type') if request.GET.get('type') in ('income', 'expense') else None
+    suggested = suggest_categories(request.user, request.GET.get('description', ''), group=group, t_type=t_type)
+    return JsonResponse({'results': [
+        {'id': entry.pk, 'name': entry.name, 'is_income': entry.is_income, 'confidence': round(probability, 3)}
+        for entry, probability in suggested
+    ]})
+
+
+@login_required
+@cost_throttled('export')
 def export_operation_to_excel(request):
     """
-    Triggers the export of the user's transactions to an Excel file.
-    (Placeholder function)
+    Starts a background export of the user's transactions to an Excel file.
+
+    If an export of the same data already exists it is downloaded directly.
+    Building a new export is charged by the number of rows it will contain.
+    """
+    job, created = request_export(request.user)
+    if created:
+        request.throttle_cost = rows_cost(job.rows_total)
+    if job.status == 'done':
+        return redirect('export_job_download', job_id=job.pk)
+    return redirect('export_job', job_id=job.pk)
+
+
+@login_required
+def export_job(request, job_id):
+    """
+    Displays the progress of an export job, or returns it as JSON with ?format=json.
+    """
+    job = get_object_or_404(ExportJob, pk=job_id, user=request.user)
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'status': job.status,
+            'progress': job.progress,
+            'rows_done': job.rows_done,
+            'rows_total': job.rows_total,
+            'download_url': reverse('export_job_download', args=[job.pk]) if job.status == 'done' else None,
+        })
+    return render(request, 'operation/export_job.html', {'job': job})
+
+
+@login_required
+def export_job_download(request, job_id):
+    """
+    Streams the file of a finished export job.
     """
-    # This function is currently a placeholder.
-    # The actual export logic is in finance.services.export_transactions
-    return export_transactions(request.user)
+    job = get_object_or_404(ExportJob, pk=job_id, user=request.user, status='done')
+    if not job.file:
+        raise Http404("Export file is missing.")
+    response = FileResponse(job.file.open('rb'), as_attachment=True, filename=EXPORT_FILENAME)
+    response.block_size = EXPORT_STREAM_BLOCK_SIZE
+    return response
+
+
+def _streaming_export(request, iterator, content_type, filename):
+    """
+    Validates export filters and streams the matching transactions, charged by the number of rows.
+    """
+    form = TransactionQueryForm(request.GET, user=request.user, memberships=request.memberships)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    transactions = filter_transactions(request.user, form.cleaned_data)
+    request.throttle_cost = rows_cost(transactions.count())
+    response = StreamingHttpResponse(iterator(transactions), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@login_required
+@cost_throttled('export')
+def export_csv(request):
+    """
+    Streams the user's transactions as CSV, filtered by date range, type, category and scope.
+    """
+    return _streaming_export(request, iter_transactions_csv, 'text/csv; charset=utf-8', 'transactions.csv')
+
+
+@login_required
+@cost_throttled('export')
+def export_ndjson(request):
+    """
+    Streams the user's transactions as newline-delimited JSON, filtered like export_csv.
+    """
+    return _streaming_export(request, iter_transactions_ndjson, 'application/x-ndjson', 'transactions.ndjson')
 
 
 @login_required
@@ -159,7 +341,8 @@ def join_group(request, group_id):
     """
     Allows a user to join a group directly via a URL.
     """
-    join_group_service(request.user, group_id)
+    if not request.memberships.is_member(group_id):
+        join_group_service(request.user, group_id)
     return redirect('dashboard')
 
 
@@ -180,8 +363,7 @@ def leave_group(request, group_id):
     """
     Handles a user leaving a group.
     """
-    success = leave_group_service(request.user, group_id)
-    if not success:
+    if not request.memberships.is_member(group_id) or not leave_group_service(request.user, group_id):
         return HttpResponse("You are not a member of this group.")
     return redirect('group_list')
 
@@ -191,9 +373,9 @@ def invite_to_group(request, group_id):
     """
     Allows a group admin to invite another user to the group.
     """
-    group = get_object_or_404(UserGroup, id=group_id)
-    if not UserGroupMember.objects.filter(user=request.user, group=group, role='admin').exists():
+    if not request.memberships.is_admin(group_id):
         return HttpResponseForbidden("Only admins can invite users.")
+    group = get_object_or_404(UserGroup, id=group_id)
 
     if request.method == 'POST':
         form = InvitationForm(request.POST, group=group)
@@ -249,14 +431,13 @@ def reject_invitation(request, invitation_id):
 @login_required
 def group_members(request, group_id):
     """
-    Displays the list of members for a specific group.
+    Displays the members of a group a page at a time, with each member's totals in the group for admins.
     """
-    group = get_object_or_404(UserGroup, id=group_id)
-    if not UserGroupMember.objects.filter(user=request.user, group=group).exists():
+    if not request.memberships.is_member(group_id):
         return HttpResponseForbidden("You do not have access to this group.")
+    group = get_object_or_404(UserGroup, id=group_id)
 
-    members = UserGroupMember.objects.filter(group=group).order_by('role', 'joined_at')
-    is_admin = UserGroupMember.objects.filter(user=request.user, group=group, role='admin').exists()
+    is_admin = request.memberships.is_admin(group_id)
 
     if request.method == 'POST':
         if not is_admin:
@@ -265,23 +446,30 @@ def group_members(request, group_id):
         member_to_kick = get_object_or_404(UserGroupMember, id=member_id, group=group)
         if member_to_kick.role == 'admin':
             return HttpResponse("Admins cannot be removed.")
-        if member_to_kick.user == request.user:
+        if member_to_kick.user_id == request.user.pk:
             return HttpResponse("You cannot remove yourself. Use the 'Leave Group' option.")
         member_to_kick.delete()
         return redirect('group_members', group_id=group_id)
 
+    sort = request.GET.get('sort')
+    if sort not in MEMBER_SORTS or (sort in MEMBER_STAT_SORTS and not is_admin):
+        sort = 'role'
+    members = Paginator(get_group_members(group, sort), MEMBERS_PAGE_SIZE).get_page(request.GET.get('page'))
     return render(request, 'group/group_members.html', {
         'group': group,
         'members': members,
-        'is_admin': is_admin
+        'is_admin': is_admin,
+        'sort': sort,
     })
 
 
 @login_required
+@user_data_condition
 def income_list(request):
     """
     Displays a list of the user's income transactions and their sum.
     """
-    incomes = Transaction.objects.filter(user=request.user, t_type='income').order_by('-date')
-    total_income = incomes.aggregate(total=Sum('amount'))['total'] or 0
-    return render(request, 'operation/income_list.html', {'incomes': incomes, 'total_income': total_income})
+    incomes = Transaction.objects.filter(user=request.user, t_type='income').select_related('category')
+    summary = summarize_transactions(incomes)
+    page = paginate_keyset(incomes, request.GET.get('cursor'))
+    return render(request, 'operation/income_list.html', {'page': page, 'total_income': summary.income})
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+from datetime import timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -53,6 +54,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'finance.memberships.MembershipMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -91,6 +93,46 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default, which is only correct for a single worker process: cached data is
+# invalidated through versions stored in this cache. With WEB_CONCURRENCY > 1 the system check
+# finance.E001 requires a shared backend, e.g. CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# and CACHE_LOCATION=/path/to/dir, or django.core.cache.backends.redis.RedisCache.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'frognance'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000')),
+        },
+    },
+    # Throttle buckets and usage counters; kept in process memory so throttling never waits on a network cache
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'frognance-throttle',
+    },
+}
+
+# Number of worker processes serving requests (also read by gunicorn)
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+# Seconds a cached dashboard stays valid if none of its data versions change
+DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', '600'))
+
+# Threads per process that build Excel exports in the background
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '2'))
+
+# Seconds after which an unfinished export job is considered lost (e.g. its worker was restarted) and is rebuilt
+EXPORT_JOB_TIMEOUT = int(os.getenv('EXPORT_JOB_TIMEOUT', '1800'))
+
+# API tokens expire this many days after they are issued (0 disables expiry); rotate them via /api/token/rotate/
+AUTH_TOKEN_TTL = timedelta(days=int(os.getenv('AUTH_TOKEN_TTL_DAYS', '30'))) or None
+
+# Seconds a resolved API token is cached; bounds how long a revoked token can be served by another process
+AUTH_TOKEN_CACHE_TIMEOUT = int(os.getenv('AUTH_TOKEN_CACHE_TIMEOUT', '300'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -145,9 +187,14 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'finance.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Cost units per period (see finance.throttling): a request costs 1 plus 1 per 100 rows returned or exported
+    'DEFAULT_THROTTLE_RATES': {
+        'api': os.getenv('THROTTLE_RATE_API', '1200/min'),
+        'export': os.getenv('THROTTLE_RATE_EXPORT', '5000/hour'),
+    },
     'PAGE_SIZE': 10,
 }
 # лого
@@ -7,9 +7,12 @@ from django.contrib import admin
 from django.urls import path, include
 
 from accounts.views import home
-from finance.api_views import IncomeListAPI
+from finance.admin import throttle_usage
+from finance.api_views import IncomeListAPI, BalanceAPI, TransactionListAPI, TransactionBatchAPI, \
+    SyncAPI, SummaryAPI, TokenRotateAPI
 
 urlpatterns = [
+    path('admin/throttle-usage/', admin.site.admin_view(throttle_usage), name='admin_throttle_usage'),
     path('admin/', admin.site.urls),
     path('', home, name='home'),
     path('', include('accounts.urls')),
@@ -17,6 +20,12 @@ urlpatterns = [
     
     # API routes
     path('api/income/', IncomeListAPI.as_view(), name='api_income_list'),
+    path('api/balance/', BalanceAPI.as_view(), name='api_balance'),
+    path('api/transactions/', TransactionListAPI.as_view(), name='api_transactions'),
+    path('api/transactions/batch/', TransactionBatchAPI.as_view(), name='api_transactions_batch'),
+    path('api/summary/', SummaryAPI.as_view(), name='api_summary'),
+    path('api/sync/', SyncAPI.as_view(), name='api_sync'),
+    path('api/token/rotate/', TokenRotateAPI.as_view(), name='api_token_rotate'),
 ]
 
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)